@@ -0,0 +1,295 @@
+"""Stage by stage benchmark of the QH readers on a synthetic dataset.
+
+    python -m interq_cip_qhs.benchmark --parts 10 --acc-rows 200000
+
+Every process class is run through its stages (read, segment, features,
+document, publish) and the wall time and peak traced memory of each stage
+are reported. Documents are published to a local stand-in of the QH endpoint.
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+from interq_cip_qhs.synthetic import generate_dataset
+from interq_cip_qhs.process.hdf5 import LazySignalFile, close_part_files
+from interq_cip_qhs.process.feature_store import FeatureStore
+from interq_cip_qhs.process.milling import MillingProcessData
+from interq_cip_qhs.process.sawing import SawingProcessData
+from interq_cip_qhs.process.turning import TurningProcessData
+from interq_cip_qhs.product.milling import MillingProductData
+from interq_cip_qhs.product.sawing import SawingProductData
+from interq_cip_qhs.product.turning import TurningProductData
+from interq_cip_qhs.publisher import QHPublisher
+
+
+class QHStandInHandler(BaseHTTPRequestHandler):
+    """Accepts QH documents like the QH endpoint and answers with a new uuid."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        body = json.dumps({"uuid": uuid.uuid4().hex}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_qh_server():
+    """Serves QHStandInHandler on a free local port, returns the server and its QH url."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), QHStandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/interq/tf/v1.0/qhs" % server.server_address[1]
+
+
+class StageTimer:
+    """Collects the wall time and peak traced memory of benchmark stages."""
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.rows = []
+
+    def run(self, process_class, stage, n_parts, function):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            result = function()
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] / 1024**2
+                tracemalloc.stop()
+        self.rows.append(
+            {
+                "process_class": process_class,
+                "stage": stage,
+                "parts": n_parts,
+                "seconds": seconds,
+                "peak_mb": peak,
+            }
+        )
+        return result
+
+    def publish(self, process_class, documents, api_endpoint):
+        def post_all():
+            publisher = QHPublisher(api_endpoint)
+            for id, response, error in publisher.post_many(
+                (id, document, None) for id, document in documents.items()
+            ):
+                if error is not None:
+                    raise error
+
+        self.run(process_class, "publish", len(documents), post_all)
+
+
+def benchmark_milling_process(timer, dataset, feature_backend, api_endpoint):
+    reader = MillingProcessData(feature_backend, path_data=dataset["root"])
+    reader._feature_store = FeatureStore(None)
+    ids = dataset["milling_ids"]
+    paths = [reader._part_id_paths[id] for id in ids]
+    signals = ["acc", "bfc"]
+
+    def read():
+        for path in paths:
+            for side in ["side_1", "side_2"]:
+                for signal in signals:
+                    ts_path, signal_path = reader.get_side_files(path, side, signal)
+                    reader.read_timestamp_process_pairs(ts_path)
+                    with LazySignalFile(signal_path) as signal_file:
+                        signal_file.data[:]
+
+    def segment():
+        reader._part_cache.clear()
+        return {
+            (path, signal): reader.read_raw_segments(path, signal)
+            for path in paths
+            for signal in signals
+        }
+
+    def document():
+        reader._part_cache.clear()
+        return {id: reader.get_process_QH_id(id) for id in ids}
+
+    timer.run("milling_process", "read", len(ids), read)
+    segments = timer.run("milling_process", "segment", len(ids), segment)
+    timer.run(
+        "milling_process",
+        "features",
+        len(ids),
+        lambda: [
+            reader.extract_signal_features(data, index, signal)
+            for (path, signal), (data, index) in segments.items()
+        ],
+    )
+    del segments
+    documents = timer.run("milling_process", "document", len(ids), document)
+    timer.publish("milling_process", documents, api_endpoint)
+
+
+def benchmark_part_file_process(timer, process_class, reader, ids, api_endpoint):
+    reader._feature_store = FeatureStore(None)
+
+    def document():
+        reader._part_cache.clear()
+        return {id: reader.get_process_QH_id(id) for id in ids}
+
+    timer.run(
+        process_class, "read", len(ids), lambda: [reader._part_file.read(id) for id in ids]
+    )
+    frames = timer.run(
+        process_class, "segment", len(ids), lambda: [reader.load_raw_from_id(id) for id in ids]
+    )
+    timer.run(
+        process_class,
+        "features",
+        len(ids),
+        lambda: [reader.extract_features(data) for data in frames],
+    )
+    del frames
+    documents = timer.run(process_class, "document", len(ids), document)
+    timer.publish(process_class, documents, api_endpoint)
+
+
+def benchmark_product(timer, process_class, product_class, path_csv, api_endpoint):
+    reader = timer.run(process_class, "read", 0, lambda: product_class(path_csv))
+    ids = list(reader.quality_data.index)
+    timer.rows[-1]["parts"] = len(ids)
+    documents = timer.run(
+        process_class,
+        "document",
+        len(ids),
+        lambda: {id: reader.get_product_QH_id(id) for id in ids},
+    )
+    timer.publish(process_class, documents, api_endpoint)
+
+
+def benchmark_sawing_process(timer, dataset, feature_backend, api_endpoint):
+    reader = SawingProcessData(dataset["root"], feature_backend)
+    benchmark_part_file_process(
+        timer, "sawing_process", reader, dataset["sawing_ids"], api_endpoint
+    )
+
+
+def benchmark_turning_process(timer, dataset, feature_backend, api_endpoint):
+    reader = TurningProcessData(dataset["root"], feature_backend)
+    benchmark_part_file_process(
+        timer, "turning_process", reader, dataset["turning_ids"], api_endpoint
+    )
+
+
+def benchmark_milling_product(timer, dataset, feature_backend, api_endpoint):
+    benchmark_product(
+        timer, "milling_product", MillingProductData, dataset["milling_quality_data"], api_endpoint
+    )
+
+
+def benchmark_sawing_product(timer, dataset, feature_backend, api_endpoint):
+    benchmark_product(
+        timer, "sawing_product", SawingProductData, dataset["sawing_quality_data"], api_endpoint
+    )
+
+
+def benchmark_turning_product(timer, dataset, feature_backend, api_endpoint):
+    benchmark_product(
+        timer, "turning_product", TurningProductData, dataset["turning_quality_data"], api_endpoint
+    )
+
+
+BENCHMARKS = {
+    "milling_process": benchmark_milling_process,
+    "sawing_process": benchmark_sawing_process,
+    "turning_process": benchmark_turning_process,
+    "milling_product": benchmark_milling_product,
+    "sawing_product": benchmark_sawing_product,
+    "turning_product": benchmark_turning_product,
+}
+PROCESS_CLASSES = list(BENCHMARKS)
+
+
+def run_benchmark(
+    root=None,
+    n_parts=10,
+    acc_rows=200000,
+    n_samples=200,
+    feature_backend=None,
+    process_classes=None,
+    trace_memory=True,
+):
+    """Generates a synthetic dataset in root (a temporary directory if None) and
+    benchmarks the given process_classes (default all) on it.
+
+    Returns one row per process class and stage with its wall time, time per
+    part and peak traced memory in MB (None without trace_memory).
+    """
+    if root is None:
+        with tempfile.TemporaryDirectory() as root:
+            return run_benchmark(
+                root, n_parts, acc_rows, n_samples, feature_backend, process_classes, trace_memory
+            )
+    process_classes = PROCESS_CLASSES if process_classes is None else process_classes
+    for process_class in process_classes:
+        if process_class not in BENCHMARKS:
+            raise ValueError(
+                "Unknown process class: "
+                + str(process_class)
+                + ", expected one of "
+                + str(PROCESS_CLASSES)
+            )
+    # the readers keep their part files open, which would block rewriting them
+    close_part_files()
+    dataset = generate_dataset(root, n_parts, acc_rows=acc_rows, n_samples=n_samples)
+    timer = StageTimer(trace_memory)
+    server, api_endpoint = start_qh_server()
+    try:
+        for process_class in process_classes:
+            BENCHMARKS[process_class](timer, dataset, feature_backend, api_endpoint)
+    finally:
+        server.shutdown()
+        server.server_close()
+        close_part_files()
+    results = pd.DataFrame(timer.rows)
+    results.insert(4, "ms_per_part", results.seconds * 1e3 / results.parts.clip(lower=1))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", help="dataset directory, a temporary one by default")
+    parser.add_argument("--parts", type=int, default=10, help="parts per process class")
+    parser.add_argument("--acc-rows", type=int, default=200000, help="acc samples per milling side")
+    parser.add_argument("--samples", type=int, default=200, help="samples per sawing/turning part")
+    parser.add_argument("--backend", help="feature backend, from the config by default")
+    parser.add_argument("--classes", nargs="+", choices=PROCESS_CLASSES, help="process classes to run")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracing the peak memory")
+    parser.add_argument("--output", help="also write the results to this csv file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(
+        args.root,
+        args.parts,
+        args.acc_rows,
+        args.samples,
+        args.backend,
+        args.classes,
+        not args.no_memory,
+    )
+    print(results.to_string(index=False, float_format=lambda value: "%.3f" % value))
+    if args.output:
+        results.to_csv(args.output, index=False)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""Publishes the QH documents of the whole plant as one job graph.
+
+    interq-qhs --workers 8 --process-data /data/cip --milling-quality q_milling.csv
+
+Every process class gets a job that brings its dataset manifest up to date
+and then one that publishes its process hallmarks, every product class a job
+that publishes its product hallmarks. Jobs start as soon as the jobs they
+come after are done and their worker processes fit into the worker budget.
+The process classes split the budget, in proportion to the bytes of their
+datasets for publishing. Product jobs only wait on the QH endpoint and take
+no workers, so they run alongside the CPU-bound feature extraction of the
+process jobs. Worker processes are spawned (see batch.run_parts), none of
+them inherits the locks or connections of the job threads.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from interq_cip_qhs.process.milling import MillingProcessData
+from interq_cip_qhs.process.sawing import SawingProcessData
+from interq_cip_qhs.process.turning import TurningProcessData
+from interq_cip_qhs.product.milling import MillingProductData
+from interq_cip_qhs.product.sawing import SawingProductData
+from interq_cip_qhs.product.turning import TurningProductData
+from interq_cip_qhs.instrumentation import get_instrumentation
+from interq_cip_qhs.config import Config
+
+config = Config()
+instrumentation = get_instrumentation()
+
+PROCESS_CLASSES = [
+    "milling_process",
+    "sawing_process",
+    "turning_process",
+    "milling_product",
+    "sawing_product",
+    "turning_product",
+]
+# the path every process class reads its data from
+DATA_PATHS = {
+    "milling_process": "dataset",
+    "sawing_process": "process_data",
+    "turning_process": "process_data",
+    "milling_product": "milling_quality_data",
+    "sawing_product": "sawing_quality_data",
+    "turning_product": "turning_quality_data",
+}
+
+
+class Job:
+    """A named step of the pipeline, run(n_workers) with up to n_workers worker
+    processes once all jobs named in after are done. n_workers may be a
+    function, called once the job is ready to start."""
+
+    def __init__(self, name, run, n_workers=0, after=()):
+        self.name = name
+        self.run = run
+        self.n_workers = n_workers
+        self.after = list(after)
+
+
+def get_config_paths():
+    # DATASET_PATH is the notebooks' example data, the pipeline only reads a given dataset
+    return {
+        "dataset": None,
+        "process_data": config.PROCESS_DATA_PATH,
+        "milling_quality_data": config.MILLING_QUALITY_DATA_PATH,
+        "sawing_quality_data": config.SAWING_QUALITY_DATA_PATH,
+        "turning_quality_data": config.TURNING_QUALITY_DATA_PATH,
+    }
+
+
+def get_worker_shares(sizes, n_workers):
+    """Splits n_workers over the keys of sizes in proportion to their sizes,
+    at least one worker each."""
+    if not sizes:
+        return {}
+    total = sum(sizes.values())
+    if total == 0:
+        sizes, total = {key: 1 for key in sizes}, len(sizes)
+    quotas = {key: n_workers * size / total for key, size in sizes.items()}
+    shares = {key: max(int(quota), 1) for key, quota in quotas.items()}
+    # the workers left go to the largest remainders, the minimum of one is
+    # taken back from the largest shares
+    remainders = sorted(quotas, key=lambda key: int(quotas[key]) - quotas[key])
+    for key in remainders[: max(n_workers - sum(shares.values()), 0)]:
+        shares[key] += 1
+    while sum(shares.values()) > max(n_workers, len(shares)):
+        shares[max(shares, key=shares.get)] -= 1
+    return shares
+
+
+def get_reader(process_class, paths, feature_backend=None, dq_backend=None, api_endpoint=None):
+    path = paths[DATA_PATHS[process_class]]
+    if process_class == "milling_process":
+        reader = MillingProcessData(feature_backend, dq_backend, path_data=path)
+    elif process_class == "sawing_process":
+        reader = SawingProcessData(path, feature_backend, dq_backend)
+    elif process_class == "turning_process":
+        reader = TurningProcessData(path, feature_backend, dq_backend)
+    elif process_class == "milling_product":
+        reader = MillingProductData(path)
+    elif process_class == "sawing_product":
+        reader = SawingProductData(path)
+    elif process_class == "turning_product":
+        reader = TurningProductData(path)
+    else:
+        raise ValueError(
+            "Unknown process class: "
+            + str(process_class)
+            + ", expected one of "
+            + str(PROCESS_CLASSES)
+        )
+    if api_endpoint is not None:
+        reader.api_endpoint = api_endpoint
+    return reader
+
+
+def build_jobs(
+    paths,
+    process_classes=None,
+    n_workers=None,
+    feature_backend=None,
+    dq_backend=None,
+    api_endpoint=None,
+):
+    """Jobs of process_classes (default all with a data path in paths).
+
+    Every job builds its own reader, sqlite connections can't be shared
+    between the job threads.
+    """
+    n_workers = config.N_WORKERS if n_workers is None else n_workers
+    if process_classes is None:
+        process_classes = [
+            process_class
+            for process_class in PROCESS_CLASSES
+            if paths.get(DATA_PATHS[process_class]) is not None
+        ]
+
+    def reader(process_class):
+        return get_reader(process_class, paths, feature_backend, dq_backend, api_endpoint)
+
+    processes = [
+        process_class for process_class in process_classes if process_class.endswith("_process")
+    ]
+
+    def publish_workers(process_class):
+        # the manifests as indexed so far, a class still being indexed counts with its last run
+        sizes = {
+            name: reader(name)._manifest.get_nbytes(name)
+            for name in processes
+            if paths.get(DATA_PATHS[name]) is not None
+        }
+        return get_worker_shares(sizes, n_workers)[process_class]
+
+    index_workers = get_worker_shares({name: 1 for name in processes}, n_workers)
+    jobs = []
+    for process_class in process_classes:
+        if process_class not in DATA_PATHS:
+            raise ValueError(
+                "Unknown process class: "
+                + str(process_class)
+                + ", expected one of "
+                + str(PROCESS_CLASSES)
+            )
+        path = paths.get(DATA_PATHS[process_class])
+        if path is None:
+            raise ValueError(
+                "Missing path: " + DATA_PATHS[process_class] + " for " + process_class
+            )
+        if not os.path.exists(path):
+            raise ValueError(
+                "Path not found: "
+                + str(path)
+                + " ("
+                + DATA_PATHS[process_class]
+                + ") for "
+                + process_class
+            )
+        if process_class.endswith("_process"):
+            jobs.append(
+                Job(
+                    process_class + ":index",
+                    lambda workers, process_class=process_class: reader(
+                        process_class
+                    ).update_manifest(n_workers=workers),
+                    index_workers[process_class],
+                )
+            )
+            jobs.append(
+                Job(
+                    process_class + ":publish",
+                    lambda workers, process_class=process_class: reader(
+                        process_class
+                    ).publish_all_process_and_data_qh(workers),
+                    lambda process_class=process_class: publish_workers(process_class),
+                    after=[process_class + ":index"],
+                )
+            )
+        else:
+            jobs.append(
+                Job(
+                    process_class + ":publish",
+                    lambda workers, process_class=process_class: reader(
+                        process_class
+                    ).publish_all_product_qh(),
+                )
+            )
+    return jobs
+
+
+def run_jobs(jobs, n_workers=None):
+    """Runs the jobs in threads, each as soon as the jobs it comes after are
+    done and its workers fit into n_workers.
+
+    A job wanting more workers than n_workers gets n_workers. Jobs after a
+    failed job are skipped. Returns {name: (status, seconds, error)} in the
+    order the jobs finished.
+    """
+    n_workers = max(config.N_WORKERS if n_workers is None else n_workers, 1)
+    names = {job.name for job in jobs}
+    for job in jobs:
+        for name in job.after:
+            if name not in names:
+                raise ValueError("Unknown job: " + name + " before " + job.name)
+
+    results, pending, running = {}, list(jobs), {}
+    free = n_workers
+
+    with ThreadPoolExecutor(max_workers=max(len(jobs), 1)) as executor:
+        while pending or running:
+            for job in list(pending):
+                if any(name in results and results[name][0] != "done" for name in job.after):
+                    pending.remove(job)
+                    results[job.name] = ("skipped", 0.0, None)
+                    continue
+                if not all(name in results for name in job.after):
+                    continue
+                workers = job.n_workers() if callable(job.n_workers) else job.n_workers
+                workers = min(workers, n_workers)
+                if workers > free:
+                    continue
+                pending.remove(job)
+                free -= workers
+                instrumentation.log("starting " + job.name + " with " + str(workers) + " workers")
+                running[executor.submit(job.run, workers)] = (job, workers, time.perf_counter())
+            if not running:
+                # the jobs left wait on each other
+                for job in pending:
+                    results[job.name] = ("skipped", 0.0, None)
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, workers, start = running.pop(future)
+                free += workers
+                seconds = time.perf_counter() - start
+                try:
+                    future.result()
+                    results[job.name] = ("done", seconds, None)
+                except Exception as error:
+                    results[job.name] = ("failed", seconds, error)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    paths = get_config_paths()
+    parser.add_argument("--dataset", default=paths["dataset"], help="milling dataset root, milling jobs only run with it")
+    parser.add_argument(
+        "--process-data", default=paths["process_data"], help="folder of the sawing and turning .h5 files"
+    )
+    for name in ["milling", "sawing", "turning"]:
+        parser.add_argument(
+            "--" + name + "-quality",
+            default=paths[name + "_quality_data"],
+            help=name + " quality data csv",
+        )
+    parser.add_argument("--classes", nargs="+", choices=PROCESS_CLASSES, help="process classes to run, all with a path by default")
+    parser.add_argument("--workers", type=int, default=config.N_WORKERS, help="worker processes shared by all jobs")
+    parser.add_argument("--feature-backend", help="feature backend, from the config by default")
+    parser.add_argument("--dq-backend", choices=["container", "local"], help="data quality backend, from the config by default")
+    parser.add_argument("--api-endpoint", help="QH endpoint, the readers' own by default")
+    parser.add_argument("--metrics-jsonl", help="append stage timings and counts to this JSON lines file")
+    parser.add_argument("--metrics-prometheus", help="write the totals to this Prometheus textfile")
+    parser.add_argument("--quiet", action="store_true", help="drop the per-document output")
+    parser.add_argument("--dry-run", action="store_true", help="only list the jobs")
+    args = parser.parse_args(argv)
+
+    instrumentation.configure(
+        args.metrics_jsonl, args.metrics_prometheus, True if args.quiet else None
+    )
+    try:
+        jobs = build_jobs(
+            {
+                "dataset": args.dataset,
+                "process_data": args.process_data,
+                "milling_quality_data": args.milling_quality,
+                "sawing_quality_data": args.sawing_quality,
+                "turning_quality_data": args.turning_quality,
+            },
+            args.classes,
+            args.workers,
+            args.feature_backend,
+            args.dq_backend,
+            args.api_endpoint,
+        )
+    except ValueError as error:
+        parser.error(str(error))
+
+    if args.dry_run:
+        for job in jobs:
+            workers = job.n_workers() if callable(job.n_workers) else job.n_workers
+            print(job.name, "workers:", min(workers, max(args.workers, 1)), "after:", job.after)
+        return 0
+    results = run_jobs(jobs, args.workers)
+    instrumentation.flush()
+    for name, (status, seconds, error) in results.items():
+        print("%-24s %-8s %8.1f s" % (name, status, seconds) + ("  " + str(error) if error else ""))
+    return 0 if all(status == "done" for status, _, _ in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
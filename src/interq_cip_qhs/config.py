@@ -1,6 +1,58 @@
+import os
+
+
 class Config:
     def __init__(self):
         self.DATASET_PATH = "/Users/nicolasjourdan/projects/temp/interq_cip_qhs/src/interq_cip_qhs/notebooks/example_data/"
+        # folder of sawing_process_data.h5 and turning_process_data.h5 and the quality
+        # data csvs (with measurement timestamps) for the pipeline, None skips their jobs
+        self.PROCESS_DATA_PATH = None
+        self.MILLING_QUALITY_DATA_PATH = None
+        self.SAWING_QUALITY_DATA_PATH = None
+        self.TURNING_QUALITY_DATA_PATH = None
         self.cid = "2WwhkHtuCLBXdnv3M9BN5jGE2wToKuiQmZ6YRwH8BeKb"
         self.pwd = "interq"
         self.model = "demo_process_milling_data_12"
+        # "numpy" computes the minimal feature set natively, "tsfresh" delegates to tsfresh
+        self.FEATURE_BACKEND = "numpy"
+        # chunk cache per opened HDF5 signal file, in bytes
+        self.H5_CHUNK_CACHE_BYTES = 16 * 1024 * 1024
+        # upper bound for the parsed part data kept in memory per reader, in bytes
+        self.PART_CACHE_BYTES = 1024 * 1024 * 1024
+        # persistent store of computed features, None disables it
+        self.FEATURE_STORE_PATH = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "tmp_files", "feature_store.sqlite"
+        )
+        self.FEATURE_STORE_MAX_BYTES = 512 * 1024 * 1024
+        # rows per process and signal kept for the approximate median of streamed parts
+        self.STREAM_MEDIAN_SAMPLES = 4096
+        # upper bound for the raw part data combined into one feature extraction call, in bytes
+        self.FEATURE_BATCH_BYTES = 256 * 1024 * 1024
+        # worker processes for the bulk publishers, 1 runs them in the calling process
+        self.N_WORKERS = 1
+        # concurrent in-flight posts per QH endpoint, shared by all readers and jobs
+        self.QH_MAX_IN_FLIGHT = 8
+        # failed posts are retried with exponential backoff starting at QH_BACKOFF_SECONDS
+        self.QH_MAX_RETRIES = 5
+        self.QH_BACKOFF_SECONDS = 0.5
+        self.QH_TIMEOUT_SECONDS = 60
+        # record of posted QH documents, bulk runs resume from it and skip the subjects
+        # an endpoint URL acknowledged before, even if its database was reset since;
+        # None disables it
+        self.OUTBOX_PATH = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "tmp_files", "outbox.sqlite"
+        )
+        # rebuilds the documents of acknowledged subjects and reports the changed ones
+        self.OUTBOX_VERIFY = False
+        # documents the endpoint rejected this often are reported as errors instead of posted again
+        self.OUTBOX_MAX_ATTEMPTS = 3
+        # catalog of the parts of a dataset, stored next to the data under this name;
+        # None keeps it in memory and lists the data on every start
+        self.MANIFEST_FILE_NAME = "interq_manifest.sqlite"
+        # "container" runs the data quality rules in the DQaaS container, "local" in process
+        self.DQ_BACKEND = "container"
+        # stage timings and event counts as JSON lines and as a Prometheus textfile, None disables them
+        self.METRICS_JSONL_PATH = None
+        self.METRICS_PROMETHEUS_PATH = None
+        # drops the per-document console output of the publishers
+        self.QUIET = False
@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from interq_cip_qhs.config import Config
+
+config = Config()
+
+
+class Instrumentation:
+    """Timers and counters of the QH pipeline, tagged by process class and part id.
+
+    Every timed stage (read, segment, extract, document, dq, publish) and every
+    counted event adds to running totals per name and process class. With a
+    jsonl_path each of them is also appended to that file as one JSON line,
+    with its part id. The totals can be written as a Prometheus textfile. In
+    quiet mode log and log_json drop the per-document console output.
+
+    Worker processes keep their own totals, their lines still go to the
+    jsonl file of the configuration they were started with.
+    """
+
+    def __init__(self, jsonl_path=None, prometheus_path=None, quiet=False):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.quiet = quiet
+        # (stage, process_class) -> [count, seconds]
+        self.timers = {}
+        # (name, process_class) -> value
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._jsonl_file = None
+
+    def configure(self, jsonl_path=None, prometheus_path=None, quiet=None):
+        """Sets the given export paths and quiet mode, None keeps a setting."""
+        with self._lock:
+            if jsonl_path is not None and jsonl_path != self.jsonl_path:
+                self.close_jsonl()
+                self.jsonl_path = jsonl_path
+            if prometheus_path is not None:
+                self.prometheus_path = prometheus_path
+            if quiet is not None:
+                self.quiet = quiet
+
+    def _after_fork(self):
+        # a fork while another thread holds the lock would leave it held in the
+        # child, and the child appends to the jsonl file through its own handle
+        self._lock = threading.Lock()
+        self._jsonl_file = None
+
+    def close_jsonl(self):
+        if self._jsonl_file is not None:
+            self._jsonl_file.close()
+            self._jsonl_file = None
+
+    def _write_line(self, record):
+        # called with the lock held
+        if self.jsonl_path is None:
+            return
+        if self._jsonl_file is None:
+            directory = os.path.dirname(os.path.abspath(self.jsonl_path))
+            os.makedirs(directory, exist_ok=True)
+            # line buffered, so every record is one append even from several processes
+            self._jsonl_file = open(self.jsonl_path, "a", buffering=1)
+        self._jsonl_file.write(json.dumps(record, default=str) + "\n")
+
+    def add_time(self, stage, process_class, seconds, part_id=None):
+        with self._lock:
+            totals = self.timers.setdefault((stage, process_class), [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            self._write_line(
+                {
+                    "time": time.time(),
+                    "type": "timer",
+                    "name": stage,
+                    "process_class": process_class,
+                    "part_id": part_id,
+                    "seconds": seconds,
+                }
+            )
+
+    @contextmanager
+    def timer(self, stage, process_class, part_id=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, process_class, time.perf_counter() - start, part_id)
+
+    def count(self, name, process_class, value=1, part_id=None):
+        with self._lock:
+            self.counters[(name, process_class)] = (
+                self.counters.get((name, process_class), 0) + value
+            )
+            self._write_line(
+                {
+                    "time": time.time(),
+                    "type": "counter",
+                    "name": name,
+                    "process_class": process_class,
+                    "part_id": part_id,
+                    "value": value,
+                }
+            )
+
+    def log(self, *args):
+        if not self.quiet:
+            print(*args)
+
+    def log_json(self, obj):
+        if not self.quiet:
+            print(json.dumps(obj, sort_keys=True, indent=4))
+
+    def get_summary(self):
+        """One row per timer and counter with its count, total and mean seconds or value."""
+        with self._lock:
+            rows = [
+                {
+                    "type": "timer",
+                    "name": stage,
+                    "process_class": process_class,
+                    "count": count,
+                    "seconds": seconds,
+                    "mean_seconds": seconds / count,
+                }
+                for (stage, process_class), (count, seconds) in sorted(self.timers.items())
+            ]
+            rows.extend(
+                {
+                    "type": "counter",
+                    "name": name,
+                    "process_class": process_class,
+                    "value": value,
+                }
+                for (name, process_class), value in sorted(self.counters.items())
+            )
+        return rows
+
+    def format_prometheus(self):
+        def labels(**values):
+            return ",".join(
+                key + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+                for key, value in values.items()
+            )
+
+        with self._lock:
+            lines = [
+                "# HELP interq_qhs_stage_seconds Time spent in the QH pipeline stages.",
+                "# TYPE interq_qhs_stage_seconds summary",
+            ]
+            for (stage, process_class), (count, seconds) in sorted(self.timers.items()):
+                tags = labels(process_class=process_class, stage=stage)
+                lines.append("interq_qhs_stage_seconds_sum{" + tags + "} " + repr(seconds))
+                lines.append("interq_qhs_stage_seconds_count{" + tags + "} " + str(count))
+            lines.extend(
+                [
+                    "# HELP interq_qhs_events_total Events counted in the QH pipeline.",
+                    "# TYPE interq_qhs_events_total counter",
+                ]
+            )
+            for (name, process_class), value in sorted(self.counters.items()):
+                tags = labels(process_class=process_class, event=name)
+                lines.append("interq_qhs_events_total{" + tags + "} " + str(value))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=None):
+        """Writes the totals to a Prometheus textfile, replaced atomically for the collector."""
+        path = self.prometheus_path if path is None else path
+        if path is None:
+            return
+        # one tmp file per writer, jobs of the pipeline flush concurrently
+        tmp_path = path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.format_prometheus())
+        os.replace(tmp_path, path)
+
+    def flush(self):
+        """Writes the Prometheus textfile if one is configured, the jsonl file is written as it goes."""
+        self.write_prometheus()
+
+
+_instrumentation = Instrumentation(
+    config.METRICS_JSONL_PATH, config.METRICS_PROMETHEUS_PATH, config.QUIET
+)
+os.register_at_fork(after_in_child=_instrumentation._after_fork)
+
+
+def get_instrumentation():
+    """Returns the instrumentation shared by all readers of this process."""
+    return _instrumentation
@@ -34,9 +34,8 @@ with open(labels_path, 'r') as f:
             anomal_1_keys.append(int(row[0]))
 
 reader = MillingProcessData()
-keys = list(map(int, reader._part_id_paths.keys()))
-keys.sort()
-keys = np.array(keys)
+# sorted by part id in the dataset manifest
+keys = np.array(list(map(int, reader.get_part_ids())))
 
 keys_normal = []
 for key in keys:
@@ -48,26 +47,15 @@ keys_anomal = anomal_1_keys[:10]
 keys_normal = keys_normal[:45]
 
 new_ids = []
-initialized = False
 
-# generate features
+# generate features, extracted for all parts of a group at once
 def generate_features(keys):
-    global initialized, new_ids
-    all_features = []
-    for key in keys:
-        feat = reader.get_process_acc_features(str(key))
-        cols = feat.columns.to_list()
-        rows = feat.index.to_list()
-        features_flat = []
-        if initialized == False:
-            for col in cols:
-                for row in rows:
-                    new_ids.append((col, row, col + "_" + row))
-            initialized = True
-        for new_id in new_ids:
-            features_flat.append(feat[new_id[0]][new_id[1]])
-        all_features.append(features_flat)
-    return np.array(all_features)
+    global new_ids
+    features = reader.get_process_features_batch([str(key) for key in keys])
+    if not new_ids:
+        for process, feature in features.columns:
+            new_ids.append((feature, process, feature + "_" + process))
+    return features[[(new_id[1], new_id[0]) for new_id in new_ids]].to_numpy()
 
 features_normal = generate_features(keys_normal)
 features_anomal = generate_features(keys_anomal)
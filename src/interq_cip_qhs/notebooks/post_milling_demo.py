@@ -19,14 +19,11 @@ milling_quality_data_with_ts_path = "/home/mittwollen_h@PTW.Maschinenbau.TU-Darm
 
 
 reader = MillingProcessData()
-keys = list(map(int, reader._part_id_paths.keys()))
-keys.sort()
-keys = np.array(keys)
-start_idx = np.searchsorted(keys, 111501)#124504
-keys = keys[start_idx:start_idx + 50]
+# sorted by part id in the dataset manifest
+keys = reader.get_part_ids(start="111501")[:50]#124504
 print(len(keys))
 exit()
 for key in keys:
-    jprint(reader.publish_process_QH_id(str(key)))
+    jprint(reader.publish_process_QH_id(key))
 
 
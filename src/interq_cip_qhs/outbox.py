@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from interq_cip_qhs.instrumentation import get_instrumentation
+from interq_cip_qhs.config import Config
+
+config = Config()
+instrumentation = get_instrumentation()
+
+PENDING = "pending"
+ACKNOWLEDGED = "acknowledged"
+FAILED = "failed"
+
+
+class Outbox:
+    """Durable SQLite record of the QH documents of bulk publishing runs.
+
+    Every built document is stored as pending under its endpoint and subject
+    before it is posted. It is marked acknowledged once the endpoint accepted
+    it (or reported it as not unique), and failed with one more attempt if the
+    endpoint answered otherwise. A resumed run skips acknowledged subjects
+    without building their documents. Pending and failed subjects are built
+    again from their source, stored documents are never replayed. Subjects
+    that failed max_attempts times are reported as errors and not posted
+    again until they are cleared, see get_failed. With verify, the documents
+    of acknowledged subjects are built as well and the ones whose content
+    changed since they were acknowledged are reported. With path None the
+    outbox is disabled and every document is built.
+
+    Subjects are recorded per endpoint URL, so a run against an endpoint whose
+    database was reset still skips them: clear the outbox to post them again.
+    """
+
+    def __init__(self, path=None, verify=None, max_attempts=None):
+        self.path = path
+        self.verify = config.OUTBOX_VERIFY if verify is None else verify
+        self.max_attempts = (
+            config.OUTBOX_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        )
+        self._connection = None
+
+    def __getstate__(self):
+        # sqlite connections can't be shared between processes
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            # one small transaction per document, WAL keeps them cheap
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "endpoint TEXT, subject TEXT, part_id TEXT, content_hash TEXT, "
+                "document TEXT, status TEXT, response TEXT, updated REAL, "
+                "attempts INTEGER DEFAULT 0, PRIMARY KEY (endpoint, subject))"
+            )
+            columns = self._connection.execute("PRAGMA table_info(outbox)").fetchall()
+            if "attempts" not in [column[1] for column in columns]:
+                # outboxes written before failed documents were counted
+                self._connection.execute(
+                    "ALTER TABLE outbox ADD COLUMN attempts INTEGER DEFAULT 0"
+                )
+            self._connection.commit()
+        return self._connection
+
+    def get_content_hash(self, document):
+        return hashlib.sha1(document.encode()).hexdigest()
+
+    def get_status(self, endpoint, subject):
+        if self.path is None:
+            return None
+        row = self.connection.execute(
+            "SELECT status FROM outbox WHERE endpoint = ? AND subject = ?",
+            (endpoint, subject),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def get_subjects(self, endpoint):
+        """Subjects with a stored document for endpoint, whatever their status."""
+        return set(self.get_content_hashes(endpoint))
+
+    def get_content_hashes(self, endpoint):
+        """{subject: (status, content hash)} of the stored documents of endpoint."""
+        return {
+            subject: (status, content_hash)
+            for subject, (status, content_hash, _) in self.get_rows(endpoint).items()
+        }
+
+    def get_rows(self, endpoint):
+        """{subject: (status, content hash, attempts)} of the stored documents of endpoint."""
+        if self.path is None:
+            return {}
+        rows = self.connection.execute(
+            "SELECT subject, status, content_hash, attempts FROM outbox WHERE endpoint = ?",
+            (endpoint,),
+        )
+        return {row[0]: row[1:] for row in rows}
+
+    def get_failed(self, endpoint):
+        """(part id, subject, attempts, last response) of the subjects endpoint
+        rejected, oldest first."""
+        if self.path is None:
+            return []
+        rows = self.connection.execute(
+            "SELECT part_id, subject, attempts, response FROM outbox "
+            "WHERE endpoint = ? AND status = ? ORDER BY updated",
+            (endpoint, FAILED),
+        )
+        return [
+            (part_id, subject, attempts, json.loads(response))
+            for part_id, subject, attempts, response in rows
+        ]
+
+    def add(self, endpoint, subject, part_id, qh_document):
+        if self.path is None:
+            return
+        document = json.dumps(qh_document)
+        with self.connection:
+            # a rebuilt document keeps the attempts of the subject
+            self.connection.execute(
+                "INSERT INTO outbox VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0) "
+                "ON CONFLICT (endpoint, subject) DO UPDATE SET part_id = excluded.part_id, "
+                "content_hash = excluded.content_hash, document = excluded.document, "
+                "status = excluded.status, updated = excluded.updated",
+                (
+                    endpoint,
+                    subject,
+                    str(part_id),
+                    self.get_content_hash(document),
+                    document,
+                    PENDING,
+                    None,
+                    time.time(),
+                ),
+            )
+
+    def acknowledge(self, endpoint, subject, response):
+        """Marks subject acknowledged if response accepted it and failed
+        otherwise, returns whether it was accepted."""
+        acknowledged = "uuid" in response or "not unique" in str(
+            response.get("message", "")
+        )
+        if self.path is None:
+            return acknowledged
+        with self.connection:
+            self.connection.execute(
+                "UPDATE outbox SET status = ?, response = ?, updated = ?, "
+                "attempts = attempts + ? WHERE endpoint = ? AND subject = ?",
+                (
+                    ACKNOWLEDGED if acknowledged else FAILED,
+                    json.dumps(response),
+                    time.time(),
+                    0 if acknowledged else 1,
+                    endpoint,
+                    subject,
+                ),
+            )
+        return acknowledged
+
+    def resume(self, endpoint, ids, get_subject, build_documents):
+        """Yields the (id, document, error) items still to be posted to endpoint.
+
+        build_documents(ids) is called with the ids that aren't acknowledged,
+        and every document it builds is stored as pending before it is
+        yielded. Ids whose subject failed max_attempts times are yielded with
+        a ValueError instead, they aren't built. With verify, acknowledged ids
+        are built too, and a document that differs from the acknowledged one
+        is yielded as a ValueError, it isn't posted.
+        """
+        stored = self.get_rows(endpoint)
+        statuses = {id: stored.get(get_subject(id), (None, None, 0)) for id in ids}
+        acknowledged = [id for id in ids if statuses[id][0] == ACKNOWLEDGED]
+        if acknowledged:
+            instrumentation.log(
+                "skipping "
+                + str(len(acknowledged))
+                + " subjects already acknowledged by "
+                + str(endpoint)
+                + (", checking their content" if self.verify else "")
+            )
+        for id in ids:
+            status, _, attempts = statuses[id]
+            if status == FAILED and attempts >= self.max_attempts:
+                yield id, None, ValueError(
+                    "Rejected document for subject: "
+                    + str(get_subject(id))
+                    + " after "
+                    + str(attempts)
+                    + " attempts"
+                )
+        ids = [
+            id
+            for id in ids
+            if statuses[id][0] in (None, PENDING)
+            or (statuses[id][0] == FAILED and statuses[id][2] < self.max_attempts)
+            or (self.verify and statuses[id][0] == ACKNOWLEDGED)
+        ]
+        for id, qh_document, error in build_documents(ids):
+            subject = get_subject(id)
+            if statuses[id][0] == ACKNOWLEDGED:
+                if error is None and self.get_content_hash(
+                    json.dumps(qh_document)
+                ) != statuses[id][1]:
+                    yield id, None, ValueError(
+                        "Changed document for acknowledged subject: " + str(subject)
+                    )
+                continue
+            if error is None:
+                try:
+                    self.add(endpoint, subject, id, qh_document)
+                except Exception as add_error:
+                    qh_document, error = None, add_error
+            yield id, qh_document, error
+
+    def clear(self, endpoint=None, status=None):
+        """Forgets the subjects of endpoint (default all) with status (default any),
+        e.g. FAILED to post the rejected documents again."""
+        if self.path is None:
+            return
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM outbox WHERE (? IS NULL OR endpoint = ?) AND (? IS NULL OR status = ?)",
+                (endpoint, endpoint, status, status),
+            )
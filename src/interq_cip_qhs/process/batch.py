@@ -0,0 +1,87 @@
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from interq_cip_qhs.process.cache import get_nbytes
+from interq_cip_qhs.instrumentation import get_instrumentation
+
+_worker_reader = None
+
+
+def _init_worker(reader, jsonl_path, quiet):
+    global _worker_reader
+    _worker_reader = reader
+    # spawned workers start out with the default configuration
+    get_instrumentation().configure(jsonl_path, None, quiet)
+    # the pool already uses every core, so tsfresh must not start its own workers
+    if hasattr(reader.feature_backend, "n_jobs"):
+        reader.feature_backend.n_jobs = 0
+
+
+def _run_worker(method, id, args):
+    return getattr(_worker_reader, method)(id, *args)
+
+
+def run_parts(reader, method, ids, n_workers=1, args=(), max_in_flight=None):
+    """Calls reader.<method>(id, *args) for every id and yields (id, result, error).
+
+    With n_workers > 1 the parts are spread over a pool of spawned worker
+    processes and results are yielded in completion order. Every worker gets
+    a pickled copy of the reader, which opens its own sqlite connections and
+    HDF5 handles, none are inherited from the calling process or its threads.
+    At most max_in_flight (default 2 * n_workers) parts are submitted at a
+    time, the parts not started yet are cancelled once the caller stops
+    iterating. An exception raised for one part is yielded as its error
+    instead of stopping the batch.
+    """
+    if n_workers is None or n_workers <= 1:
+        for id in ids:
+            try:
+                yield id, getattr(reader, method)(id, *args), None
+            except Exception as error:
+                yield id, None, error
+        return
+
+    instrumentation = get_instrumentation()
+    max_in_flight = 2 * n_workers if max_in_flight is None else max_in_flight
+    executor = ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(reader, instrumentation.jsonl_path, instrumentation.quiet),
+    )
+    ids = iter(ids)
+    futures = {}
+    try:
+        while True:
+            for id in ids:
+                futures[executor.submit(_run_worker, method, id, args)] = id
+                if len(futures) >= max_in_flight:
+                    break
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                id = futures.pop(future)
+                try:
+                    result, error = future.result(), None
+                except Exception as exception:
+                    result, error = None, exception
+                yield id, result, error
+    finally:
+        # also reached when the caller raises or drops the generator
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_batches(items, max_items=None, max_bytes=None):
+    """Groups (key, value) items into dicts of at most max_items items. A dict
+    is also closed as soon as its values hold max_bytes or more (see get_nbytes)."""
+    batch, nbytes = {}, 0
+    for key, value in items:
+        batch[key] = value
+        nbytes += get_nbytes(value)
+        if (max_items is not None and len(batch) >= max_items) or (
+            max_bytes is not None and nbytes >= max_bytes
+        ):
+            yield batch
+            batch, nbytes = {}, 0
+    if batch:
+        yield batch
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from interq_cip_qhs.config import Config
+
+config = Config()
+
+
+def file_fingerprint(paths):
+    """(path, mtime, size) of every file, changes whenever one of them is rewritten."""
+    fingerprint = []
+    for path in paths:
+        stat = os.stat(path)
+        fingerprint.append((str(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+
+def array_fingerprint(array):
+    """sha1 of the dtype, shape and bytes of an array, changes whenever its content does."""
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha1(repr((str(array.dtype), array.shape)).encode())
+    digest.update(array.data)
+    return digest.hexdigest()
+
+
+def get_nbytes(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(index=True, deep=False).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(get_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(get_nbytes(item) for item in value.values())
+    return 0
+
+
+class PartDataCache:
+    """In-memory LRU cache of parsed part data, bounded by its total size in bytes.
+
+    Entries are stored together with the fingerprint of their source data (see
+    file_fingerprint and array_fingerprint) and are reloaded as soon as that
+    fingerprint changes. Cached values are shared
+    between callers and must not be modified in place.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = config.PART_CACHE_BYTES if max_bytes is None else max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        # cached data stays in its process, a copied cache starts out empty
+        return {"max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state["max_bytes"])
+
+    def get(self, key, fingerprint):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != fingerprint:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, fingerprint, value):
+        nbytes = get_nbytes(value)
+        with self._lock:
+            self._remove(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, fingerprint, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def get_or_load(self, key, fingerprint, loader):
+        value = self.get(key, fingerprint)
+        if value is not None:
+            return value
+        value = loader()
+        self.put(key, fingerprint, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
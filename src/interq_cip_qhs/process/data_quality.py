@@ -0,0 +1,162 @@
+import datetime
+import numpy as np
+import pandas as pd
+from interq_cip_qhs.process.utils import format_timestamps
+
+# fixed fields the DQaaS container puts into every response
+DQAAS_HEADER = {
+    "owner": "InterQ",
+    "asset": "CNC",
+    "model": "test data",
+    "partID": "test part ID",
+    "processID": "test process ID",
+    "subject": "test subject",
+}
+DQAAS_BODY = {
+    "program_name": "DQaaS",
+    "rule_id": "a97sef79",
+    "batch_id": "aisudfgq",
+    "object_id": "as9d756",
+}
+N_PARTIAL_UNEXPECTED = 20
+
+
+def _to_seconds(times):
+    # the container compares the iso8601 strings, which have a resolution of one second
+    return np.asarray(times, dtype="datetime64[ns]").astype("datetime64[s]")
+
+
+def _get_percent(count, total):
+    # in the order of the container, 100 * count / total differs in the last bit
+    return None if total == 0 else count / total * 100
+
+
+def _get_qhd(seconds, expectation_type, kwargs, result, success):
+    valid = seconds[~np.isnat(seconds)]
+    start_time, end_time = (
+        format_timestamps(np.array([valid.min(), valid.max()]), "Z").tolist()
+        if len(valid)
+        else (None, None)
+    )
+    kwargs = dict(kwargs, result_format="BASIC")
+    return {
+        "qhd": {
+            "qhd-header": dict(
+                timeref=datetime.datetime.now(datetime.timezone.utc).strftime(
+                    "%Y-%m-%dT%H:%M:%SZ"
+                ),
+                **DQAAS_HEADER,
+            ),
+            "qhd-body": {
+                "key": {},
+                "exceptions": {
+                    "result": result,
+                    "exception_info": {
+                        "exception_traceback": None,
+                        "exception_message": None,
+                        "raised_exception": False,
+                    },
+                    "expectation_config": {
+                        "kwargs": kwargs,
+                        "meta": {},
+                        "expectation_type": expectation_type,
+                    },
+                    "meta": {},
+                    "success": success,
+                },
+                "program_name": DQAAS_BODY["program_name"],
+                "start_time": start_time,
+                "end_time": end_time,
+                "rule_id": DQAAS_BODY["rule_id"],
+                "batch_id": DQAAS_BODY["batch_id"],
+                "object_id": DQAAS_BODY["object_id"],
+                "kpi_actual": result["unexpected_percent"],
+                "kpi_required": 1.0,
+                "kpi_success": True,
+            },
+        }
+    }
+
+
+def get_missing_values_qhd(times, values, ts_column, value_column, timestamp_suffix):
+    """Local counterpart of the container's MissingValues rule on value_column."""
+    seconds = _to_seconds(times)
+    element_count = len(seconds)
+    unexpected_count = int(pd.isna(np.asarray(values)).sum())
+    unexpected_percent = _get_percent(unexpected_count, element_count)
+    result = {
+        "element_count": element_count,
+        "unexpected_count": unexpected_count,
+        "unexpected_percent": unexpected_percent,
+        "unexpected_percent_total": unexpected_percent,
+        "partial_unexpected_list": [],
+    }
+    return _get_qhd(
+        seconds,
+        "expect_column_values_to_not_be_null",
+        {"column": value_column},
+        result,
+        unexpected_count == 0,
+    )
+
+
+def get_duplicate_records_qhd(times, values, ts_column, value_column, timestamp_suffix):
+    """Local counterpart of the container's DuplicateRecords rule on ts_column.
+
+    Every repetition of an already seen timestamp counts as unexpected, the
+    first N_PARTIAL_UNEXPECTED of them are listed in row order.
+    """
+    seconds = _to_seconds(times)
+    element_count = len(seconds)
+    missing = np.isnat(seconds)
+    missing_count = int(missing.sum())
+    present = seconds[~missing]
+    duplicated = pd.Series(present.view(np.int64)).duplicated(keep="first").to_numpy()
+    unexpected_count = int(duplicated.sum())
+    partial = format_timestamps(
+        present[duplicated][:N_PARTIAL_UNEXPECTED], timestamp_suffix
+    ).tolist()
+    result = {
+        "element_count": element_count,
+        "missing_count": missing_count,
+        "missing_percent": _get_percent(missing_count, element_count),
+        "unexpected_count": unexpected_count,
+        "unexpected_percent": _get_percent(unexpected_count, len(present)),
+        "unexpected_percent_total": _get_percent(unexpected_count, element_count),
+        "unexpected_percent_nonmissing": _get_percent(unexpected_count, len(present)),
+        "partial_unexpected_list": [[value, value] for value in partial],
+    }
+    return _get_qhd(
+        seconds,
+        "expect_column_records_unique",
+        {"column_A": ts_column, "column_B": ts_column},
+        result,
+        unexpected_count == 0,
+    )
+
+
+# analyzers by the name of the DQaaS endpoint they replace
+DQ_ANALYZERS = {
+    "MissingValues_Plain": get_missing_values_qhd,
+    "DuplicateRecords": get_duplicate_records_qhd,
+}
+
+
+def analyze_data_quality(
+    dqaas_endpoint, times, values, ts_column, value_column, timestamp_suffix
+):
+    """Computes the response the DQaaS container would return for dqaas_endpoint.
+
+    times holds the datetimes of the ts_column, values the value_column. The
+    timestamp_suffix is the UTC offset the container would see on the uploaded
+    timestamps, e.g. "Z" or "+01:00".
+    """
+    name = dqaas_endpoint.rstrip("/").rsplit("/", 1)[-1]
+    if name not in DQ_ANALYZERS:
+        raise ValueError(
+            "No local data quality analyzer for "
+            + str(dqaas_endpoint)
+            + ", available: "
+            + ", ".join(DQ_ANALYZERS)
+        )
+    return DQ_ANALYZERS[name](times, values, ts_column, value_column, timestamp_suffix)
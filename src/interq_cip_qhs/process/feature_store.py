@@ -0,0 +1,147 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+from interq_cip_qhs.config import Config
+
+config = Config()
+
+
+class FeatureStore:
+    """Persistent SQLite store of computed features.
+
+    Entries are keyed by process class, part id and feature set and carry a
+    fingerprint of their source data (of the part files, or the content hash
+    of a part in a shared file); an entry whose fingerprint no longer matches
+    is recomputed. The least recently used entries are evicted once
+    the stored payloads exceed max_bytes. With path None the store is disabled
+    and every lookup is computed.
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path
+        self.max_bytes = (
+            config.FEATURE_STORE_MAX_BYTES if max_bytes is None else max_bytes
+        )
+        self._connection = None
+
+    def __getstate__(self):
+        # sqlite connections can't be shared between processes
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS features ("
+                "process_class TEXT, part_id TEXT, feature_set TEXT, "
+                "fingerprint TEXT, payload BLOB, nbytes INTEGER, last_access REAL, "
+                "PRIMARY KEY (process_class, part_id, feature_set))"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def get_fingerprint_hash(self, fingerprint):
+        return hashlib.sha1(repr(fingerprint).encode()).hexdigest()
+
+    def get(self, process_class, part_id, feature_set, fingerprint):
+        if self.path is None:
+            return None
+        key = (process_class, str(part_id), feature_set)
+        row = self.connection.execute(
+            "SELECT fingerprint, payload FROM features "
+            "WHERE process_class = ? AND part_id = ? AND feature_set = ?",
+            key,
+        ).fetchone()
+        if row is None:
+            return None
+        if row[0] != self.get_fingerprint_hash(fingerprint):
+            self.invalidate(process_class, part_id)
+            return None
+        try:
+            value = pickle.loads(row[1])
+        except Exception:
+            # written by an incompatible library version
+            self.invalidate(process_class, part_id)
+            return None
+        with self.connection:
+            self.connection.execute(
+                "UPDATE features SET last_access = ? "
+                "WHERE process_class = ? AND part_id = ? AND feature_set = ?",
+                (time.time(), *key),
+            )
+        return value
+
+    def put(self, process_class, part_id, feature_set, fingerprint, value):
+        if self.path is None:
+            return
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.max_bytes:
+            return
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    process_class,
+                    str(part_id),
+                    feature_set,
+                    self.get_fingerprint_hash(fingerprint),
+                    payload,
+                    len(payload),
+                    time.time(),
+                ),
+            )
+            self._evict()
+
+    def get_or_compute(self, process_class, part_id, feature_set, fingerprint, compute):
+        value = self.get(process_class, part_id, feature_set, fingerprint)
+        if value is None:
+            value = compute()
+            self.put(process_class, part_id, feature_set, fingerprint, value)
+        return value
+
+    def invalidate(self, process_class=None, part_id=None):
+        if self.path is None:
+            return
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM features WHERE (? IS NULL OR process_class = ?) "
+                "AND (? IS NULL OR part_id = ?)",
+                (
+                    process_class,
+                    process_class,
+                    None if part_id is None else str(part_id),
+                    None if part_id is None else str(part_id),
+                ),
+            )
+
+    def clear(self):
+        self.invalidate()
+
+    def get_nbytes(self):
+        if self.path is None:
+            return 0
+        return self.connection.execute(
+            "SELECT COALESCE(SUM(nbytes), 0) FROM features"
+        ).fetchone()[0]
+
+    def _evict(self):
+        excess = self.get_nbytes() - self.max_bytes
+        if excess <= 0:
+            return
+        rows = self.connection.execute(
+            "SELECT rowid, nbytes FROM features ORDER BY last_access"
+        )
+        evicted = []
+        for rowid, nbytes in rows:
+            if excess <= 0:
+                break
+            evicted.append((rowid,))
+            excess -= nbytes
+        self.connection.executemany("DELETE FROM features WHERE rowid = ?", evicted)
@@ -0,0 +1,316 @@
+import numpy as np
+import pandas as pd
+from interq_cip_qhs.config import Config
+
+config = Config()
+
+MINIMAL_FEATURES = [
+    "sum_values",
+    "median",
+    "mean",
+    "length",
+    "standard_deviation",
+    "variance",
+    "root_mean_square",
+    "maximum",
+    "absolute_maximum",
+    "minimum",
+]
+
+
+class NumpyFeatureBackend:
+    """Computes the tsfresh MinimalFCParameters directly on contiguous segments.
+
+    Takes the same long-format frames as tsfresh extract_features, with one
+    value column per kind or with column_kind and column_value, and returns
+    the same id x "<kind>__<feature>" frame. A segment index of the frame (see
+    segmentation.get_segment_index) saves locating the segments by their ids.
+    """
+
+    name = "numpy"
+    feature_set = "minimal"
+    # no setup per call, extracting part by part saves concatenating them
+    batch_calls = False
+
+    def get_segments(self, ids):
+        if isinstance(ids.dtype, pd.CategoricalDtype):
+            # work on the integer codes, the names are only looked up for the result
+            names, ids = ids.cat.categories, ids.cat.codes.to_numpy()
+        else:
+            names, ids = None, ids.to_numpy()
+        # ids come in runs, so only the first id of every run needs to be hashed
+        run_starts = np.flatnonzero(np.append(True, ids[1:] != ids[:-1]))
+        run_codes, uniques = pd.factorize(ids[run_starts])
+        if names is not None:
+            uniques = names[uniques]
+        if len(run_starts) == len(uniques):
+            return None, run_starts, uniques
+        # an id occurs in more than one run of rows, so group the rows first
+        run_lengths = np.diff(np.append(run_starts, len(ids)))
+        codes = np.repeat(run_codes, run_lengths)
+        order = np.argsort(codes, kind="stable")
+        starts = np.searchsorted(codes[order], np.arange(len(uniques)))
+        return order, starts, uniques
+
+    def factorize(self, column):
+        """Integer codes of column and its sorted unique values."""
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes, uniques = pd.factorize(column.cat.codes.to_numpy())
+            uniques = column.cat.categories[uniques]
+        else:
+            codes, uniques = pd.factorize(column.to_numpy())
+        order = np.argsort(np.asarray(uniques), kind="stable")
+        ranks = np.empty_like(order)
+        ranks[order] = np.arange(len(order))
+        return ranks[codes], uniques[order]
+
+    def get_statistics(self, values, starts):
+        """MINIMAL_FEATURES of the row segments of values starting at starts."""
+        lengths = np.diff(np.append(starts, len(values)))[:, None]
+        sums = np.add.reduceat(values, starts, axis=0)
+        means = sums / lengths
+        centered = values - np.repeat(means, lengths[:, 0], axis=0)
+        variances = np.add.reduceat(centered * centered, starts, axis=0) / lengths
+        maxima = np.maximum.reduceat(values, starts, axis=0)
+        minima = np.minimum.reduceat(values, starts, axis=0)
+        medians = np.array(
+            [np.median(segment, axis=0) for segment in np.split(values, starts[1:])]
+        ).reshape(sums.shape)
+        stats = {
+            "sum_values": sums,
+            "median": medians,
+            "mean": means,
+            "length": np.broadcast_to(lengths, sums.shape).astype(float),
+            "standard_deviation": np.sqrt(variances),
+            "variance": variances,
+            "root_mean_square": np.sqrt(
+                np.add.reduceat(values * values, starts, axis=0) / lengths
+            ),
+            "maximum": maxima,
+            "absolute_maximum": np.maximum(np.abs(maxima), np.abs(minima)),
+            "minimum": minima,
+        }
+        # segments x columns x features
+        return np.stack([stats[name] for name in MINIMAL_FEATURES], axis=2)
+
+    def get_values(self, data, value_columns):
+        values = data[value_columns].to_numpy(dtype=float)
+        has_nan = np.isnan(values).any(axis=0)
+        if has_nan.any():
+            raise ValueError(
+                "Column must not contain NaN values: "
+                + value_columns[np.argmax(has_nan)]
+            )
+        return values
+
+    def extract_features(
+        self,
+        data,
+        column_id="id",
+        column_sort=None,
+        segments=None,
+        column_kind=None,
+        column_value=None,
+    ):
+        if column_kind is not None:
+            return self.extract_long_features(
+                data, column_id, column_sort, column_kind, column_value
+            )
+        value_columns = [
+            column for column in data.columns if column not in (column_id, column_sort)
+        ]
+        columns = [
+            column + "__" + name for column in value_columns for name in MINIMAL_FEATURES
+        ]
+        if len(data) == 0:
+            return pd.DataFrame(columns=columns, dtype=float)
+
+        values = self.get_values(data, value_columns)
+        if segments is None:
+            order, starts, uniques = self.get_segments(data[column_id])
+        else:
+            segments = segments[segments.end > segments.start]
+            order, starts, uniques = None, segments.start.to_numpy(), segments.index.rename(None)
+        if order is not None:
+            values = values[order]
+
+        features = pd.DataFrame(
+            self.get_statistics(values, starts).reshape(len(uniques), -1),
+            index=uniques,
+            columns=columns,
+        )
+        return features.sort_index()
+
+    def extract_long_features(self, data, column_id, column_sort, column_kind, column_value):
+        """Features of a (id, kind, [sort,] value) frame, one "<kind>__<feature>"
+        column per kind, kinds sorted by name like tsfresh does."""
+        if column_value is None:
+            # like tsfresh, the value column is the one column left
+            (column_value,) = [
+                column
+                for column in data.columns
+                if column not in (column_id, column_sort, column_kind)
+            ]
+        kind_codes, kinds = self.factorize(data[column_kind])
+        columns = [
+            str(kind) + "__" + name for kind in kinds for name in MINIMAL_FEATURES
+        ]
+        if len(data) == 0:
+            return pd.DataFrame(columns=columns, dtype=float)
+
+        values = self.get_values(data, [column_value])
+        id_codes, ids = self.factorize(data[column_id])
+        # every (kind, id) pair is one segment
+        order, starts, keys = self.get_segments(
+            pd.Series(kind_codes.astype(np.int64) * len(ids) + id_codes)
+        )
+        if order is not None:
+            values = values[order]
+
+        statistics = np.full((len(ids), len(kinds), len(MINIMAL_FEATURES)), np.nan)
+        keys = np.asarray(keys)
+        statistics[keys % len(ids), keys // len(ids)] = self.get_statistics(values, starts)[:, 0]
+        return pd.DataFrame(
+            statistics.reshape(len(ids), -1), index=pd.Index(ids), columns=columns
+        )
+
+
+class TsfreshFeatureBackend:
+    """Delegates to tsfresh extract_features with MinimalFCParameters."""
+
+    name = "tsfresh"
+    feature_set = "minimal"
+    # every call pays for its worker pool, melting and progress bar
+    batch_calls = True
+
+    def __init__(self, n_jobs=None):
+        self.n_jobs = n_jobs
+
+    def extract_features(
+        self,
+        data,
+        column_id="id",
+        column_sort=None,
+        segments=None,
+        column_kind=None,
+        column_value=None,
+    ):
+        from tsfresh.feature_extraction import extract_features, MinimalFCParameters
+
+        kwargs = {} if self.n_jobs is None else {"n_jobs": self.n_jobs}
+        for column in (column_id, column_kind):
+            if column is not None and isinstance(data[column].dtype, pd.CategoricalDtype):
+                # tsfresh groups by id and kind and would keep unused categories as empty groups
+                data = data.assign(**{column: data[column].astype(object)})
+        return extract_features(
+            data,
+            column_sort=column_sort,
+            column_id=column_id,
+            column_kind=column_kind,
+            column_value=column_value,
+            default_fc_parameters=MinimalFCParameters(),
+            **kwargs,
+        )
+
+
+FEATURE_BACKENDS = {
+    NumpyFeatureBackend.name: NumpyFeatureBackend,
+    TsfreshFeatureBackend.name: TsfreshFeatureBackend,
+}
+
+
+def get_feature_backend(backend=None):
+    """Returns a feature backend instance for a backend name (default from config)."""
+    if backend is None:
+        backend = config.FEATURE_BACKEND
+    if not isinstance(backend, str):
+        return backend
+    try:
+        return FEATURE_BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(
+            "Unknown feature backend: "
+            + str(backend)
+            + ", expected one of "
+            + str(list(FEATURE_BACKENDS))
+        )
+
+
+def extract_features_batch(extract, frames, segments=None, column_id="id", combine=True):
+    """Features of several long frames from a single extract(data, segments) call.
+
+    frames maps a key (e.g. a part id) to a long frame and segments optionally
+    to the segment index of that frame. For the call, the ids of all frames
+    are replaced by integer codes unique over all frames and the frames are
+    concatenated. Returns the features of every frame under its key, indexed
+    by the frame's own ids, as a call on the frame alone would. With combine
+    False, extract is called on every frame instead (see batch_calls of the
+    backends).
+    """
+    if not combine:
+        return {
+            key: extract(frame, None if segments is None else segments[key])
+            for key, frame in frames.items()
+        }
+    pieces, segment_pieces, names, bounds = [], [], [], {}
+    n_rows = 0
+    for key, frame in frames.items():
+        codes, uniques = pd.factorize(frame[column_id])
+        uniques = pd.Index(uniques)
+        offset = len(names)
+        pieces.append(frame.assign(**{column_id: codes + offset}))
+        if segments is not None:
+            frame_segments = segments[key]
+            frame_segments = frame_segments[frame_segments.end > frame_segments.start]
+            segment_pieces.append(
+                frame_segments.assign(
+                    start=frame_segments.start + n_rows, end=frame_segments.end + n_rows
+                ).set_axis(offset + uniques.get_indexer(frame_segments.index))
+            )
+        names.extend(uniques)
+        bounds[key] = (offset, len(names))
+        n_rows += len(frame)
+    if not pieces:
+        return {}
+
+    data = pd.concat(pieces, ignore_index=True)
+    features = extract(
+        data, None if segments is None else pd.concat(segment_pieces)
+    )
+    names = np.asarray(names, dtype=object)
+    codes = features.index.to_numpy()
+    result = {}
+    for key, (start, end) in bounds.items():
+        frame_features = features[(codes >= start) & (codes < end)]
+        result[key] = frame_features.set_axis(
+            pd.Index(list(names[frame_features.index.to_numpy(dtype=np.int64)]))
+        ).sort_index()
+    return result
+
+
+def get_part_feature_frame(features):
+    """parts x (process, feature) frame of the process x feature frames of several parts."""
+    if not features:
+        return pd.DataFrame(columns=pd.MultiIndex.from_tuples([], names=["process", "feature"]))
+    first = next(iter(features.values()))
+    if all(
+        part_features.index.equals(first.index) and part_features.columns.equals(first.columns)
+        for part_features in features.values()
+    ):
+        # usually all parts have the same processes and features
+        frame = pd.DataFrame(
+            np.stack([part_features.to_numpy().ravel() for part_features in features.values()]),
+            index=list(features),
+            columns=pd.MultiIndex.from_product([first.index.astype(str), first.columns]),
+        )
+    else:
+        frame = pd.concat(
+            {
+                part: part_features.set_axis(part_features.index.astype(str)).stack()
+                for part, part_features in features.items()
+            },
+            axis=1,
+        ).T
+    frame.index.name = "part_id"
+    frame.columns.names = ["process", "feature"]
+    return frame
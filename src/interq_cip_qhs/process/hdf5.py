@@ -0,0 +1,250 @@
+import os
+import threading
+import numpy as np
+from interq_cip_qhs.process.segmentation import split_segments
+
+_part_files = {}
+_part_files_lock = threading.Lock()
+
+
+class LazySignalFile:
+    """Slice-on-demand reader for the "data" dataset of a time-ordered signal file.
+
+    The first column of the dataset holds the time. Process windows are located
+    by binary search on that column, and only their rows are read from disk.
+    Files whose time column turns out not to be sorted are segmented in full.
+    """
+
+    def __init__(self, path, chunk_cache_bytes=None, dataset="data"):
+        self.path = path
+        self.chunk_cache_bytes = chunk_cache_bytes
+        self.dataset = dataset
+        self._file = None
+        self.data = None
+
+    def __enter__(self):
+        import h5py
+
+        kwargs = {}
+        if self.chunk_cache_bytes is not None:
+            kwargs["rdcc_nbytes"] = self.chunk_cache_bytes
+        self._file = h5py.File(self.path, "r", **kwargs)
+        self.data = self._file[self.dataset]
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        self._file = None
+        self.data = None
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def time_at(self, row):
+        return self.data[row, 0]
+
+    def looks_time_ordered(self, n_probes=64):
+        # cheap check on evenly spaced rows before relying on binary search
+        if len(self) < 2:
+            return True
+        probes = np.unique(np.linspace(0, len(self) - 1, n_probes).astype(np.int64))
+        times = self.data[probes, 0]
+        return not np.any(times[1:] < times[:-1])
+
+    def searchsorted(self, value, lo=0, hi=None):
+        # first row whose time is >= value
+        hi = len(self) if hi is None else hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.time_at(mid) < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def read_windows(self, timestamps, windows=None, n_columns=None, fill_empty=False):
+        """Reads the rows of the given process windows into one array.
+
+        Window i holds the rows with timestamps[i] <= time < timestamps[i + 1],
+        the last window is open-ended. Returns the rows in window order and the
+        number of rows per window, like split_segments.
+        """
+        n_rows = len(self)
+        n_columns = self.data.shape[1] if n_columns is None else n_columns
+        windows = range(len(timestamps)) if windows is None else windows
+        if not self.looks_time_ordered():
+            return self._read_windows_unordered(
+                timestamps, windows, n_columns, fill_empty
+            )
+
+        bounds = {}
+
+        def bound(i):
+            if i == len(timestamps):
+                return n_rows
+            if i not in bounds:
+                bounds[i] = self.searchsorted(timestamps[i])
+            return bounds[i]
+
+        starts = np.array([bound(i) for i in windows], dtype=np.int64)
+        ends = np.array([bound(i + 1) for i in windows], dtype=np.int64)
+        lengths = np.maximum(ends - starts, 0)
+        if fill_empty:
+            lengths = np.maximum(lengths, 1)
+
+        rows = np.zeros((int(lengths.sum()), n_columns), dtype=self.data.dtype)
+        offset = 0
+        for i, start, end, length in zip(windows, starts, ends, lengths):
+            if end > start:
+                self.data.read_direct(
+                    rows,
+                    np.s_[start:end, :n_columns],
+                    np.s_[offset : offset + end - start],
+                )
+            if not self._is_window_ordered(
+                timestamps, i, start, end, rows[offset : offset + end - start, 0]
+            ):
+                return self._read_windows_unordered(
+                    timestamps, windows, n_columns, fill_empty
+                )
+            offset += length
+        return rows, lengths
+
+    def _is_window_ordered(self, timestamps, i, start, end, times):
+        # the binary search is only valid if the rows around and inside the window are sorted
+        if start > 0 and not self.time_at(start - 1) < timestamps[i]:
+            return False
+        if i + 1 < len(timestamps):
+            if end < len(self) and not self.time_at(end) >= timestamps[i + 1]:
+                return False
+            if len(times) and not times[-1] < timestamps[i + 1]:
+                return False
+        if len(times) and not times[0] >= timestamps[i]:
+            return False
+        return not np.any(times[1:] < times[:-1])
+
+    def _read_windows_unordered(self, timestamps, windows, n_columns, fill_empty):
+        # binary search needs sorted times, so segment the full dataset instead
+        rows, lengths = split_segments(
+            self.data[:, :n_columns], timestamps, fill_empty=fill_empty
+        )
+        offsets = np.cumsum(lengths) - lengths
+        windows = list(windows)
+        pieces = [rows[offsets[i] : offsets[i] + lengths[i]] for i in windows]
+        if not pieces:
+            return rows[:0], lengths[:0]
+        return np.concatenate(pieces), lengths[windows]
+
+
+class PartFile:
+    """Shared read-only handle of an HDF5 file holding one dataset per part.
+
+    The file is opened on first use and kept open, together with an index of
+    the parts and the offsets of their data in the file. It is reopened when
+    the file at path is replaced. HDF5 doesn't allow writing to a file that is
+    open for reading, so call close (or close_part_files) before modifying it
+    in place. Copies sent to worker processes open their own handle.
+    """
+
+    def __init__(self, path, chunk_cache_bytes=None):
+        self.path = path
+        self.chunk_cache_bytes = chunk_cache_bytes
+        self._file = None
+        self._stat = None
+        self._offsets = None
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        # h5py handles can't be pickled
+        return {"path": self.path, "chunk_cache_bytes": self.chunk_cache_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["chunk_cache_bytes"])
+
+    def _get_file(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError as error:
+            raise OSError("Failed to open file: " + str(self.path)) from error
+        stat = (stat.st_mtime_ns, stat.st_size)
+        if self._file is not None and stat != self._stat:
+            self.close()
+        if self._file is None:
+            import h5py
+
+            kwargs = {}
+            if self.chunk_cache_bytes is not None:
+                kwargs["rdcc_nbytes"] = self.chunk_cache_bytes
+            try:
+                self._file = h5py.File(self.path, "r", **kwargs)
+            except OSError as error:
+                raise OSError("Failed to open file: " + str(self.path)) from error
+            self._stat = stat
+            self._offsets = {
+                key: self._get_offset(dataset)
+                for key, dataset in self._file.items()
+                if isinstance(dataset, h5py.Dataset)
+            }
+        return self._file
+
+    def _get_offset(self, dataset):
+        # contiguous datasets have one offset, chunked ones are placed by their first chunk
+        offset = dataset.id.get_offset()
+        if offset is None and dataset.chunks is not None and dataset.id.get_num_chunks():
+            offset = dataset.id.get_chunk_info(0).byte_offset
+        return np.inf if offset is None else offset
+
+    def keys(self):
+        """Part keys in the order their data is stored in the file."""
+        with self._lock:
+            self._get_file()
+            return sorted(self._offsets, key=lambda key: (self._offsets[key], key))
+
+    def __contains__(self, key):
+        with self._lock:
+            self._get_file()
+            return key in self._offsets
+
+    def read(self, key, selection=()):
+        """The dataset of a part, or only the selection of it (e.g. its time row)."""
+        with self._lock:
+            hf = self._get_file()
+            if key not in self._offsets:
+                raise KeyError(
+                    "Failed to find dataset: " + str(key) + " in file " + str(self.path)
+                )
+            return hf[key][selection]
+
+    def get_layout(self, keys=None):
+        """(offset, stored bytes, shape) of the datasets of keys (default all parts)."""
+        with self._lock:
+            hf = self._get_file()
+            keys = self._offsets if keys is None else keys
+            return {
+                key: (self._offsets[key], hf[key].id.get_storage_size(), hf[key].shape)
+                for key in keys
+            }
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+            self._stat = None
+            self._offsets = None
+
+
+def get_part_file(path, chunk_cache_bytes=None):
+    """Returns the PartFile shared by all readers of path."""
+    path = os.path.abspath(path)
+    with _part_files_lock:
+        if path not in _part_files:
+            _part_files[path] = PartFile(path, chunk_cache_bytes)
+        return _part_files[path]
+
+
+def close_part_files():
+    """Closes the handles of all shared PartFiles, they reopen on next use."""
+    with _part_files_lock:
+        for part_file in _part_files.values():
+            part_file.close()
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from interq_cip_qhs.config import Config
+
+config = Config()
+
+ENTRY_FIELDS = [
+    "part_id",
+    "path",
+    "files",
+    "nbytes",
+    "n_samples",
+    "first_time",
+    "last_time",
+    "offset",
+    "fingerprint",
+]
+
+
+def get_fingerprint_hash(fingerprint):
+    return hashlib.sha1(repr(fingerprint).encode()).hexdigest()
+
+
+def get_part_id_key(part_id):
+    # numeric part ids sort by their value, as the notebooks did with int()
+    part_id = str(part_id)
+    if part_id.isdigit():
+        return (0, int(part_id), part_id)
+    return (1, 0, part_id)
+
+
+class DatasetManifest:
+    """Persistent SQLite catalog of the parts of a dataset, kept next to the data.
+
+    Every part of a process class is recorded with its path, its files and
+    their total size in bytes, its number of samples, the time of its first
+    and last sample (seconds since the epoch), its offset within a shared
+    file and a fingerprint of its content (the identity of its files, or a
+    hash of its data for parts sharing a file). The entries are only brought
+    up to date (see update) when the fingerprint of their source, the part
+    folder directory or the part file, changed. If path can't be written, e.g.
+    on a read only dataset, or is None, the catalog is kept in memory instead.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._connection = None
+
+    def __getstate__(self):
+        # sqlite connections can't be shared between processes
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            try:
+                self._connection = self._connect(self.path)
+            except (sqlite3.Error, OSError):
+                self._connection = self._connect(None)
+        return self._connection
+
+    def _connect(self, path):
+        if path is None:
+            connection = sqlite3.connect(":memory:")
+        else:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(path, timeout=60)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS parts ("
+            "process_class TEXT, part_id TEXT, path TEXT, files TEXT, nbytes INTEGER, "
+            "n_samples INTEGER, first_time REAL, last_time REAL, offset REAL, "
+            "fingerprint TEXT, updated REAL, PRIMARY KEY (process_class, part_id))"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            "process_class TEXT, source TEXT, fingerprint TEXT, updated REAL, "
+            "PRIMARY KEY (process_class, source))"
+        )
+        connection.commit()
+        return connection
+
+    def is_current(self, process_class, source, source_fingerprint):
+        row = self.connection.execute(
+            "SELECT fingerprint FROM sources WHERE process_class = ? AND source = ?",
+            (process_class, source),
+        ).fetchone()
+        return row is not None and row[0] == get_fingerprint_hash(source_fingerprint)
+
+    def update(self, process_class, source, source_fingerprint, list_parts, index_parts):
+        """Brings the entries of process_class up to date with source, returns
+        the number of entries added, replaced or removed.
+
+        Nothing else is read while source_fingerprint matches the one of the
+        last update. Otherwise list_parts() returns {part_id: (key, fingerprint)}
+        of the parts in source, where a fingerprint of None keeps a known part
+        as it is. Entries of parts gone from source are removed, and new parts
+        and parts whose fingerprint differs from the one of their entry (e.g.
+        all of them, if it can only be known by reading the part) are passed
+        to index_parts(keys),
+        which yields (key, entry, error) with entry a dict of ENTRY_FIELDS. A
+        part that fails to be indexed is kept with its part id and key as path
+        only. source_fingerprint None always lists the parts.
+        """
+        if source_fingerprint is not None and self.is_current(
+            process_class, source, source_fingerprint
+        ):
+            return 0
+        parts = list_parts()
+        known = self.get_fingerprints(process_class)
+        gone = [(process_class, part_id) for part_id in known if part_id not in parts]
+        keys = {
+            key: part_id
+            for part_id, (key, fingerprint) in parts.items()
+            if part_id not in known
+            or (fingerprint is not None and get_fingerprint_hash(fingerprint) != known[part_id])
+        }
+        rows = []
+        for key, entry, error in index_parts(list(keys)):
+            if error is not None:
+                entry = {"part_id": keys[key], "path": str(key)}
+            entry["files"] = json.dumps(entry.get("files"))
+            if entry.get("fingerprint") is not None:
+                entry["fingerprint"] = get_fingerprint_hash(entry["fingerprint"])
+            rows.append(
+                (process_class, *[entry.get(field) for field in ENTRY_FIELDS], time.time())
+            )
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM parts WHERE process_class = ? AND part_id = ?", gone
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO parts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            if source_fingerprint is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                    (
+                        process_class,
+                        source,
+                        get_fingerprint_hash(source_fingerprint),
+                        time.time(),
+                    ),
+                )
+        return len(rows) + len(gone)
+
+    def get_fingerprint(self, process_class, part_id):
+        """Fingerprint hash of the entry of part_id, None for an unknown part."""
+        row = self.connection.execute(
+            "SELECT fingerprint FROM parts WHERE process_class = ? AND part_id = ?",
+            (process_class, str(part_id)),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def get_fingerprints(self, process_class):
+        rows = self.connection.execute(
+            "SELECT part_id, fingerprint FROM parts WHERE process_class = ?",
+            (process_class,),
+        )
+        return {part_id: fingerprint for part_id, fingerprint in rows}
+
+    def select(self, process_class, fields):
+        """Rows of fields of the entries of process_class, sorted by part id."""
+        rows = self.connection.execute(
+            "SELECT part_id, " + ", ".join(fields) + " FROM parts WHERE process_class = ?",
+            (process_class,),
+        )
+        return [row[1:] for row in sorted(rows, key=lambda row: get_part_id_key(row[0]))]
+
+    def get_entries(self, process_class):
+        """Entries of process_class sorted by part id, files decoded."""
+        entries = [
+            dict(zip(ENTRY_FIELDS, row)) for row in self.select(process_class, ENTRY_FIELDS)
+        ]
+        for entry in entries:
+            entry["files"] = json.loads(entry["files"])
+        return entries
+
+    def get_nbytes(self, process_class):
+        """Total size of the parts of process_class, in bytes."""
+        row = self.connection.execute(
+            "SELECT SUM(nbytes) FROM parts WHERE process_class = ?", (process_class,)
+        ).fetchone()
+        return row[0] or 0
+
+    def get_paths(self, process_class):
+        return dict(self.select(process_class, ["part_id", "path"]))
+
+    def get_part_ids(
+        self, process_class, start=None, stop=None, shard=None, n_shards=None, order="part_id"
+    ):
+        """Part ids of process_class with start <= part id < stop, sorted by part
+        id or, with order "offset", in the order their data is stored.
+
+        With n_shards, the part ids are split into n_shards ranges holding
+        about the same number of bytes and those of range shard are returned.
+        """
+        if order not in ("part_id", "offset"):
+            raise ValueError(
+                "Unknown order: " + str(order) + ", expected one of ['part_id', 'offset']"
+            )
+        fields = ["part_id", "nbytes", "offset"]
+        entries = [
+            dict(zip(fields, row))
+            for row in self.select(process_class, fields)
+            if (start is None or get_part_id_key(row[0]) >= get_part_id_key(start))
+            and (stop is None or get_part_id_key(row[0]) < get_part_id_key(stop))
+        ]
+        if n_shards is not None:
+            weights = [entry["nbytes"] or 0 for entry in entries]
+            if sum(weights) == 0:
+                weights = [1] * len(entries)
+            total, cumulative, shard_entries = sum(weights), 0, []
+            for entry, weight in zip(entries, weights):
+                # a part belongs to the shard its middle byte falls into
+                if min(int((cumulative + weight / 2) * n_shards / total), n_shards - 1) == shard:
+                    shard_entries.append(entry)
+                cumulative += weight
+            entries = shard_entries
+        if order == "offset":
+            entries = sorted(
+                entries,
+                key=lambda entry: (
+                    float("inf") if entry["offset"] is None else entry["offset"],
+                    get_part_id_key(entry["part_id"]),
+                ),
+            )
+        return [entry["part_id"] for entry in entries]
+
+    def clear(self, process_class=None):
+        with self.connection:
+            for table in ("parts", "sources"):
+                self.connection.execute(
+                    "DELETE FROM " + table + " WHERE ? IS NULL OR process_class = ?",
+                    (process_class, process_class),
+                )
@@ -1,36 +1,74 @@
 import json
-import h5py
-import docker
 import os
-import ciso8601
+import uuid
 import datetime
 import numpy as np
 import pandas as pd
-import requests
 from pathlib import Path
-import matplotlib.pyplot as plt
-from tsfresh.feature_extraction import extract_features, MinimalFCParameters
-from interq_cip_qhs.process.utils import copy_to_container, jprint
+from interq_cip_qhs.process.utils import (
+    copy_frame_to_container,
+    format_timestamps,
+    get_docker_client,
+    parse_timestamps,
+    remove_from_container,
+)
+from interq_cip_qhs.process.segmentation import (
+    decimate_segments,
+    get_segment_index,
+    index_segments,
+    select_segments,
+    split_segments,
+    to_long_frame,
+)
+from interq_cip_qhs.process.features import (
+    extract_features_batch,
+    get_feature_backend,
+    get_part_feature_frame,
+)
+from interq_cip_qhs.process.hdf5 import LazySignalFile
+from interq_cip_qhs.process.cache import PartDataCache, file_fingerprint
+from interq_cip_qhs.process.feature_store import FeatureStore
+from interq_cip_qhs.process.manifest import DatasetManifest
+from interq_cip_qhs.process.batch import iter_batches, run_parts
+from interq_cip_qhs.process.data_quality import analyze_data_quality
+from interq_cip_qhs.process.streaming import stream_process_QH
+from interq_cip_qhs.publisher import get_publisher
+from interq_cip_qhs.outbox import Outbox
+from interq_cip_qhs.instrumentation import get_instrumentation
 from interq_cip_qhs.config import Config
 import csv
 
 config = Config()
+instrumentation = get_instrumentation()
 
 
 class MillingProcessData:
-    def __init__(self):
+    def __init__(self, feature_backend=None, dq_backend=None, path_data=None):
         self.owner = "ptw"
-        self.docker_client = docker.from_env()
+        self.process_class = "milling_process"
+        self._docker_client = None
         self.tmp_dir = os.path.abspath(
             os.path.join(os.path.dirname(os.path.realpath(__file__)), "../tmp_files")
         )
         self._path = os.path.join(
-            config.DATASET_PATH,
+            config.DATASET_PATH if path_data is None else path_data,
             "cylinder_bottom",
             "cnc_milling_machine",
             "process_data",
         )
-        self._init_path_dict()
+        # parts are looked up in the dataset manifest next to the process data
+        # folder, brought up to date on the first lookup of a part by its id
+        self._manifest = DatasetManifest(
+            None
+            if config.MANIFEST_FILE_NAME is None
+            else os.path.join(os.path.dirname(self._path), config.MANIFEST_FILE_NAME)
+        )
+        self._part_id_path_dict = None
+        self.feature_backend = get_feature_backend(feature_backend)
+        self._part_cache = PartDataCache()
+        self._feature_store = FeatureStore(config.FEATURE_STORE_PATH)
+        self._outbox = Outbox(config.OUTBOX_PATH)
+        self.dq_backend = config.DQ_BACKEND if dq_backend is None else dq_backend
         self.pwd = config.pwd
         self.cid = config.cid
         self.model = config.model
@@ -86,13 +124,98 @@ class MillingProcessData:
             "aaLoad6",
         ]
 
+    def __getstate__(self):
+        # docker clients can't be pickled, copies sent to worker processes go without
+        state = self.__dict__.copy()
+        state["_docker_client"] = None
+        return state
+
+    @property
+    def docker_client(self):
+        # connecting to the docker daemon waits for the first data QH upload
+        if self._docker_client is None:
+            self._docker_client = get_docker_client()
+        return self._docker_client
+
     def _init_path_dict(self):
-        p = Path(self._path)
-        subdirectories = [x for x in p.iterdir() if x.is_dir()]
-        self._part_id_paths = {
-            os.path.basename(path).split("_")[0]: path for path in subdirectories
+        self.update_manifest()
+        self._part_id_path_dict = {
+            part_id: Path(path)
+            for part_id, path in self._manifest.get_paths(self.process_class).items()
+        }
+
+    @property
+    def _part_id_paths(self):
+        if self._part_id_path_dict is None:
+            self._init_path_dict()
+        return self._part_id_path_dict
+
+    def get_part_files(self, path):
+        files = []
+        for side in ["side_1", "side_2"]:
+            ts_path, acc_path = self.get_side_files(path, side, "acc")
+            files.extend([ts_path, acc_path, self.get_side_files(path, side, "bfc")[1]])
+        return files
+
+    def list_part_folders(self, verify=False):
+        """{part_id: (folder, fingerprint)} of the part folders, fingerprints only with verify."""
+        parts = {}
+        for path in Path(self._path).iterdir():
+            if path.is_dir():
+                parts[os.path.basename(path).split("_")[0]] = (
+                    str(path),
+                    file_fingerprint(self.get_part_files(path)) if verify else None,
+                )
+        return parts
+
+    def get_manifest_entry(self, path):
+        files = self.get_part_files(path)
+        n_samples, first_times, last_times = 0, [], []
+        for side in ["side_1", "side_2"]:
+            with LazySignalFile(self.get_side_files(path, side, "acc")[1]) as signal_file:
+                n_samples += len(signal_file)
+                if len(signal_file):
+                    first_times.append(signal_file.time_at(0) / 1e6)
+                    last_times.append(signal_file.time_at(len(signal_file) - 1) / 1e6)
+        sizes = [os.path.getsize(file) for file in files]
+        return {
+            "part_id": os.path.basename(path).split("_")[0],
+            "path": str(path),
+            "files": [[file, size] for file, size in zip(files, sizes)],
+            "nbytes": sum(sizes),
+            "n_samples": n_samples,
+            "first_time": float(min(first_times)) if first_times else None,
+            "last_time": float(max(last_times)) if last_times else None,
+            "offset": None,
+            "fingerprint": file_fingerprint(files),
         }
 
+    def update_manifest(self, verify=False, n_workers=None):
+        """Indexes new part folders in the dataset manifest and drops removed ones.
+
+        The folders are only listed when the process data folder changed. With
+        verify, every part folder is listed and parts whose files changed are
+        indexed again. Returns the number of changed entries.
+        """
+        n_workers = config.N_WORKERS if n_workers is None else n_workers
+        with instrumentation.timer("index", self.process_class):
+            n_changed = self._manifest.update(
+                self.process_class,
+                self._path,
+                None if verify else file_fingerprint([self._path]),
+                lambda: self.list_part_folders(verify),
+                lambda paths: run_parts(self, "get_manifest_entry", paths, n_workers),
+            )
+        if n_changed:
+            instrumentation.count("parts_indexed", self.process_class, n_changed)
+            self._part_id_path_dict = None
+        return n_changed
+
+    def get_part_ids(self, start=None, stop=None, shard=None, n_shards=None):
+        """Part ids of the dataset sorted by id, see DatasetManifest.get_part_ids."""
+        self.update_manifest()
+        return self._manifest.get_part_ids(self.process_class, start, stop, shard, n_shards)
+
     def get_sorted_timestamps_processes(self, ts_data):
         timestamps = np.array([float(key) * 1e6 for key in ts_data.keys()])
         processes = np.array([ts_data[key] for key in ts_data.keys()])
@@ -102,212 +225,397 @@ class MillingProcessData:
 
         return timestamps, processes
 
-    def extract_bfc_features(self, bfc_data):
-        features = extract_features(
+    def extract_bfc_features(self, bfc_data, segments=None):
+        features = self.feature_backend.extract_features(
             bfc_data,
             column_sort="time",
             column_id="id",
-            default_fc_parameters=MinimalFCParameters(),
+            segments=segments,
         )
         return features
 
-    def extract_acc_features(self, acc_data):
+    def extract_acc_features(self, acc_data, segments=None):
         acc_data = acc_data.fillna(0, inplace=False)
-        features = extract_features(
+        features = self.feature_backend.extract_features(
             acc_data,
             column_sort="time",
             column_id="id",
-            default_fc_parameters=MinimalFCParameters(),
+            segments=segments,
         )
         return features
 
     def read_raw_acc(self, name, acc_data, ts_data):
         timestamps, processes = self.get_sorted_timestamps_processes(ts_data)
-        data = pd.DataFrame(columns=["id", "time", *self.acc_features])
-        for i in range(len(timestamps)):
-            if i < len(timestamps) - 1:
-                process_data = acc_data[
-                    (
-                        (acc_data[:, 0] >= timestamps[i])
-                        & (acc_data[:, 0] < timestamps[i + 1])
-                    )
-                ]
-            else:
-                process_data = acc_data[acc_data[:, 0] >= timestamps[i]]
-
-            process_data = pd.DataFrame(
-                columns=["id", "time", *self.acc_features],
-                data={
-                    "id": [name + "_" + processes[i]] * len(process_data),
-                    "time": process_data[:, 0],
-                    "acc_x": process_data[:, 1],
-                    "acc_y": process_data[:, 2],
-                    "acc_z": process_data[:, 3],
-                },
-            )
-            data = pd.concat([data, process_data])
-
-        return data
+        process_rows, lengths = split_segments(acc_data[:, :4], timestamps)
+        return to_long_frame(
+            [name + "_" + process for process in processes],
+            process_rows,
+            lengths,
+            ["time", *self.acc_features],
+        )
 
     def new_read_raw_bfc(self, name, bfc_data, ts_data):
         timestamps, processes = self.get_sorted_timestamps_processes(ts_data)
         timestamps = timestamps / 1e6
-        data = pd.DataFrame(columns=["id", "time", *self.bfc_features])
         # print("difference first timestamp bfc_features " + str(timestamps[0] - bfc_data[0][0]) + " on side " + name)
         # print("difference last timestamp bfc_features " + str(timestamps[-1] - bfc_data[-1][0]) + " on side " + name)
-        for i in range(len(timestamps)):
-            if len(bfc_data[(bfc_data[:, 0] >= timestamps[i])]) == 0:
+        last_ts = np.nanmax(bfc_data[:, 0]) if len(bfc_data) else -np.inf
+        for ts in timestamps:
+            if not last_ts >= ts:
                 print("WARNING")
-            if i < len(timestamps) - 1:
-                bfc_process_data = bfc_data[
-                    (
-                        (bfc_data[:, 0] >= timestamps[i])
-                        & (bfc_data[:, 0] < timestamps[i + 1])
-                    )
-                ]
-            else:
-                bfc_process_data = bfc_data[bfc_data[:, 0] >= timestamps[i]]
 
-            # safeguard to ensure shape of bfc_data even when no correspondences can be made
-            len_bfc_process_data = len(bfc_process_data[:, 0])
-            if len_bfc_process_data == 0:
-                len_bfc_process_data = 1
-                bfc_process_data = np.zeros((1, bfc_data.shape[1]))
-
-            process_data = pd.DataFrame(
-                columns=["id", "time"],
-                data={
-                    "id": [name + "_" + processes[i]] * len_bfc_process_data,
-                    "time": bfc_process_data[:, 0],
-                },
-            )
-            for feature_idx, feature in enumerate(self.bfc_features):
-                process_data[feature] = bfc_process_data[:, feature_idx + 1]
-
-            data = pd.concat([data, process_data])
-        return data
+        # safeguard to ensure shape of bfc_data even when no correspondences can be made
+        process_rows, lengths = split_segments(
+            bfc_data[:, : len(self.bfc_features) + 1], timestamps, fill_empty=True
+        )
+        return to_long_frame(
+            [name + "_" + process for process in processes],
+            process_rows,
+            lengths,
+            ["time", *self.bfc_features],
+        )
 
     def read_raw_bfc(self, name, bfc_data, ts_data):
+        """Long frame of bfc messages with "set": {"timestamp": ..., "datapoints": [...]}.
+
+        Messages outside of all process windows are attributed to the last
+        process. Datapoints missing from a message are NaN.
+        """
         timestamps, processes = self.get_sorted_timestamps_processes(ts_data)
 
-        process_data = {key: [] for key in self.bfc_features}
-        process_data["id"] = []
-        process_data["time"] = []
-
-        for bfc_message in bfc_data:
-            ts = ciso8601.parse_datetime(bfc_message["set"]["timestamp"])
-            ts = ts.timestamp() * 1e6
-            process_data["time"].append(ts)
-
-            for i in range(len(timestamps)):
-                if i < len(timestamps) - 1:
-                    if (ts >= timestamps[i]) & (ts < timestamps[i + 1]):
-                        process_data["id"].append(name + "_" + processes[i])
-                        break
-                else:
-                    process_data["id"].append(name + "_" + processes[i])
-
-            datapoints = bfc_message["set"]["datapoints"]
-            for datapoint in datapoints:
-                for feature_name in self.bfc_features:
-                    if feature_name == datapoint["name"]:
-                        process_data[feature_name].append(datapoint["value"])
-
-        data = pd.DataFrame(
-            columns=["id", "time", *self.bfc_features], data=process_data
+        # the datapoints of all messages in one flat list, with the column of their name
+        columns = {feature: i for i, feature in enumerate(self.bfc_features)}
+        datapoints = [bfc_message["set"]["datapoints"] for bfc_message in bfc_data]
+        rows = np.repeat(
+            np.arange(len(datapoints)), [len(message) for message in datapoints]
         )
-        return data
+        cols = np.array(
+            [columns.get(datapoint["name"], -1) for message in datapoints for datapoint in message],
+            dtype=np.int64,
+        )
+        # values of other signals are left out, they need not be numbers
+        values = np.array(
+            [
+                datapoint["value"] if datapoint["name"] in columns else np.nan
+                for message in datapoints
+                for datapoint in message
+            ],
+            dtype=float,
+        )
+        process_data = np.full((len(bfc_data), len(self.bfc_features)), np.nan)
+        process_data[rows[cols >= 0], cols[cols >= 0]] = values[cols >= 0]
 
-    def read_raw_from_folder(self, path):
-        side_1_acc = "frontside_external_sensor_signals.h5"
-        side_2_acc = "backside_external_sensor_signals.h5"
-        side_1_ts = "frontside_timestamp_process_pairs.csv"
-        side_2_ts = "backside_timestamp_process_pairs.csv"
-        side_1_bfc = "frontside_internal_machine_signals.h5"
-        side_2_bfc = "backside_internal_machine_signals.h5"
+        times = parse_timestamps(
+            [bfc_message["set"]["timestamp"] for bfc_message in bfc_data]
+        )
+        labels = np.searchsorted(timestamps, times, side="right") - 1
+        labels[labels < 0] = len(timestamps) - 1
+        codes, names = pd.factorize(
+            np.asarray([name + "_" + process for process in processes], dtype=object)
+        )
+        # without any process the ids stay missing
+        codes = np.append(codes, -1)
 
-        part_id = os.path.basename(path).split("_")[0]
+        data = pd.DataFrame(process_data, columns=self.bfc_features, copy=False)
+        data.insert(0, "time", times)
+        data.insert(0, "id", pd.Categorical.from_codes(codes[labels], categories=names))
+        return data
 
-        side_1_acc = h5py.File(os.path.join(path, side_1_acc))
-        side_1_acc_data = np.array(side_1_acc["data"])
+    def read_timestamp_process_pairs(self, path):
+        ts_data = {}
+        with open(path, newline="") as csvfile:
+            reader = csv.reader(csvfile, delimiter=",", quotechar="|")
+            for row in reader:
+                ts_data[row[0]] = row[1]
+        return ts_data
+
+    def get_side_files(self, path, side, signal):
+        file_prefix = {"side_1": "frontside", "side_2": "backside"}[side]
+        if signal == "acc":
+            file_name = file_prefix + "_external_sensor_signals.h5"
+        else:
+            file_name = file_prefix + "_internal_machine_signals.h5"
+        return (
+            os.path.join(path, file_prefix + "_timestamp_process_pairs.csv"),
+            os.path.join(path, file_name),
+        )
 
-        side_2_acc = h5py.File(os.path.join(path, side_2_acc))
-        side_2_acc_data = np.array(side_2_acc["data"])
+    def read_raw_side(self, path, side, signal, processes=None):
+        ts_path, signal_path = self.get_side_files(path, side, signal)
+        ts_data = self.read_timestamp_process_pairs(ts_path)
+        timestamps, process_names = self.get_sorted_timestamps_processes(ts_data)
+        ids = [side + "_" + process for process in process_names]
+        windows = [
+            i for i, id in enumerate(ids) if processes is None or id in processes
+        ]
 
-        side_1_bfc = h5py.File(os.path.join(path, side_1_bfc))
-        side_1_bfc_data = np.array(side_1_bfc["data"])
+        if signal == "acc":
+            columns = ["time", *self.acc_features]
+        else:
+            columns = ["time", *self.bfc_features]
+            timestamps = timestamps / 1e6
+
+        with LazySignalFile(
+            signal_path, chunk_cache_bytes=config.H5_CHUNK_CACHE_BYTES
+        ) as signal_file:
+            if signal == "bfc":
+                last_ts = (
+                    signal_file.time_at(len(signal_file) - 1)
+                    if len(signal_file)
+                    else -np.inf
+                )
+                for i in windows:
+                    if not last_ts >= timestamps[i]:
+                        print("WARNING")
+            # safeguard to ensure shape of bfc_data even when no correspondences can be made
+            process_rows, lengths = signal_file.read_windows(
+                timestamps, windows, len(columns), fill_empty=signal == "bfc"
+            )
+        return [ids[i] for i in windows], process_rows, lengths
 
-        side_2_bfc = h5py.File(os.path.join(path, side_2_bfc))
-        side_2_bfc_data = np.array(side_2_bfc["data"])
+    def read_raw_signal(self, path, signal, sides=None, processes=None):
+        return self.read_raw_segments(path, signal, sides, processes)[0]
 
-        side_1_ts_data = {}
-        with open(os.path.join(path, side_1_ts), newline="") as csvfile:
-            reader = csv.reader(csvfile, delimiter=",", quotechar="|")
-            for row in reader:
-                side_1_ts_data[row[0]] = row[1]
+    def read_raw_segments(self, path, signal, sides=None, processes=None):
+        """Long frame of a signal together with its segment index (see get_segment_index).
 
-        side_2_ts_data = {}
-        with open(os.path.join(path, side_2_ts), newline="") as csvfile:
-            reader = csv.reader(csvfile, delimiter=",", quotechar="|")
-            for row in reader:
-                side_2_ts_data[row[0]] = row[1]
+        The index has one row per process, with its side, so processes can be
+        looked up by row offset instead of by comparing ids.
+        """
+        sides = ("side_1", "side_2") if sides is None else tuple(sides)
+        processes = None if processes is None else tuple(processes)
+        fingerprint = file_fingerprint(
+            [file for side in sides for file in self.get_side_files(path, side, signal)]
+        )
 
-        acc_data_side_1 = self.read_raw_acc("side_1", side_1_acc_data, side_1_ts_data)
-        acc_data_side_2 = self.read_raw_acc("side_2", side_2_acc_data, side_2_ts_data)
-        acc_data = pd.concat([acc_data_side_1, acc_data_side_2])
+        key = (str(path), signal, sides, processes)
+        data = self._part_cache.get(key, fingerprint)
+        if data is None and processes is not None:
+            # a cached read of all processes already contains the requested ones
+            data = self._part_cache.get(key[:-1] + (None,), fingerprint)
+            if data is not None:
+                return select_segments(*data, processes)
+        if data is None:
+            data = self.load_raw_signal(path, signal, sides, processes)
+            self._part_cache.put(key, fingerprint, data)
+        return data
 
-        bfc_data_side_1 = self.new_read_raw_bfc(
-            "side_1", side_1_bfc_data, side_1_ts_data
-        )
-        bfc_data_side_2 = self.new_read_raw_bfc(
-            "side_2", side_2_bfc_data, side_2_ts_data
-        )
-        bfc_data = pd.concat([bfc_data_side_1, bfc_data_side_2])
+    def load_raw_signal(self, path, signal, sides, processes=None):
+        columns = ["time", *(self.acc_features if signal == "acc" else self.bfc_features)]
+        part_id = os.path.basename(path).split("_")[0]
+        ids, process_rows, lengths, id_sides = [], [], [], []
+        with instrumentation.timer("read", self.process_class, part_id):
+            for side in sides:
+                side_ids, side_rows, side_lengths = self.read_raw_side(
+                    path, side, signal, processes
+                )
+                ids.extend(side_ids)
+                process_rows.append(side_rows)
+                lengths.append(side_lengths)
+                id_sides.extend([side] * len(side_ids))
+        with instrumentation.timer("segment", self.process_class, part_id):
+            process_rows = (
+                process_rows[0] if len(process_rows) == 1 else np.concatenate(process_rows)
+            )
+            lengths = np.concatenate(lengths)
+            segments = get_segment_index(ids, lengths, process_rows[:, 0])
+            segments.insert(0, "side", id_sides)
+            data = to_long_frame(ids, process_rows, lengths, columns, copy=False)
+        return data, segments
+
+    def read_raw_from_folder(self, path, sides=None, processes=None, signals=None):
+        """Reads and segments the acc and bfc data of a part folder.
+
+        sides, processes and signals ("acc", "bfc") restrict what is read from
+        disk; a signal that was not requested is returned as None. Results are
+        shared through the reader's part cache and must not be modified in place.
+        """
+        part_id = os.path.basename(path).split("_")[0]
+        signals = ["acc", "bfc"] if signals is None else signals
+
+        acc_data, bfc_data = None, None
+        if "acc" in signals:
+            acc_data = self.read_raw_signal(path, "acc", sides, processes)
+        if "bfc" in signals:
+            bfc_data = self.read_raw_signal(path, "bfc", sides, processes)
 
         return part_id, acc_data, bfc_data
 
-    def get_processing_times(self, acc_data):
+    def get_processing_times(self, acc_data, segments=None):
+        segments = index_segments(acc_data) if segments is None else segments
         processing_times = {}
         for process_name in self.processes:
-            process_data = acc_data[acc_data.id == process_name]
+            segment = segments.loc[process_name]
             processing_times[process_name] = (
-                process_data.time.iloc[-1] - process_data.time.iloc[0]
+                segment.end_time - segment.start_time
             ) / 1e6
-            process_end_ts = process_data.time.iloc[-1]
+            process_end_ts = segment.end_time
         return process_end_ts, processing_times
 
-    def get_process_acc_features(self, id):
+    def extract_signal_features(self, data, segments, signal):
+        if signal == "acc":
+            return self.extract_acc_features(data, segments)
+        return self.extract_bfc_features(data, segments)
+
+    def collect_signal_features(self, data, segments, signal, features):
+        features.index = pd.Categorical(
+            features.index, categories=segments.index.unique(), ordered=True
+        )
+        signal_features = {"features": features.sort_index()}
+        if signal == "acc":
+            signal_features["process_end_ts"] = self.get_processing_times(
+                data, segments
+            )[0]
+        return signal_features
+
+    def compute_signal_features(self, path, signal):
+        data, segments = self.read_raw_segments(path, signal)
+        part_id = os.path.basename(path).split("_")[0]
+        with instrumentation.timer("extract", self.process_class, part_id):
+            features = self.extract_signal_features(data, segments, signal)
+        return self.collect_signal_features(data, segments, signal, features)
+
+    def get_signal_fingerprint(self, path, signal):
+        files = [
+            file
+            for side in ["side_1", "side_2"]
+            for file in self.get_side_files(path, side, signal)
+        ]
+        return file_fingerprint(files)
+
+    def get_signal_features(self, path, signal):
+        part_id = os.path.basename(path).split("_")[0]
+        return self._feature_store.get_or_compute(
+            "milling_" + signal,
+            part_id,
+            self.feature_backend.feature_set,
+            self.get_signal_fingerprint(path, signal),
+            lambda: self.compute_signal_features(path, signal),
+        )
+
+    def get_process_features_batch(
+        self, ids, signal="acc", n_workers=None, batch_size=100, batch_bytes=None
+    ):
+        """Features of many parts as one parts x (process, feature) frame.
+
+        Parts found in the feature store are taken from there, the others are
+        computed in n_workers processes (see compute_signal_features_many) and
+        stored.
+        """
+        features, missing = {}, []
+        for id in ids:
+            path = self._part_id_paths[id]
+            signal_features = self._feature_store.get(
+                "milling_" + signal,
+                id,
+                self.feature_backend.feature_set,
+                self.get_signal_fingerprint(path, signal),
+            )
+            if signal_features is None:
+                missing.append(id)
+            else:
+                features[id] = signal_features["features"]
+
+        for id, signal_features in self.compute_signal_features_many(
+            missing, signal, n_workers, batch_size, batch_bytes
+        ):
+            self._feature_store.put(
+                "milling_" + signal,
+                id,
+                self.feature_backend.feature_set,
+                self.get_signal_fingerprint(self._part_id_paths[id], signal),
+                signal_features,
+            )
+            features[id] = signal_features["features"]
+        return get_part_feature_frame({id: features[id] for id in ids})
+
+    def compute_signal_features_many(
+        self, ids, signal="acc", n_workers=None, batch_size=100, batch_bytes=None
+    ):
+        """Yields (id, signal features) of every id, computed in n_workers processes.
+
+        Backends without setup per call (batch_calls False) extract the
+        features in the workers, which only send back the feature rows. For
+        the others the workers read the parts and their features are extracted
+        with one backend call per batch_size parts, or fewer parts holding
+        batch_bytes (default Config.FEATURE_BATCH_BYTES) of raw data.
+        """
+        n_workers = config.N_WORKERS if n_workers is None else n_workers
+        batch_bytes = config.FEATURE_BATCH_BYTES if batch_bytes is None else batch_bytes
+        paths = {self._part_id_paths[id]: id for id in ids}
+        if not getattr(self.feature_backend, "batch_calls", True):
+            for path, signal_features, error in run_parts(
+                self, "compute_signal_features", list(paths), n_workers, args=(signal,)
+            ):
+                if error is not None:
+                    raise error
+                instrumentation.count("parts_extracted", self.process_class)
+                yield paths[path], signal_features
+            return
+
+        def read_parts():
+            for path, data, error in run_parts(
+                self, "read_raw_segments", list(paths), n_workers, args=(signal,)
+            ):
+                if error is not None:
+                    raise error
+                yield paths[path], data
+
+        for raw in iter_batches(read_parts(), batch_size, batch_bytes):
+            with instrumentation.timer("extract_batch", self.process_class):
+                batch_features = extract_features_batch(
+                    lambda data, segments: self.extract_signal_features(data, segments, signal),
+                    {id: data for id, (data, _) in raw.items()},
+                    {id: segments for id, (_, segments) in raw.items()},
+                )
+            instrumentation.count("parts_extracted", self.process_class, len(raw))
+            for id, (data, segments) in raw.items():
+                yield id, self.collect_signal_features(data, segments, signal, batch_features[id])
+
+    def get_process_acc_features(self, id, processes=None):
         path = self._part_id_paths[id]
-        part_id, acc_data, bfc_data = self.read_raw_from_folder(path)
-        process_end_ts, process_times = self.get_processing_times(acc_data)
-        acc_features = self.extract_acc_features(acc_data)
+        if processes is None:
+            return self.get_signal_features(path, "acc")["features"]
+        acc_data, segments = self.read_raw_segments(path, "acc", processes=processes)
+        acc_features = self.extract_acc_features(acc_data, segments)
         acc_features.index = pd.Categorical(
-            acc_features.index, categories=acc_data.id.unique(), ordered=True
+            acc_features.index, categories=segments.index.unique(), ordered=True
         )
         acc_features = acc_features.sort_index()
         return acc_features
 
-    def plot_raw_bfc_data(self, id):
+    def get_plot_rows(self, values, segments, max_points):
+        # the rows of a side are one block of the frame
+        start, end = segments.start.min(), segments.end.max()
+        if max_points is None:
+            return np.arange(start, end)
+        return decimate_segments(values, segments.start, segments.end, max_points)
+
+    def plot_raw_bfc_data(self, id, sides=None, max_points=4000):
+        """Plots max_points per line at most, as min/max of every bucket of
+        samples within a process (None plots every sample)."""
+        import matplotlib.pyplot as plt
+
         path = self._part_id_paths[id]
-        part_id, acc_data_expanded, bfc_data = self.read_raw_from_folder(path)
+        sides = ["side_1", "side_2"] if sides is None else sides
+        part_id = os.path.basename(path).split("_")[0]
+        bfc_data, segments = self.read_raw_segments(path, "bfc", sides=sides)
 
         def format_process_name(name):
             return " ".join(w.capitalize() for w in name.split("_"))
 
-        # Convert 'time' to seconds since the first timestamp
-        first_timestamp = bfc_data["time"].min()
-        bfc_data["time"] = (
-            bfc_data["time"] - first_timestamp
-        ) / 1e9  # Convert nanoseconds to seconds
+        # Time in seconds since the first timestamp, only converted for the plotted samples
+        times = bfc_data["time"].to_numpy()
+        first_timestamp = np.nanmin(times)
 
         # Select the columns you want to plot. For example, let's take the first four after 'time'
         columns_to_plot = ["measPos12", "measPos13", "actFeedRate1", "aaLoad6"]
 
         # Create plots for each 'side' prefix in the ID
-        for side_prefix in ["side_1_", "side_2_"]:
-            # Filter data for the current side
-            data_filtered = bfc_data[bfc_data["id"].str.startswith(side_prefix)]
-            unique_ids = data_filtered["id"].unique()
+        for side in sides:
+            side_prefix = side + "_"
+            # The rows of the current side are one block of the frame
+            side_segments = segments[segments.side == side]
 
             # Determine the number of subplots needed based on the number of columns to plot
             num_subplots = len(columns_to_plot)
@@ -321,15 +629,17 @@ class MillingProcessData:
 
             # Plot each selected column in a separate subplot
             for i, column in enumerate(columns_to_plot):
-                axs[i].plot(data_filtered["time"], data_filtered[column])
+                values = bfc_data[column].to_numpy()
+                rows = self.get_plot_rows(values, side_segments, max_points)
+                axs[i].plot((times[rows] - first_timestamp) / 1e9, values[rows])
                 axs[i].set_ylabel(column)
 
             axs[-1].set_xlabel("Time (s)")
 
-            # Draw vertical lines and add process names for each unique process ID
-            for uid in unique_ids:
-                id_data = data_filtered[data_filtered["id"] == uid]
-                min_time, max_time = id_data["time"].min(), id_data["time"].max()
+            # Draw vertical lines and add process names for each process segment
+            for uid, segment in side_segments.iterrows():
+                min_time = (segment.start_time - first_timestamp) / 1e9
+                max_time = (segment.end_time - first_timestamp) / 1e9
                 mid_time = (min_time + max_time) / 2
 
                 # Draw vertical lines at the start and end of each ID segment
@@ -355,28 +665,29 @@ class MillingProcessData:
             # Show the plot for the current side
             plt.show()
 
-    def plot_raw_acc_data(self, id):
+    def plot_raw_acc_data(self, id, sides=None, max_points=4000):
+        """Plots max_points per line at most, as min/max of every bucket of
+        samples within a process (None plots every sample)."""
+        import matplotlib.pyplot as plt
+
         path = self._part_id_paths[id]
-        part_id, acc_data_expanded, bfc_data = self.read_raw_from_folder(path)
-        process_end_ts, process_times = self.get_processing_times(acc_data_expanded)
+        sides = ["side_1", "side_2"] if sides is None else sides
+        part_id = os.path.basename(path).split("_")[0]
+        acc_data_expanded, segments = self.read_raw_segments(path, "acc", sides=sides)
 
-        # Convert 'time' to seconds since the first timestamp
-        first_timestamp = acc_data_expanded["time"].min()
-        acc_data_expanded["time"] = (
-            acc_data_expanded["time"] - first_timestamp
-        ) / 1e6  # Convert nanoseconds to seconds
+        # Time in seconds since the first timestamp, only converted for the plotted samples
+        times = acc_data_expanded["time"].to_numpy()
+        first_timestamp = np.nanmin(times)
 
         # Function to format process names
         def format_process_name(name):
             return " ".join(w.capitalize() for w in name.split("_"))
 
         # Create plots for each 'side' prefix in the ID
-        for side_prefix in ["side_1_", "side_2_"]:
-            # Filter data for the current side
-            data_filtered = acc_data_expanded[
-                acc_data_expanded["id"].str.startswith(side_prefix)
-            ]
-            unique_ids = data_filtered["id"].unique()
+        for side in sides:
+            side_prefix = side + "_"
+            # The rows of the current side are one block of the frame
+            side_segments = segments[segments.side == side]
 
             # Create subplots
             fig, axs = plt.subplots(3, 1, figsize=(12, 9), sharex=True)
@@ -385,9 +696,10 @@ class MillingProcessData:
             )
 
             # Plot each accelerometer axis
-            axs[0].plot(data_filtered["time"], data_filtered["acc_x"])
-            axs[1].plot(data_filtered["time"], data_filtered["acc_y"])
-            axs[2].plot(data_filtered["time"], data_filtered["acc_z"])
+            for ax, column in zip(axs, ["acc_x", "acc_y", "acc_z"]):
+                values = acc_data_expanded[column].to_numpy()
+                rows = self.get_plot_rows(values, side_segments, max_points)
+                ax.plot((times[rows] - first_timestamp) / 1e6, values[rows])
 
             # Set labels for each subplot
             axs[0].set_ylabel("Acceleration X (g)")
@@ -399,10 +711,12 @@ class MillingProcessData:
             axs[1].set_ylim(-1.5, 1.5)
             axs[2].set_ylim(-1.5, 1.5)
 
-            # Draw vertical lines and add process names for each unique process ID
-            for uid in unique_ids:
-                id_data = data_filtered[data_filtered["id"] == uid]
-                min_time, max_time = id_data["time"].min(), id_data["time"].max()
+            # Draw vertical lines and add process names for each process segment
+            for uid, segment in side_segments[
+                side_segments.end > side_segments.start
+            ].iterrows():
+                min_time = (segment.start_time - first_timestamp) / 1e6
+                max_time = (segment.end_time - first_timestamp) / 1e6
                 mid_time = (min_time + max_time) / 2
 
                 # Draw vertical lines at the start and end of each ID segment
@@ -429,29 +743,25 @@ class MillingProcessData:
             plt.show()
 
     def get_process_QH_path(self, path):
-        part_id, acc_data, bfc_data = self.read_raw_from_folder(path)
-        process_end_ts, process_times = self.get_processing_times(acc_data)
-        acc_features = self.extract_acc_features(acc_data)
-        bfc_features = self.extract_bfc_features(bfc_data)
-
-        acc_features.index = pd.Categorical(
-            acc_features.index, categories=acc_data.id.unique(), ordered=True
-        )
-        bfc_features.index = pd.Categorical(
-            bfc_features.index, categories=acc_data.id.unique(), ordered=True
-        )
-        acc_features = acc_features.sort_index()
-        bfc_features = bfc_features.sort_index()
+        part_id = os.path.basename(path).split("_")[0]
+        acc = self.get_signal_features(path, "acc")
+        process_end_ts, acc_features = acc["process_end_ts"], acc["features"]
+        bfc_features = self.get_signal_features(path, "bfc")["features"]
+        with instrumentation.timer("document", self.process_class, part_id):
+            return self.build_process_QH_document(
+                part_id, process_end_ts, acc_features, bfc_features
+            )
 
+    def build_process_QH_document(
+        self, part_id, process_end_ts, acc_features, bfc_features, subject=None
+    ):
         qh_document = {
             "pwd": self.pwd,
             "cid": self.cid,
             "qhd": {
                 "qhd-header": {
                     "owner": self.owner,
-                    "subject": "part::cylinder_bottom,part_id::"
-                    + part_id
-                    + ",process::milling,type::process_qh",
+                    "subject": subject or self.get_process_QH_subject(part_id),
                     "timeref": datetime.datetime.fromtimestamp(
                         process_end_ts / 1e6
                     ).strftime("%Y-%m-%dT%H:%M:%S+01:00"),
@@ -465,12 +775,16 @@ class MillingProcessData:
         for process_name in self.processes:
             qh_document["qhd"]["qhd-body"][process_name] = {
                 "features_acc": {
-                    "IND_" + feature: acc_features.loc[process_name, feature]
-                    for feature in acc_features.columns
+                    "IND_" + feature: value
+                    for feature, value in zip(
+                        acc_features.columns, acc_features.loc[process_name].to_numpy()
+                    )
                 },
                 "features_bfc": {
-                    "IND_" + feature: bfc_features.loc[process_name, feature]
-                    for feature in bfc_features.columns
+                    "IND_" + feature: value
+                    for feature, value in zip(
+                        bfc_features.columns, bfc_features.loc[process_name].to_numpy()
+                    )
                 },
             }
         return qh_document
@@ -478,42 +792,59 @@ class MillingProcessData:
     def get_process_QH_id(self, id):
         return self.get_process_QH_path(self._part_id_paths[id])
 
-    def get_data_QH_path(self, path, container_name):
-        part_id, acc_data, bfc_data = self.read_raw_from_folder(path)
+    def get_process_QH_subject(self, id):
+        return "part::cylinder_bottom,part_id::" + id + ",process::milling,type::process_qh"
 
-        # Reformat timestamps to iso8601 for the data quality analysis to work
-        acc_data.time = pd.to_datetime(acc_data.time / 1e6, unit="s").dt.strftime(
-            "%Y-%m-%dT%H:%M:%S+01:00"
-        )
-        bfc_data.time = pd.to_datetime(bfc_data.time / 1e6, unit="s").dt.strftime(
-            "%Y-%m-%dT%H:%M:%S+01:00"
+    def get_process_QH_stream_subject(self, id):
+        # the median of a streamed part is approximate, its document must not
+        # replace the one built from the part folder
+        return self.get_process_QH_subject(id) + ",mode::stream"
+
+    def get_data_QH_path(self, path, container_name=None):
+        import requests
+
+        part_id, acc_data, _ = self.read_raw_from_folder(path, signals=["acc"])
+        times = pd.to_datetime(acc_data.time / 1e6, unit="s")
+        if self.dq_backend == "local":
+            with instrumentation.timer("dq", self.process_class, part_id):
+                return analyze_data_quality(
+                    self.dqaas_endpoint, times, acc_data.acc_x, "time", "acc_x", "+01:00"
+                )
+
+        # Only the columns the data quality analysis looks at are uploaded,
+        # with timestamps reformatted to iso8601 for it to work
+        acc_data = pd.DataFrame(
+            {
+                "time": format_timestamps(times, "+01:00"),
+                "acc_x": acc_data.acc_x,
+            }
         )
 
-        # Save as .csv and copy into docker container
-        acc_path = os.path.join(self.tmp_dir, "tmp_acc_data.csv")
-        bfc_path = os.path.join(self.tmp_dir, "tmp_bfc_data.csv")
-        acc_data.to_csv(acc_path)
-        bfc_data.to_csv(bfc_path)
-
-        container = self.docker_client.containers.get(container_name)
-        copy_to_container(container, src=acc_path, dst_dir="/app/data/")
-        copy_to_container(container, src=bfc_path, dst_dir="/app/data/")
-
-        # Call the containers rest API with a rule
-        query_params = {
-            "file_name": "tmp_acc_data.csv",
-            "ts_column": "time",
-            "value_column_1": "acc_x",
-            "qhd_key": "interq_qhd",
-        }
-        response = requests.get(self.dqaas_endpoint, params=query_params)
+        # Stream as .csv into the docker container, a unique name per upload
+        # keeps concurrent runs from overwriting each other's data
+        file_name = "tmp_acc_data_" + part_id + "_" + uuid.uuid4().hex + ".csv"
+        with instrumentation.timer("dq", self.process_class, part_id):
+            container = self.docker_client.containers.get(container_name)
+            copy_frame_to_container(container, acc_data, "/app/data/", file_name)
+
+            # Call the containers rest API with a rule
+            query_params = {
+                "file_name": file_name,
+                "ts_column": "time",
+                "value_column_1": "acc_x",
+                "qhd_key": "interq_qhd",
+            }
+            try:
+                response = requests.get(self.dqaas_endpoint, params=query_params)
+            finally:
+                remove_from_container(container, "/app/data/" + file_name)
         response = json.loads(response.content)
         return response
 
-    def get_raw_data_QH_id(self, id, container_name):
+    def get_raw_data_QH_id(self, id, container_name=None):
         return self.get_data_QH_path(self._part_id_paths[id], container_name)
 
-    def get_data_QH_id(self, id, container_name):
+    def get_data_QH_id(self, id, container_name=None):
         data_qh = self.get_data_QH_path(self._part_id_paths[id], container_name)
         process_qh = self.get_process_QH_id(id)
 
@@ -542,24 +873,33 @@ class MillingProcessData:
         )
         return data_qh
 
-    def publish_process_QH_id(self, id):
-        qh_document = self.get_process_QH_id(id)
-        print("publishing document:")
-        # jprint(qh_document)
-        response = requests.post(self.api_endpoint, json=qh_document)
-        response = json.loads(response.content)
-        print("got response: ")
-        jprint(response)
+    def publish_QH_document(self, qh_document, id=None):
+        instrumentation.log("publishing document:")
+        # instrumentation.log_json(qh_document)
+        with instrumentation.timer("publish", self.process_class, id):
+            response = get_publisher(self.api_endpoint).post(qh_document)
+        instrumentation.log("got response: ")
+        instrumentation.log_json(response)
         return response
 
-    def publish_data_QH_id(self, id, container_name):
+    def publish_process_QH_id(self, id):
+        return self.publish_QH_document(self.get_process_QH_id(id), id)
+
+    def publish_process_QH_stream(self, events):
+        """Publishes the process QH document of every part in a live event stream
+        (see streaming.stream_process_QH) as soon as the part ends, under the
+        subject of get_process_QH_stream_subject."""
+        for id, qh_document in stream_process_QH(self, events):
+            self.publish_QH_document(qh_document, id)
+
+    def publish_data_QH_id(self, id, container_name=None):
         data_qh = self.get_data_QH_id(id, container_name)
-        print("publishing document:")
-        # jprint(data_qh)
-        response = requests.post(self.api_endpoint, json=data_qh)
-        response = json.loads(response.content)
-        print("got response: ")
-        jprint(response)
+        instrumentation.log("publishing document:")
+        # instrumentation.log_json(data_qh)
+        with instrumentation.timer("publish", self.process_class, id):
+            response = get_publisher(self.api_endpoint).post(data_qh)
+        instrumentation.log("got response: ")
+        instrumentation.log_json(response)
         return response
 
     def reformatAtomicFields(self, document):
@@ -571,27 +911,55 @@ class MillingProcessData:
                 document[attribute] = self.reformatAtomicFields(document[attribute])
         return document
 
-    def publish_all_process_and_data_qh(self):
+    def publish_all_process_and_data_qh(self, n_workers=None):
+        """Posts the process QH documents of all parts to api_endpoint, built in
+        n_workers processes.
+
+        Parts whose subject api_endpoint acknowledged before according to the
+        outbox (Config.OUTBOX_PATH) are skipped, also if the database behind
+        the endpoint changed since. Call self._outbox.clear(self.api_endpoint)
+        to post them again. Parts whose documents api_endpoint rejected
+        Config.OUTBOX_MAX_ATTEMPTS times are reported as errors instead of
+        being posted again.
+        """
+        n_workers = config.N_WORKERS if n_workers is None else n_workers
+        publisher = get_publisher(self.api_endpoint)
         with open("milling_process_error_list.txt", "a", newline="") as f:
             writer = csv.writer(f)
-            for id in self._part_id_paths:
-                try:
-                    response = self.publish_process_QH_id(id)
-                    if "uuid" in response.keys():
-                        continue
-                    else:
-                        if "not unique" in response["message"]:
-                            print("hallmark already posted")
-                        while "some error condition" in response["message"]:
-                            response = self.publish_process_QH_id(id)
-                            if "uuid" in response.keys():
-                                break
-
-                    # self.publish_data_QH_id(id, "angry_williamson")
-                except Exception as error:
-                    print(error)
-                    writer.writerow(["error in " + str(id)])
-                    writer.writerow([str(error)])
+            # documents are built in worker processes and posted from here,
+            # the publisher keeps several posts in flight and retries failed ones.
+            # Acknowledged parts are skipped and unsent documents replayed from the outbox
+            documents = self._outbox.resume(
+                self.api_endpoint,
+                self.get_part_ids(),
+                self.get_process_QH_subject,
+                lambda ids: run_parts(self, "get_process_QH_id", ids, n_workers),
+            )
+            with instrumentation.timer("publish_all", self.process_class):
+                for id, response, error in publisher.post_many(documents):
+                    try:
+                        if error is not None:
+                            raise error
+                        instrumentation.log("got response: ")
+                        instrumentation.log_json(response)
+                        if self._outbox.acknowledge(
+                            self.api_endpoint, self.get_process_QH_subject(id), response
+                        ):
+                            instrumentation.count("published", self.process_class, part_id=id)
+                        else:
+                            # failed in the outbox, see Outbox.get_failed
+                            instrumentation.count("rejected", self.process_class, part_id=id)
+                        if "uuid" not in response.keys():
+                            if "not unique" in response["message"]:
+                                instrumentation.log("hallmark already posted")
+
+                        # self.publish_data_QH_id(id, "angry_williamson")
+                    except Exception as error:
+                        print(error)
+                        instrumentation.count("errors", self.process_class, part_id=id)
+                        writer.writerow(["error in " + str(id)])
+                        writer.writerow([str(error)])
+        instrumentation.flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+
+
+def get_segment_bounds(times, timestamps):
+    """Locate the process windows [timestamps[i], timestamps[i + 1]) in times.
+
+    Returns the row order (None if times is already sorted) and the start and
+    end offset of every window within that order. Rows before the first
+    timestamp or with a NaN time fall outside of all windows.
+    """
+    times = np.asarray(times)
+    timestamps = np.asarray(timestamps)
+    if len(times) < 2 or np.all(times[1:] >= times[:-1]):
+        order = None
+        starts = np.searchsorted(times, timestamps, side="left")
+    else:
+        labels = np.searchsorted(timestamps, times, side="right") - 1
+        labels[np.isnan(times)] = -1
+        # a stable sort keeps the on-disk order of the rows within each window
+        order = np.argsort(labels, kind="stable")
+        starts = np.searchsorted(
+            labels[order], np.arange(len(timestamps)), side="left"
+        )
+    ends = np.append(starts[1:], len(times)).astype(starts.dtype)
+    return order, starts, ends
+
+
+def split_segments(data, timestamps, fill_empty=False):
+    """Cut the rows of data into the process windows given by timestamps.
+
+    The first column of data holds the time. Returns the rows of all windows
+    in window order and the number of rows per window. With fill_empty, an
+    empty window is represented by a single row of zeros.
+    """
+    order, starts, ends = get_segment_bounds(data[:, 0], timestamps)
+    if order is not None:
+        data = data[order]
+    lengths = ends - starts
+
+    if len(starts) == 0:
+        return data[:0], lengths
+    if fill_empty and np.any(lengths == 0):
+        zero_row = np.zeros((1, data.shape[1]), dtype=data.dtype)
+        rows = np.concatenate(
+            [data[s:e] if e > s else zero_row for s, e in zip(starts, ends)]
+        )
+        return rows, np.maximum(lengths, 1)
+    # windows are adjacent, so their rows form one contiguous block
+    return data[starts[0] : ends[-1]], lengths
+
+
+def get_id_column(ids, lengths):
+    """Categorical id column of consecutive segments of the given lengths.
+
+    Every sample holds a small integer code into the segment names instead of
+    its own string object.
+    """
+    codes, names = pd.factorize(np.asarray(ids, dtype=object))
+    return pd.Categorical.from_codes(np.repeat(codes, lengths), categories=names)
+
+
+def to_long_frame(ids, rows, lengths, columns, copy=True):
+    """Build the long-format (id, *columns) frame of consecutive segments.
+
+    Every segment keeps its own 0-based index, as if the per-segment frames
+    had been concatenated. Pass copy=False if rows is a fresh buffer the frame
+    may take over.
+    """
+    offsets = np.cumsum(lengths) - lengths
+    index = np.arange(len(rows)) - np.repeat(offsets, lengths)
+    frame = pd.DataFrame(rows, columns=columns, index=index, copy=copy)
+    frame.insert(0, "id", get_id_column(ids, lengths))
+    return frame
+
+
+def get_segment_index(names, lengths, times):
+    """Table of consecutive segments, indexed by segment name.
+
+    Holds the start and end row offset (end exclusive) of every segment within
+    its long frame and its first and last timestamp, so a segment can be looked
+    up without scanning the id column. Empty segments get NaN timestamps.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    times = np.asarray(times, dtype=float)
+    starts = np.cumsum(lengths) - lengths
+    start_times = np.full(len(lengths), np.nan)
+    end_times = np.full(len(lengths), np.nan)
+    non_empty = lengths > 0
+    if non_empty.any():
+        # reduceat needs strictly increasing offsets, so empty segments are left out
+        start_times[non_empty] = np.fmin.reduceat(times, starts[non_empty])
+        end_times[non_empty] = np.fmax.reduceat(times, starts[non_empty])
+    return pd.DataFrame(
+        {
+            "start": starts,
+            "end": starts + lengths,
+            "start_time": start_times,
+            "end_time": end_times,
+        },
+        index=pd.Index(names, name="id"),
+    )
+
+
+def index_segments(data, column_id="id", column_sort="time"):
+    """Segment index of a long frame whose ids come in one run per segment."""
+    ids = data[column_id]
+    if isinstance(ids.dtype, pd.CategoricalDtype):
+        names, ids = ids.cat.categories, ids.cat.codes.to_numpy()
+    else:
+        names, ids = None, ids.to_numpy()
+    run_starts = np.flatnonzero(np.append(True, ids[1:] != ids[:-1])) if len(ids) else []
+    lengths = np.diff(np.append(run_starts, len(ids)))
+    return get_segment_index(
+        ids[run_starts] if names is None else names[ids[run_starts]],
+        lengths,
+        data[column_sort].to_numpy(dtype=float),
+    )
+
+
+def select_segments(data, segments, names):
+    """Rows and segment index of the named segments, in their original order."""
+    selected = segments[segments.index.isin(names)]
+    lengths = (selected.end - selected.start).to_numpy()
+    offsets = np.cumsum(lengths) - lengths
+    rows = np.arange(lengths.sum()) + np.repeat(selected.start.to_numpy() - offsets, lengths)
+    selected = selected.assign(start=offsets, end=offsets + lengths)
+    return data.iloc[rows], selected
+
+
+def decimate_segments(values, starts, ends, max_points):
+    """Row positions of a min/max decimation of the segments [starts, ends) of values.
+
+    The rows of every segment are cut into equal buckets, about max_points / 2
+    in total and proportional to the segment lengths, and the first minimum and
+    maximum of every bucket are kept. Peaks stay visible and no bucket spans
+    two segments. NaN values are only kept for buckets without other values.
+    """
+    values = np.asarray(values, dtype=float)
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(ends, dtype=np.int64) - starts
+    starts, lengths = starts[lengths > 0], lengths[lengths > 0]
+    if lengths.sum() <= max_points:
+        return np.arange(lengths.sum()) + np.repeat(
+            starts - (np.cumsum(lengths) - lengths), lengths
+        )
+
+    # only the rows covered by the segments are looked at
+    first, last = starts.min(), (starts + lengths).max()
+    values, starts = values[first:last], starts - first
+    low = high = values
+    nan = np.isnan(values)
+    if nan.any():
+        low, high = np.where(nan, np.inf, values), np.where(nan, -np.inf, values)
+    n_buckets = np.clip((max_points // 2) * lengths // lengths.sum(), 1, lengths)
+    positions = []
+    for start, length, size in zip(starts, lengths, -(-lengths // n_buckets)):
+        # full buckets are the rows of a reshaped view, the rest is one shorter bucket
+        full = length // size * size
+        offsets = start + np.arange(0, full, size)
+        for extremes, argfunc in ((low, np.argmin), (high, np.argmax)):
+            segment = extremes[start : start + length]
+            positions.append(offsets + argfunc(segment[:full].reshape(-1, size), axis=1))
+            if full < length:
+                positions.append([start + full + argfunc(segment[full:])])
+    return first + np.unique(np.concatenate(positions))
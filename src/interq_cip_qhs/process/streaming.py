@@ -0,0 +1,254 @@
+import ciso8601
+import numpy as np
+import pandas as pd
+from interq_cip_qhs.process.features import MINIMAL_FEATURES
+from interq_cip_qhs.config import Config
+
+config = Config()
+
+
+class RunningStatistics:
+    """MINIMAL_FEATURES per column of a stream of row chunks, in constant memory.
+
+    Count, sum, mean and variance are merged chunk by chunk (Welford's update
+    generalized to chunks by Chan et al.), extremes and the sum of squares are
+    kept as they are, all of them match the batch features up to rounding.
+    The median comes from every stride-th row, a sample of at most
+    max_samples rows: it is exact up to max_samples rows and otherwise the
+    median of more than max_samples / 2 evenly spaced rows, which is off by
+    about 1.25 / sqrt(max_samples / 2) standard deviations of a noisy signal
+    (under 0.03 for the default 4096) but can be further off for a signal
+    that is periodic in the stride. NaN values are left out per column.
+    """
+
+    def __init__(self, n_columns, max_samples=None):
+        self.max_samples = (
+            config.STREAM_MEDIAN_SAMPLES if max_samples is None else max_samples
+        )
+        self.n_rows = 0
+        self.count = np.zeros(n_columns)
+        self.sum = np.zeros(n_columns)
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+        self.sum_squares = np.zeros(n_columns)
+        self.maximum = np.full(n_columns, -np.inf)
+        self.minimum = np.full(n_columns, np.inf)
+        # every stride-th row since the first one
+        self.samples = np.empty((0, n_columns))
+        self.stride = 1
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.0)
+        count = valid.sum(axis=0)
+        chunk_sum = filled.sum(axis=0)
+        chunk_mean = np.divide(chunk_sum, count, out=np.zeros_like(chunk_sum), where=count > 0)
+        centered = np.where(valid, values - chunk_mean, 0.0)
+        total = self.count + count
+        weight = np.divide(count, total, out=np.zeros_like(chunk_sum), where=total > 0)
+        delta = chunk_mean - self.mean
+        self.m2 += (centered * centered).sum(axis=0) + delta * delta * self.count * weight
+        self.mean += delta * weight
+        self.count = total
+        self.sum += chunk_sum
+        self.sum_squares += (filled * filled).sum(axis=0)
+        self.maximum = np.maximum(self.maximum, np.where(valid, values, -np.inf).max(axis=0))
+        self.minimum = np.minimum(self.minimum, np.where(valid, values, np.inf).min(axis=0))
+
+        # widen the stride until the rows seen so far fit into the sample
+        stride = self.stride
+        while -(-(self.n_rows + len(values)) // stride) > self.max_samples:
+            stride *= 2
+        self.samples = self.samples[:: stride // self.stride]
+        self.stride = stride
+        self.samples = np.concatenate(
+            [self.samples, values[-self.n_rows % stride :: stride]]
+        )
+        self.n_rows += len(values)
+
+    def get_statistics(self):
+        """columns x MINIMAL_FEATURES, NaN for columns without values."""
+        empty = self.count == 0
+        count = np.where(empty, np.nan, self.count)
+        variance = self.m2 / count
+        median = np.full(len(count), np.nan)
+        for column in np.flatnonzero(~empty):
+            median[column] = np.nanmedian(self.samples[:, column])
+        stats = {
+            "sum_values": self.sum,
+            "median": median,
+            "mean": self.mean,
+            "length": self.count,
+            "standard_deviation": np.sqrt(variance),
+            "variance": variance,
+            "root_mean_square": np.sqrt(self.sum_squares / count),
+            "maximum": self.maximum,
+            "absolute_maximum": np.maximum(np.abs(self.maximum), np.abs(self.minimum)),
+            "minimum": self.minimum,
+        }
+        statistics = np.stack([stats[name] for name in MINIMAL_FEATURES], axis=1)
+        statistics[empty] = np.nan
+        return statistics
+
+
+class ProcessWindows:
+    """Running statistics of the process windows [start_i, start_(i + 1)) of one side.
+
+    Starts are in microseconds like the acc time, bfc times are in seconds.
+    Samples before the first start are dropped, like rows outside of all
+    windows when reading a part folder.
+    """
+
+    def __init__(self, n_acc, n_bfc):
+        self.n_acc, self.n_bfc = n_acc, n_bfc
+        self.starts = []
+        self.ids = []
+        self.acc = []
+        self.bfc = []
+        self.acc_end_times = []
+
+    def add(self, start, id):
+        if self.starts and start < self.starts[-1]:
+            raise ValueError("Process start out of order: " + id)
+        self.starts.append(start)
+        self.ids.append(id)
+        self.acc.append(RunningStatistics(self.n_acc))
+        self.bfc.append(RunningStatistics(self.n_bfc))
+        self.acc_end_times.append(np.nan)
+
+    def update(self, signal, times, values):
+        starts = np.asarray(self.starts)
+        if signal == "bfc":
+            starts = starts / 1e6
+        labels = np.searchsorted(starts, times, side="right") - 1
+        labels[np.isnan(times)] = -1
+        # a chunk mostly falls into a single window
+        for label in np.unique(labels[labels >= 0]):
+            rows = labels == label
+            if signal == "acc":
+                self.acc[label].update(values[rows])
+                self.acc_end_times[label] = np.fmax(
+                    self.acc_end_times[label], times[rows].max()
+                )
+            else:
+                self.bfc[label].update(values[rows])
+
+
+class MillingPartStream:
+    """Process QH document of a milling part built while its signals arrive.
+
+    Feed the process starts (the rows of the timestamp_process_pairs files),
+    the acc chunks and the bfc messages of both sides as they come in and call
+    finish once the part is done. Every sample is folded into the running
+    statistics of its process right away, so finishing only assembles the
+    document. The process starts of a side have to arrive in time order and
+    ahead of the samples of their process. The median is approximate (see
+    RunningStatistics), so the document has its own subject, see
+    get_process_QH_stream_subject, and never changes the one built from the
+    part folder.
+    """
+
+    def __init__(self, reader, part_id):
+        self.reader = reader
+        self.part_id = part_id
+        self.bfc_columns = {name: i for i, name in enumerate(reader.bfc_features)}
+        self.sides = {}
+
+    def get_windows(self, side):
+        if side not in self.sides:
+            self.sides[side] = ProcessWindows(
+                len(self.reader.acc_features), len(self.reader.bfc_features)
+            )
+        return self.sides[side]
+
+    def add_process_start(self, side, timestamp, process):
+        """timestamp in seconds, as in the timestamp_process_pairs files."""
+        self.get_windows(side).add(float(timestamp) * 1e6, side + "_" + process)
+
+    def add_acc(self, side, rows):
+        """rows of time (in microseconds), acc_x, acc_y, acc_z."""
+        rows = np.asarray(rows, dtype=float)
+        # missing acc values count as 0 like in extract_acc_features
+        values = rows[:, 1:]
+        self.get_windows(side).update("acc", rows[:, 0], np.where(np.isnan(values), 0.0, values))
+
+    def add_bfc(self, side, rows):
+        """rows of time (in seconds) and the bfc_features."""
+        rows = np.asarray(rows, dtype=float)
+        self.get_windows(side).update("bfc", rows[:, 0], rows[:, 1:])
+
+    def add_bfc_message(self, side, message):
+        """A machine message with "set": {"timestamp": ..., "datapoints": [...]}."""
+        row = np.full(len(self.bfc_columns) + 1, np.nan)
+        row[0] = ciso8601.parse_datetime(message["set"]["timestamp"]).timestamp()
+        for datapoint in message["set"]["datapoints"]:
+            column = self.bfc_columns.get(datapoint["name"])
+            if column is not None:
+                row[column + 1] = datapoint["value"]
+        self.add_bfc(side, row[None])
+
+    def get_features(self, signal, columns):
+        ids, statistics = [], []
+        for windows in self.sides.values():
+            for id, stats in zip(windows.ids, getattr(windows, signal)):
+                if signal == "bfc" and stats.n_rows == 0:
+                    # like an empty window when reading a part folder, a single row of zeros
+                    stats.update(np.zeros((1, len(columns))))
+                ids.append(id)
+                statistics.append(stats.get_statistics().ravel())
+        return pd.DataFrame(
+            np.array(statistics).reshape(len(ids), -1),
+            index=ids,
+            columns=[
+                column + "__" + name for column in columns for name in MINIMAL_FEATURES
+            ],
+        )
+
+    def finish(self):
+        """The process QH document of the part."""
+        end_times = {
+            id: end_time
+            for windows in self.sides.values()
+            for id, end_time in zip(windows.ids, windows.acc_end_times)
+        }
+        # the part ends with the last acc sample of its last process, as in get_processing_times
+        process_end_ts = end_times[self.reader.processes[-1]]
+        return self.reader.build_process_QH_document(
+            self.part_id,
+            process_end_ts,
+            self.get_features("acc", self.reader.acc_features),
+            self.get_features("bfc", self.reader.bfc_features),
+            self.reader.get_process_QH_stream_subject(self.part_id),
+        )
+
+
+def stream_process_QH(reader, events):
+    """Yields (part_id, process QH document) for every part of an event stream
+    as soon as its "part_end" event arrives.
+
+    events are (part_id, kind, side, payload) tuples, with kind "process_start"
+    and a (timestamp, process) payload, "acc" and a chunk of acc rows, "bfc"
+    and a bfc message or a chunk of bfc rows (see MillingPartStream), or
+    "part_end" without side and payload.
+    """
+    parts = {}
+    for part_id, kind, side, payload in events:
+        if kind == "part_end":
+            yield part_id, parts.pop(part_id).finish()
+            continue
+        if part_id not in parts:
+            parts[part_id] = MillingPartStream(reader, part_id)
+        part = parts[part_id]
+        if kind == "process_start":
+            part.add_process_start(side, *payload)
+        elif kind == "acc":
+            part.add_acc(side, payload)
+        elif kind == "bfc" and isinstance(payload, dict):
+            part.add_bfc_message(side, payload)
+        elif kind == "bfc":
+            part.add_bfc(side, payload)
+        else:
+            raise ValueError("Unknown event kind: " + str(kind))
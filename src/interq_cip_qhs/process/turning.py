@@ -1,28 +1,52 @@
 import json
-import h5py
-import docker
 import os
+import uuid
 import ciso8601
 import datetime
 import numpy as np
 import pandas as pd
-import requests
 import math
 from pathlib import Path
-from tsfresh.feature_extraction import extract_features, MinimalFCParameters
-from interq_cip_qhs.process.utils import copy_to_container, jprint
+from interq_cip_qhs.process.utils import copy_frame_to_container, format_timestamps, get_docker_client, remove_from_container
+from interq_cip_qhs.process.features import extract_features_batch, get_feature_backend, get_part_feature_frame
+from interq_cip_qhs.process.segmentation import get_id_column
+from interq_cip_qhs.process.cache import PartDataCache, array_fingerprint, file_fingerprint
+from interq_cip_qhs.process.hdf5 import get_part_file
+from interq_cip_qhs.process.feature_store import FeatureStore
+from interq_cip_qhs.process.manifest import DatasetManifest
+from interq_cip_qhs.process.batch import iter_batches, run_parts
+from interq_cip_qhs.process.data_quality import analyze_data_quality
+from interq_cip_qhs.publisher import get_publisher
+from interq_cip_qhs.outbox import Outbox
+from interq_cip_qhs.instrumentation import get_instrumentation
 from interq_cip_qhs.config import Config
 import pprint
+import csv
 
 config = Config()
+instrumentation = get_instrumentation()
 
 
 class TurningProcessData:
-    def __init__(self, path_data):
+    def __init__(self, path_data, feature_backend=None, dq_backend=None):
         self.owner = "ptw"
-        self.docker_client = docker.from_env()
+        self.process_class = "turning_process"
+        self._docker_client = None
         self.tmp_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../tmp_files"))
         self._path = path_data
+        self.feature_backend = get_feature_backend(feature_backend)
+        self._part_cache = PartDataCache()
+        self._part_file = get_part_file(
+            os.path.join(self._path, "turning_process_data.h5"), config.H5_CHUNK_CACHE_BYTES
+        )
+        self._manifest = DatasetManifest(
+            None
+            if config.MANIFEST_FILE_NAME is None
+            else os.path.join(self._path, config.MANIFEST_FILE_NAME)
+        )
+        self._feature_store = FeatureStore(config.FEATURE_STORE_PATH)
+        self._outbox = Outbox(config.OUTBOX_PATH)
+        self.dq_backend = config.DQ_BACKEND if dq_backend is None else dq_backend
         self.process_name = "turning"
         self.pwd = config.pwd
         self.cid = config.cid
@@ -122,44 +146,122 @@ class TurningProcessData:
             "measPos29",
         ]
     def get_sorted_process_data(self, data):
+        # most recordings are already in time order and are returned as they are
         timestamps = data[0]
-        process_data = data[1:]
-        sort_inds = np.argsort(timestamps)
-        timestamps = timestamps[sort_inds]
-        for i in range(len(process_data)):
-            process_data[i] = process_data[i][sort_inds]
-        return np.vstack([timestamps, process_data])
+        if np.all(timestamps[1:] >= timestamps[:-1]):
+            return data
+        # otherwise all rows are reordered at once, the stable sort keeps
+        # samples with equal timestamps in recorded order
+        return data[:, np.argsort(timestamps, kind="stable")]
+
+    def __getstate__(self):
+        # docker clients can't be pickled, copies sent to worker processes go without
+        state = self.__dict__.copy()
+        state["_docker_client"] = None
+        return state
+
+    @property
+    def docker_client(self):
+        # connecting to the docker daemon waits for the first data QH upload
+        if self._docker_client is None:
+            self._docker_client = get_docker_client()
+        return self._docker_client
+
+    def get_manifest_entry(self, id):
+        path = os.path.join(self._path, "turning_process_data.h5")
+        offset, nbytes, shape = self._part_file.get_layout([id])[id]
+        data = self._part_file.read(id)
+        # time is the first row
+        times = data[0]
+        times = times[~np.isnan(times)]
+        return {
+            "part_id": id,
+            "path": path,
+            "files": [[path, nbytes]],
+            "nbytes": nbytes,
+            "n_samples": shape[-1],
+            "first_time": float(times.min()) if len(times) else None,
+            "last_time": float(times.max()) if len(times) else None,
+            "offset": offset,
+            "fingerprint": array_fingerprint(data),
+        }
+
+    def update_manifest(self, n_workers=None):
+        """Indexes the parts of the part file in the dataset manifest and drops
+        removed ones, the file is only opened when it changed. A part can be
+        rewritten in place with the same layout, so every part is read again
+        and its content hashed then. Returns the number of changed entries."""
+        n_workers = config.N_WORKERS if n_workers is None else n_workers
+        path = os.path.join(self._path, "turning_process_data.h5")
+        source_fingerprint = file_fingerprint([path])
+        with instrumentation.timer("index", self.process_class):
+            n_changed = self._manifest.update(
+                self.process_class,
+                path,
+                source_fingerprint,
+                # never matches the content hash of an entry, all parts are indexed
+                lambda: {
+                    id: (id, (source_fingerprint, layout))
+                    for id, layout in self._part_file.get_layout().items()
+                },
+                lambda ids: run_parts(self, "get_manifest_entry", ids, n_workers),
+            )
+        if n_changed:
+            instrumentation.count("parts_indexed", self.process_class, n_changed)
+        return n_changed
+
+    def get_part_fingerprint(self, id):
+        """Fingerprint of the data of a part, the content hash of its manifest
+        entry. Unlike the fingerprint of the whole part file it stays the same
+        when other parts are added to the file, and changes when the part is
+        rewritten."""
+        path = os.path.join(self._path, "turning_process_data.h5")
+        fingerprint = self._manifest.get_fingerprint(self.process_class, id)
+        if fingerprint is None or not self._manifest.is_current(
+            self.process_class, path, file_fingerprint([path])
+        ):
+            self.update_manifest()
+            fingerprint = self._manifest.get_fingerprint(self.process_class, id)
+        return (path, fingerprint)
+
+    def get_part_ids(self, start=None, stop=None, shard=None, n_shards=None, order="part_id"):
+        """Part ids of the part file sorted by id or, with order "offset", as
+        stored. See DatasetManifest.get_part_ids."""
+        self.update_manifest()
+        return self._manifest.get_part_ids(
+            self.process_class, start, stop, shard, n_shards, order
+        )
 
     def extract_features(self, data):
-        features = extract_features(
+        features = self.feature_backend.extract_features(
             data,
             column_sort="time",
             column_id="id",
-            default_fc_parameters=MinimalFCParameters(),
         )
         return features
 
     def read_raw_from_id(self, id):
+        # shared by all accessors, callers must not modify the result in place
         path = os.path.join(self._path, "turning_process_data.h5")
-        try:
-            hf = h5py.File(path, 'r')
-        except:
-            print("Failed to open file: " + str(path))
-            exit()
-        try:
-            data_arr = np.array(hf[id])
-        except:
-            print("Failed to find dataset: " + str(id) + " in file " + str(path))
-            exit()
+        return self._part_cache.get_or_load(
+            (path, id), self.get_part_fingerprint(id), lambda: self.load_raw_from_id(id)
+        )
+
+    def load_raw_from_id(self, id):
+        with instrumentation.timer("read", self.process_class, id):
+            data_arr = self._part_file.read(id)
         # last field is just made up of NaN Values and field key is also unknown
         # TODO: find out why that is
 
-        data_arr = self.get_sorted_process_data(data_arr)
-        data_arr = data_arr[:-1]
-        data_df = pd.DataFrame(
-            columns = self.features, data = data_arr.transpose(), index = [i for i in range(len(data_arr[0]))]
-        )
-        data_df.insert(0, "id", [id for i in range(len(data_arr[0]))])
+        with instrumentation.timer("segment", self.process_class, id):
+            data_arr = self.get_sorted_process_data(data_arr)
+            data_arr = data_arr[:-1]
+            # pandas keeps a (fields, samples) array as the block of the transposed
+            # frame, the array is our own so it is taken over without a copy
+            data_df = pd.DataFrame(
+                columns = self.features, data = data_arr.transpose(), copy = False
+            )
+            data_df.insert(0, "id", get_id_column([id], [len(data_arr[0])]))
         return data_df
 
     def get_processing_time(self, data):
@@ -169,57 +271,169 @@ class TurningProcessData:
         process_end_ts = data.time.iloc[-1] *1e6
         return process_end_ts, processing_time
 
-    def get_process_QH_id(self, id):
+    def compute_process_features(self, id):
         data = self.read_raw_from_id(id)
+        with instrumentation.timer("extract", self.process_class, id):
+            features = self.extract_features(data)
+        return self.collect_process_features(data, features)
+
+    def collect_process_features(self, data, features):
         process_end_ts, process_time = self.get_processing_time(data)
-        features = self.extract_features(data)
-        qh_document = {
-            "pwd": self.pwd,
-            "cid": self.cid,
-            "qhd": {
-                "qhd-header" : {
-                    "owner": self.owner,
-                    "subject": "part::cylinder_bottom,part_id::"+ id + ",process::turning,type::process_qh",
-                    "timeref": datetime.datetime.fromtimestamp(process_end_ts/1e6).strftime('%Y-%m-%dT%H:%M:%S+01:00'),
-                    "model" : self.model,
-                    "asset" : "type::process_qh"
-                },
-                "qhd-body": {
+        return {
+            "process_end_ts": process_end_ts,
+            "processing_time": process_time,
+            "features": features,
+        }
+
+    def get_process_features(self, id):
+        return self._feature_store.get_or_compute(
+            "turning",
+            id,
+            self.feature_backend.feature_set,
+            self.get_part_fingerprint(id),
+            lambda: self.compute_process_features(id),
+        )
+
+    def get_process_features_batch(self, ids, n_workers=None, batch_size=100, batch_bytes=None):
+        """Features of many parts as one parts x (process, feature) frame.
+
+        Parts found in the feature store are taken from there, the others are
+        computed in n_workers processes (see compute_process_features_many)
+        and stored.
+        """
+        features, missing = {}, []
+        for id in ids:
+            process_features = self._feature_store.get(
+                "turning", id, self.feature_backend.feature_set, self.get_part_fingerprint(id)
+            )
+            if process_features is None:
+                missing.append(id)
+            else:
+                features[id] = process_features["features"]
+
+        for id, process_features in self.compute_process_features_many(
+            missing, n_workers, batch_size, batch_bytes
+        ):
+            self._feature_store.put(
+                "turning",
+                id,
+                self.feature_backend.feature_set,
+                self.get_part_fingerprint(id),
+                process_features,
+            )
+            features[id] = process_features["features"]
+        # one row of features per part, under the name of the process
+        return get_part_feature_frame(
+            {id: features[id].set_axis([self.process_name]) for id in ids}
+        )
+
+    def compute_process_features_many(self, ids, n_workers=None, batch_size=100, batch_bytes=None):
+        """Yields (id, process features) of every id, computed in n_workers processes.
+
+        Backends without setup per call (batch_calls False) extract the
+        features in the workers, which only send back the feature rows. For
+        the others the workers read the parts and their features are extracted
+        with one backend call per batch_size parts, or fewer parts holding
+        batch_bytes (default Config.FEATURE_BATCH_BYTES) of raw data.
+        """
+        n_workers = config.N_WORKERS if n_workers is None else n_workers
+        batch_bytes = config.FEATURE_BATCH_BYTES if batch_bytes is None else batch_bytes
+        if not getattr(self.feature_backend, "batch_calls", True):
+            for id, process_features, error in run_parts(
+                self, "compute_process_features", ids, n_workers
+            ):
+                if error is not None:
+                    raise error
+                instrumentation.count("parts_extracted", self.process_class)
+                yield id, process_features
+            return
+
+        def read_parts():
+            for id, data, error in run_parts(self, "read_raw_from_id", ids, n_workers):
+                if error is not None:
+                    raise error
+                yield id, data
+
+        for raw in iter_batches(read_parts(), batch_size, batch_bytes):
+            with instrumentation.timer("extract_batch", self.process_class):
+                batch_features = extract_features_batch(
+                    lambda data, segments: self.extract_features(data), raw
+                )
+            instrumentation.count("parts_extracted", self.process_class, len(raw))
+            for id, data in raw.items():
+                yield id, self.collect_process_features(data, batch_features[id])
+
+    def get_process_QH_id(self, id):
+        process_features = self.get_process_features(id)
+        process_end_ts = process_features["process_end_ts"]
+        process_time = process_features["processing_time"]
+        features = process_features["features"]
+        with instrumentation.timer("document", self.process_class, id):
+            qh_document = {
+                "pwd": self.pwd,
+                "cid": self.cid,
+                "qhd": {
+                    "qhd-header" : {
+                        "owner": self.owner,
+                        "subject": self.get_process_QH_subject(id),
+                        "timeref": datetime.datetime.fromtimestamp(process_end_ts/1e6).strftime('%Y-%m-%dT%H:%M:%S+01:00'),
+                        "model" : self.model,
+                        "asset" : "type::process_qh"
+                    },
+                    "qhd-body": {
             
+                    }
                 }
             }
-        }
-        qh_document["qhd"]["qhd-body"][self.process_name] = {
-            "processing_time": process_time
-        }
-        qh_document["qhd"]["qhd-body"][self.process_name]["features"] = {
-            "IND_" + feature: features.loc[id, feature]
-            for feature in features.columns
-        }
-        return qh_document
+            qh_document["qhd"]["qhd-body"][self.process_name] = {
+                "processing_time": process_time
+            }
+            qh_document["qhd"]["qhd-body"][self.process_name]["features"] = {
+                "IND_" + feature: features.loc[id, feature]
+                for feature in features.columns
+            }
+            return qh_document
+
+    def get_process_QH_subject(self, id):
+        return "part::cylinder_bottom,part_id::"+ id + ",process::turning,type::process_qh"
+
+    def get_data_QH_id(self, id, container_name=None):
+        import requests
 
-    def get_data_QH_id(self, id, container_name):
         data = self.read_raw_from_id(id)
 
-        # Reformat timestamps to iso8601 for the data quality analysis to work
-        data.time = pd.to_datetime(data.time, unit="s").dt.strftime('%Y-%m-%dT%H:%M:%SZ')
-
-        # Save as .csv and copy into docker container
-        csv_path = os.path.join(self.tmp_dir, "tmp_data.csv")
-        data.to_csv(csv_path)
- 
-        container = self.docker_client.containers.get(container_name)
-        copy_to_container(container, src=csv_path, dst_dir="/app/data/")               
-
-        # Call the containers rest API with a rule
-        query_params = {
-            "file_name": "tmp_data.csv",
-            "ts_column": "time",
-            "value_column_1": "actSpeed1",
-            "qhd_key": "interq_qhd"
-        }
-        response = requests.get(self.dqaas_endpoint, params=query_params)
-        data_qh = json.loads(response.content)
+        value_column = "actSpeed1"
+        times = pd.to_datetime(data.time, unit="s")
+        if self.dq_backend == "local":
+            with instrumentation.timer("dq", self.process_class, id):
+                data_qh = analyze_data_quality(self.dqaas_endpoint, times, data[value_column], "time", value_column, "Z")
+        else:
+            # Only the columns the data quality analysis looks at are uploaded,
+            # with timestamps reformatted to iso8601 for it to work
+            data = pd.DataFrame({
+                "time": format_timestamps(times, "Z"),
+                value_column: data[value_column],
+            })
+
+            # Stream as .csv into the docker container, a unique name per upload
+            # keeps concurrent runs from overwriting each other's data
+            file_name = "tmp_data_" + id + "_" + uuid.uuid4().hex + ".csv"
+            with instrumentation.timer("dq", self.process_class, id):
+                container = self.docker_client.containers.get(container_name)
+                copy_frame_to_container(container, data, "/app/data/", file_name)
+
+                # Call the containers rest API with a rule
+                query_params = {
+                    "file_name": file_name,
+                    "ts_column": "time",
+                    "value_column_1": value_column,
+                    "qhd_key": "interq_qhd"
+                }
+                try:
+                    response = requests.get(self.dqaas_endpoint, params=query_params)
+                finally:
+                    remove_from_container(container, "/app/data/" + file_name)
+            data_qh = json.loads(response.content)
         process_qh = self.get_process_QH_id(id)
 
         # take timestamp from process end. Otherwise timeref of data qh service would be time of processing, 
@@ -243,24 +457,26 @@ class TurningProcessData:
 
 
 
-    def publish_process_QH_id(self, id):
-        qh_document = self.get_process_QH_id(id)
-        print("publishing document:")
-        #jprint(qh_document)
-        response = requests.post(self.api_endpoint, json = qh_document)
-        response = json.loads(response.content)
-        print("got response: ")
-        jprint(response)
+    def publish_QH_document(self, qh_document, id=None):
+        instrumentation.log("publishing document:")
+        #instrumentation.log_json(qh_document)
+        with instrumentation.timer("publish", self.process_class, id):
+            response = get_publisher(self.api_endpoint).post(qh_document)
+        instrumentation.log("got response: ")
+        instrumentation.log_json(response)
         return response
 
-    def publish_data_QH_id(self, id, container_name):
+    def publish_process_QH_id(self, id):
+        return self.publish_QH_document(self.get_process_QH_id(id), id)
+
+    def publish_data_QH_id(self, id, container_name=None):
         data_qh = self.get_data_QH_id(id, container_name)
-        print("publishing document:")
-        jprint(data_qh)
-        response = requests.post(self.api_endpoint, json = data_qh)
-        response = json.loads(response.content)
-        print("got response: ")
-        jprint(response)
+        instrumentation.log("publishing document:")
+        instrumentation.log_json(data_qh)
+        with instrumentation.timer("publish", self.process_class, id):
+            response = get_publisher(self.api_endpoint).post(data_qh)
+        instrumentation.log("got response: ")
+        instrumentation.log_json(response)
         return response
 
     def reformatAtomicFields(self, document):
@@ -272,12 +488,51 @@ class TurningProcessData:
                 document[attribute] = self.reformatAtomicFields(document[attribute])
         return document
 
-    def publish_all_process_and_data_qh(self):
-        path = os.path.join(self._path, "turning_process_data.h5")
-        hf = h5py.File(path, 'r')
-        for key in hf.keys():
-            self.publish_process_QH_id(key)
-            #self.publish_data_QH_id(key, "angry_williamson")
+    def publish_all_process_and_data_qh(self, n_workers=None):
+        """Posts the process QH documents of all parts to api_endpoint, built in
+        n_workers processes.
+
+        Parts whose subject api_endpoint acknowledged before according to the
+        outbox (Config.OUTBOX_PATH) are skipped, also if the database behind
+        the endpoint changed since. Call self._outbox.clear(self.api_endpoint)
+        to post them again. Parts whose documents api_endpoint rejected
+        Config.OUTBOX_MAX_ATTEMPTS times are reported as errors instead of
+        being posted again.
+        """
+        n_workers = config.N_WORKERS if n_workers is None else n_workers
+        # parts in on-disk order, listed from the dataset manifest
+        keys = self.get_part_ids(order="offset")
+        publisher = get_publisher(self.api_endpoint)
+        with open("turning_process_error_list.txt", "a", newline="") as f:
+            writer = csv.writer(f)
+            # documents are built in worker processes and posted from here,
+            # the publisher keeps several posts in flight and retries failed ones.
+            # Acknowledged parts are skipped and unsent documents replayed from the outbox
+            documents = self._outbox.resume(
+                self.api_endpoint,
+                keys,
+                self.get_process_QH_subject,
+                lambda ids: run_parts(self, "get_process_QH_id", ids, n_workers),
+            )
+            with instrumentation.timer("publish_all", self.process_class):
+                for key, response, error in publisher.post_many(documents):
+                    try:
+                        if error is not None:
+                            raise error
+                        instrumentation.log("got response: ")
+                        instrumentation.log_json(response)
+                        if self._outbox.acknowledge(self.api_endpoint, self.get_process_QH_subject(key), response):
+                            instrumentation.count("published", self.process_class, part_id=key)
+                        else:
+                            # failed in the outbox, see Outbox.get_failed
+                            instrumentation.count("rejected", self.process_class, part_id=key)
+                        #self.publish_data_QH_id(key, "angry_williamson")
+                    except Exception as error:
+                        print(error)
+                        instrumentation.count("errors", self.process_class, part_id=key)
+                        writer.writerow(["error in " + str(key)])
+                        writer.writerow([str(error)])
+        instrumentation.flush()
 
 if __name__ == "__main__":
     pass
@@ -2,12 +2,52 @@ import io
 import os
 import json
 import tarfile
+import tempfile
+import time
+import ciso8601
+import numpy as np
+import pandas as pd
 
 def jprint(obj):
     # create a formatted string of the Python JSON object
     text = json.dumps(obj, sort_keys=True, indent=4)
     print(text)
 
+def format_timestamps(times, suffix="Z"):
+    """ formats datetimes as "%Y-%m-%dT%H:%M:%S" + suffix like Series.dt.strftime, NaT becomes NaN """
+    index = times.index if isinstance(times, pd.Series) else None
+    # the cast floors to whole seconds like strftime
+    seconds = np.asarray(times, dtype="datetime64[ns]").astype("datetime64[s]")
+    # samples come in runs of the same second, so every run is formatted once
+    # and all its rows share the string
+    codes = seconds.view(np.int64)
+    run_starts = np.flatnonzero(np.append(len(codes) > 0, codes[1:] != codes[:-1]))
+    run_lengths = np.diff(np.append(run_starts, len(codes)))
+    strings = np.char.add(np.datetime_as_string(seconds[run_starts], unit="s"), suffix).astype(object)
+    strings[np.isnat(seconds[run_starts])] = np.nan
+    return pd.Series(np.repeat(strings, run_lengths), index=index)
+
+def parse_timestamps(strings):
+    """ microseconds since the epoch of iso8601 strings, like ciso8601.parse_datetime(s).timestamp() * 1e6 """
+    try:
+        # one call for all strings as long as they carry their utc offset
+        times = pd.to_datetime(pd.Index(strings, dtype=object), format="ISO8601")
+    except (ValueError, TypeError):
+        times = None
+    if times is None or times.tz is None:
+        # strings without offset are local times, mixed offsets are parsed one by one
+        return np.array(
+            [ciso8601.parse_datetime(string).timestamp() for string in strings], dtype=float
+        ) * 1e6
+    # seconds first, so the values round like the float timestamps of datetime
+    return times.as_unit("us").asi8 / 1e6 * 1e6
+
+def get_docker_client():
+    """ docker client configured from the environment, docker is only imported here """
+    import docker
+
+    return docker.from_env()
+
 def copy_to_container(container, src, dst_dir):
     """ src shall be an absolute path """
     stream = io.BytesIO()
@@ -17,3 +57,32 @@ def copy_to_container(container, src, dst_dir):
         tar.addfile(info, f)
 
     container.put_archive(dst_dir, stream.getvalue())
+
+
+def copy_frame_to_container(
+    container, frame, dst_dir, file_name, chunk_rows=100000, max_memory_bytes=64 * 1024 * 1024
+):
+    """ streams frame as the csv file dst_dir/file_name into the container, the encoded csv
+    is only kept in memory up to max_memory_bytes and spooled to a temp file beyond """
+    # the tar header needs the file size, so the csv is encoded chunk by chunk
+    # into the spool first and then streamed from it in blocks
+    with tempfile.SpooledTemporaryFile(max_size=max_memory_bytes) as spool:
+        for start in range(0, max(len(frame), 1), chunk_rows):
+            spool.write(
+                frame.iloc[start : start + chunk_rows].to_csv(index=False, header=start == 0).encode()
+            )
+        info = tarfile.TarInfo(file_name)
+        info.size = spool.tell()
+        info.mtime = int(time.time())
+        spool.seek(0)
+
+        def stream():
+            yield info.tobuf()
+            yield from iter(lambda: spool.read(1024 * 1024), b"")
+            # pad the file to a full block and close the archive with two empty blocks
+            yield tarfile.NUL * (-info.size % tarfile.BLOCKSIZE + 2 * tarfile.BLOCKSIZE)
+
+        container.put_archive(dst_dir, stream())
+
+def remove_from_container(container, path):
+    container.exec_run(["rm", "-f", path])
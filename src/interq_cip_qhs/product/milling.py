@@ -1,17 +1,22 @@
 import pandas as pd
 import datetime
-import requests
-import json
 from interq_cip_qhs.config import Config
-from interq_cip_qhs.process.utils import copy_to_container, jprint
+from interq_cip_qhs.process.batch import run_parts
+from interq_cip_qhs.publisher import get_publisher
+from interq_cip_qhs.outbox import Outbox
+from interq_cip_qhs.instrumentation import get_instrumentation
+from interq_cip_qhs.process.utils import copy_to_container
 import csv
 
 config = Config()
+instrumentation = get_instrumentation()
 
 
 class MillingProductData:
     def __init__(self, path_csv):
-        quality_data = pd.read_csv(path_csv, delimiter=";", encoding="latin1")
+        self.process_class = "milling_product"
+        with instrumentation.timer("read", self.process_class):
+            quality_data = pd.read_csv(path_csv, delimiter=";", encoding="latin1")
         quality_data_en = pd.DataFrame(
             columns=[
                 "id",
@@ -46,60 +51,90 @@ class MillingProductData:
         self.owner = "ptw"
         self.api_endpoint = "http://localhost:6005/interq/tf/v1.0/qhs"
         self.dqaas_endpoint = "http://localhost:8000/DuplicateRecords/"
+        self._outbox = Outbox(config.OUTBOX_PATH)
 
     def get_product_QH_id(self, id):
-        data = self.quality_data.loc[id]
-        qh_document = {
-            "pwd": self.pwd,
-            "cid": self.cid,
-            "qhd": {
-                "qhd-header": {
-                    "owner": self.owner,
-                    "subject": "part::cylinder_bottom,part_id::"
-                    + id
-                    + ",process::milling,type::product_qh",
-                    "timeref": datetime.datetime.strptime(
-                        data["measurement_timestamp"], "%d.%m.%Y %H:%M:%S"
-                    ).strftime("%Y-%m-%dT%H:%M:%S+01:00"),
-                    "model": self.model,
-                    "asset": "type::product_qh",
+        with instrumentation.timer("document", self.process_class, id):
+            data = self.quality_data.loc[id]
+            qh_document = {
+                "pwd": self.pwd,
+                "cid": self.cid,
+                "qhd": {
+                    "qhd-header": {
+                        "owner": self.owner,
+                        "subject": self.get_product_QH_subject(id),
+                        "timeref": datetime.datetime.strptime(
+                            data["measurement_timestamp"], "%d.%m.%Y %H:%M:%S"
+                        ).strftime("%Y-%m-%dT%H:%M:%S+01:00"),
+                        "model": self.model,
+                        "asset": "type::product_qh",
+                    },
+                    "qhd-body": {
+                        "IND_measurement_time": data["measurement_timestamp"],
+                        "IND_surface_roughness": data["surface_roughness"],
+                        "IND_parallelism": data["parallelism"],
+                        "IND_groove_depth": data["groove_depth"],
+                        "IND_groove_diameter": data["groove_diameter"],
+                    },
                 },
-                "qhd-body": {
-                    "IND_measurement_time": data["measurement_timestamp"],
-                    "IND_surface_roughness": data["surface_roughness"],
-                    "IND_parallelism": data["parallelism"],
-                    "IND_groove_depth": data["groove_depth"],
-                    "IND_groove_diameter": data["groove_diameter"],
-                },
-            },
-        }
-        return qh_document
+            }
+            return qh_document
+
+    def get_product_QH_subject(self, id):
+        return "part::cylinder_bottom,part_id::" + id + ",process::milling,type::product_qh"
 
     def publish_product_QH_id(self, id):
         qh_document = self.get_product_QH_id(id)
-        print("publishing document: ")
-        # jprint(qh_document)
-        response = requests.post(self.api_endpoint, json=qh_document)
-        response = json.loads(response.content)
-        print("got response: ")
-        jprint(response)
+        instrumentation.log("publishing document: ")
+        # instrumentation.log_json(qh_document)
+        with instrumentation.timer("publish", self.process_class, id):
+            response = get_publisher(self.api_endpoint).post(qh_document)
+        instrumentation.log("got response: ")
+        instrumentation.log_json(response)
         return response
 
     def publish_all_product_qh(self):
+        """Posts the product QH documents of all parts in the quality data to
+        api_endpoint.
+
+        Parts whose subject api_endpoint acknowledged before according to the
+        outbox (Config.OUTBOX_PATH) are skipped, also if the database behind
+        the endpoint changed since. Call self._outbox.clear(self.api_endpoint)
+        to post them again. Parts whose documents api_endpoint rejected
+        Config.OUTBOX_MAX_ATTEMPTS times are reported as errors instead of
+        being posted again.
+        """
+        publisher = get_publisher(self.api_endpoint)
+        # acknowledged parts are skipped and unsent documents replayed from the outbox
+        documents = self._outbox.resume(
+            self.api_endpoint,
+            list(self.quality_data.index),
+            self.get_product_QH_subject,
+            lambda ids: run_parts(self, "get_product_QH_id", ids),
+        )
         with open("milling_product_error_list.txt", "a", newline="") as f:
             writer = csv.writer(f)
-            for id, row in self.quality_data.iterrows():
-                try:
-                    response = self.publish_product_QH_id(id)
-                    if "uuid" in response.keys():
-                        continue
-                    else:
-                        if "not unique" in response["message"]:
-                            print("hallmark already posted")
-                        while "some error condition" in response["message"]:
-                            response = self.publish_process_QH_id(id)
+            with instrumentation.timer("publish_all", self.process_class):
+                for id, response, error in publisher.post_many(documents):
+                    try:
+                        if error is not None:
+                            raise error
+                        instrumentation.log("got response: ")
+                        instrumentation.log_json(response)
+                        if self._outbox.acknowledge(
+                            self.api_endpoint, self.get_product_QH_subject(id), response
+                        ):
+                            instrumentation.count("published", self.process_class, part_id=id)
+                        else:
+                            # failed in the outbox, see Outbox.get_failed
+                            instrumentation.count("rejected", self.process_class, part_id=id)
+                        if "uuid" not in response.keys():
+                            if "not unique" in response["message"]:
+                                instrumentation.log("hallmark already posted")
 
-                except Exception as error:
-                    print(error)
-                    writer.writerow(["error in " + str(id)])
-                    writer.writerow([str(error)])
+                    except Exception as error:
+                        print(error)
+                        instrumentation.count("errors", self.process_class, part_id=id)
+                        writer.writerow(["error in " + str(id)])
+                        writer.writerow([str(error)])
+        instrumentation.flush()
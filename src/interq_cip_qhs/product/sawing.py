@@ -1,14 +1,19 @@
 import pandas as pd
 import datetime
-import requests
-import json
-from interq_cip_qhs.process.utils import copy_to_container, jprint
+from interq_cip_qhs.process.utils import copy_to_container
 from interq_cip_qhs.config import Config
+from interq_cip_qhs.process.batch import run_parts
+from interq_cip_qhs.publisher import get_publisher
+from interq_cip_qhs.outbox import Outbox
+from interq_cip_qhs.instrumentation import get_instrumentation
 config = Config()
+instrumentation = get_instrumentation()
 
 class SawingProductData:
     def __init__(self, path_csv):
-        quality_data = pd.read_csv(path_csv, delimiter=",", encoding="latin1")
+        self.process_class = "sawing_product"
+        with instrumentation.timer("read", self.process_class):
+            quality_data = pd.read_csv(path_csv, delimiter=",", encoding="latin1")
         quality_data_en = pd.DataFrame(
             columns=[
                 "id",
@@ -29,39 +34,75 @@ class SawingProductData:
         self.owner = "ptw"
         self.api_endpoint = "http://localhost:6005/interq/tf/v1.0/qhs"
         self.dqaas_endpoint = "http://localhost:8000/DuplicateRecords/"
+        self._outbox = Outbox(config.OUTBOX_PATH)
 
 
     def get_product_QH_id(self, id):
         #print(self.quality_data)
-        data = self.quality_data.loc[int(float(id))]
-        qh_document = {
-            "pwd": self.pwd,
-            "cid": self.cid,
-            "qhd": {
-                "qhd-header" : {
-                    "owner": self.owner,
-                    "subject": "part::cylinder_bottom,part_id::" + str(id) + ",process::sawing,type::product_qh",
-                    "timeref": datetime.datetime.strptime(data["measurement_timestamp"], '%d-%m-%Y %H:%M:%S').strftime('%Y-%m-%dT%H:%M:%S+01:00'),
-                    "model" : self.model,
-                    "asset" : "type::product_qh"
-                },
-                "qhd-body": {
-                    "IND_weight": data["weight"],
+        with instrumentation.timer("document", self.process_class, id):
+            data = self.quality_data.loc[int(float(id))]
+            qh_document = {
+                "pwd": self.pwd,
+                "cid": self.cid,
+                "qhd": {
+                    "qhd-header" : {
+                        "owner": self.owner,
+                        "subject": self.get_product_QH_subject(id),
+                        "timeref": datetime.datetime.strptime(data["measurement_timestamp"], '%d-%m-%Y %H:%M:%S').strftime('%Y-%m-%dT%H:%M:%S+01:00'),
+                        "model" : self.model,
+                        "asset" : "type::product_qh"
+                    },
+                    "qhd-body": {
+                        "IND_weight": data["weight"],
+                    }
                 }
             }
-        }
-        return qh_document
+            return qh_document
+
+    def get_product_QH_subject(self, id):
+        return "part::cylinder_bottom,part_id::" + str(id) + ",process::sawing,type::product_qh"
         
     def publish_product_QH_id(self, id):
         qh_document = self.get_product_QH_id(id)
-        print("publishing document: ")
-        #jprint(qh_document)
-        response = requests.post(self.api_endpoint, json = qh_document)
-        response = json.loads(response.content)
-        print("got response: ")
-        jprint(response)
+        instrumentation.log("publishing document: ")
+        #instrumentation.log_json(qh_document)
+        with instrumentation.timer("publish", self.process_class, id):
+            response = get_publisher(self.api_endpoint).post(qh_document)
+        instrumentation.log("got response: ")
+        instrumentation.log_json(response)
         return response
 
     def publish_all_product_qh(self):
-        for id, row in self.quality_data.iterrows():
-            self.publish_product_QH_id(id)
+        """Posts the product QH documents of all parts in the quality data to
+        api_endpoint.
+
+        Parts whose subject api_endpoint acknowledged before according to the
+        outbox (Config.OUTBOX_PATH) are skipped, also if the database behind
+        the endpoint changed since. Call self._outbox.clear(self.api_endpoint)
+        to post them again. Parts whose documents api_endpoint rejected
+        Config.OUTBOX_MAX_ATTEMPTS times are reported as errors instead of
+        being posted again.
+        """
+        publisher = get_publisher(self.api_endpoint)
+        # acknowledged parts are skipped and unsent documents replayed from the outbox
+        documents = self._outbox.resume(
+            self.api_endpoint,
+            list(self.quality_data.index),
+            self.get_product_QH_subject,
+            lambda ids: run_parts(self, "get_product_QH_id", ids),
+        )
+        try:
+            with instrumentation.timer("publish_all", self.process_class):
+                for id, response, error in publisher.post_many(documents):
+                    if error is not None:
+                        instrumentation.count("errors", self.process_class, part_id=id)
+                        raise error
+                    instrumentation.log("got response: ")
+                    instrumentation.log_json(response)
+                    if self._outbox.acknowledge(self.api_endpoint, self.get_product_QH_subject(id), response):
+                        instrumentation.count("published", self.process_class, part_id=id)
+                    else:
+                        # failed in the outbox, see Outbox.get_failed
+                        instrumentation.count("rejected", self.process_class, part_id=id)
+        finally:
+            instrumentation.flush()
@@ -0,0 +1,155 @@
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from interq_cip_qhs.config import Config
+
+config = Config()
+
+_publishers = {}
+_publishers_lock = threading.Lock()
+
+
+class RetryableResponse(Exception):
+    pass
+
+
+class QHPublisher:
+    """Posts QH documents to the QH endpoint over one pooled keep-alive session.
+
+    At most max_in_flight requests are open at a time, over all threads and
+    post_many calls using the publisher. Failed posts (connection errors,
+    timeouts, 5xx/429 responses and messages listed in retry_messages) are
+    retried with exponential backoff up to max_retries times. The latencies
+    of the last max_latencies requests are kept in latencies.
+    """
+
+    def __init__(
+        self,
+        api_endpoint,
+        max_in_flight=None,
+        max_retries=None,
+        backoff_seconds=None,
+        timeout_seconds=None,
+        retry_messages=("some error condition",),
+        max_latencies=10000,
+    ):
+        self.api_endpoint = api_endpoint
+        self.max_in_flight = (
+            config.QH_MAX_IN_FLIGHT if max_in_flight is None else max_in_flight
+        )
+        self.max_retries = config.QH_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_seconds = (
+            config.QH_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        )
+        self.max_backoff_seconds = 30.0
+        self.timeout_seconds = (
+            config.QH_TIMEOUT_SECONDS if timeout_seconds is None else timeout_seconds
+        )
+        self.retry_messages = retry_messages
+        self.latencies = deque(maxlen=max_latencies)
+        self.n_requests = 0
+        self._lock = threading.Lock()
+        # one slot per pooled connection, shared by all callers
+        self._in_flight = threading.BoundedSemaphore(max(self.max_in_flight, 1))
+        # requests is imported with the first publisher, readers that never post go without
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=max(self.max_in_flight, 1)
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _post_once(self, qh_document):
+        with self._in_flight:
+            start = time.perf_counter()
+            try:
+                response = self.session.post(
+                    self.api_endpoint, json=qh_document, timeout=self.timeout_seconds
+                )
+            finally:
+                with self._lock:
+                    self.latencies.append(time.perf_counter() - start)
+                    self.n_requests += 1
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableResponse(
+                "QH endpoint returned status " + str(response.status_code)
+            )
+        content = json.loads(response.content)
+        message = str(content.get("message", "")) if isinstance(content, dict) else ""
+        if any(retry_message in message for retry_message in self.retry_messages):
+            raise RetryableResponse(message)
+        return content
+
+    def post(self, qh_document):
+        """Posts one document and returns the decoded endpoint response."""
+        import requests
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._post_once(qh_document)
+            except (
+                RetryableResponse,
+                requests.ConnectionError,
+                requests.Timeout,
+            ):
+                if attempt == self.max_retries:
+                    raise
+            time.sleep(
+                min(self.backoff_seconds * 2**attempt, self.max_backoff_seconds)
+            )
+
+    def post_many(self, items):
+        """Posts (key, document, error) items with at most max_in_flight concurrent requests.
+
+        Yields (key, response, error) in completion order. Items that already
+        carry an error are passed through without being posted. Concurrent
+        calls share the max_in_flight requests of the publisher.
+        """
+        with ThreadPoolExecutor(max_workers=max(self.max_in_flight, 1)) as executor:
+            pending = {}
+            for key, qh_document, error in items:
+                if error is not None:
+                    yield key, None, error
+                    continue
+                while len(pending) >= self.max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield self._get_result(pending.pop(future), future)
+                pending[executor.submit(self.post, qh_document)] = key
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield self._get_result(pending.pop(future), future)
+
+    def _get_result(self, key, future):
+        try:
+            return key, future.result(), None
+        except Exception as error:
+            return key, None, error
+
+    def get_latency_summary(self):
+        # of the last max_latencies requests, count is the number of all requests
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return {"count": self.n_requests}
+        return {
+            "count": self.n_requests,
+            "mean": sum(latencies) / len(latencies),
+            "p50": latencies[len(latencies) // 2],
+            "p95": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+            "max": latencies[-1],
+        }
+
+
+def get_publisher(api_endpoint):
+    """Returns the publisher shared by all readers posting to api_endpoint."""
+    with _publishers_lock:
+        if api_endpoint not in _publishers:
+            _publishers[api_endpoint] = QHPublisher(api_endpoint)
+        return _publishers[api_endpoint]
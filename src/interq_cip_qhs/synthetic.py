@@ -0,0 +1,257 @@
+import datetime
+import os
+import numpy as np
+
+# as listed in MillingProcessData.processes, without the side prefix
+MILLING_PROCESSES = {
+    "side_1": [
+        "outer_contour_roughing_and_finishing",
+        "drilling",
+        "lateral_drilling",
+        "drilling_countersinking",
+        "outer_contour_deburring_holes",
+        "thread_miling",
+        "lateral_groove",
+        "face_milling",
+        "stepped_bore",
+    ],
+    "side_2": [
+        "face_milling",
+        "circular_pocket_milling",
+        "component_deburring",
+        "ring_groove",
+    ],
+}
+MILLING_FILE_PREFIXES = {"side_1": "frontside", "side_2": "backside"}
+N_BFC_CHANNELS = 31
+# channels of SawingProcessData.features and fields of TurningProcessData.features,
+# both files hold one more trailing row the readers drop
+N_SAWING_CHANNELS = 43
+N_TURNING_FIELDS = 90
+START_TIME = datetime.datetime(2022, 12, 14, 18, 30).timestamp()
+
+
+def get_process_levels(rng, n_processes, n_channels):
+    # every process runs at its own load, speed and feed
+    return rng.uniform(0.5, 2.0, (n_processes, n_channels)) * rng.choice(
+        [1.0, 10.0, 100.0], n_channels
+    )
+
+
+def write_milling_part(root, part_id, acc_rows=200000, bfc_rows=None, start_time=None, seed=None):
+    """Writes a milling part folder with both sides in the layout MillingProcessData reads.
+
+    Every side gets acc_rows accelerometer samples at 25.6 kHz and bfc_rows
+    (default acc_rows // 50) machine samples over the same time span, split
+    into the processes of the side. Returns the part folder.
+    """
+    import h5py
+
+    rng = np.random.default_rng(seed)
+    bfc_rows = acc_rows // 50 if bfc_rows is None else bfc_rows
+    start_time = START_TIME if start_time is None else start_time
+    path = os.path.join(
+        root,
+        "cylinder_bottom",
+        "cnc_milling_machine",
+        "process_data",
+        str(part_id)
+        + datetime.datetime.fromtimestamp(start_time).strftime("_%m_%d_%Y_%H_%M_%S"),
+    )
+    os.makedirs(path, exist_ok=True)
+
+    for side, processes in MILLING_PROCESSES.items():
+        duration = acc_rows / 25600.0
+        # the recording starts a little before the first process
+        starts = start_time + np.sort(
+            np.append(0.02, rng.uniform(0.04, 0.98, len(processes) - 1))
+        ) * duration
+
+        acc_times = start_time + np.arange(acc_rows) / 25600.0
+        labels = np.maximum(np.searchsorted(starts, acc_times, side="right") - 1, 0)
+        amplitudes = get_process_levels(rng, len(processes), 3)[labels]
+        frequencies = rng.uniform(50, 400, len(processes))[labels]
+        acc_data = np.column_stack(
+            [
+                acc_times * 1e6,
+                amplitudes
+                * (
+                    np.sin(2 * np.pi * frequencies * acc_times)[:, None]
+                    + rng.normal(scale=0.3, size=(acc_rows, 3))
+                ),
+            ]
+        )
+
+        bfc_times = start_time + np.arange(bfc_rows) * duration / max(bfc_rows, 1)
+        labels = np.maximum(np.searchsorted(starts, bfc_times, side="right") - 1, 0)
+        levels = get_process_levels(rng, len(processes), N_BFC_CHANNELS)[labels]
+        bfc_data = np.column_stack(
+            [bfc_times, levels * (1 + rng.normal(scale=0.05, size=levels.shape))]
+        )
+
+        prefix = MILLING_FILE_PREFIXES[side]
+        with h5py.File(os.path.join(path, prefix + "_external_sensor_signals.h5"), "w") as f:
+            f.create_dataset("data", data=acc_data, chunks=True)
+        with h5py.File(os.path.join(path, prefix + "_internal_machine_signals.h5"), "w") as f:
+            f.create_dataset("data", data=bfc_data, chunks=True)
+        with open(os.path.join(path, prefix + "_timestamp_process_pairs.csv"), "w") as f:
+            for start, process in zip(starts, processes):
+                f.write(repr(float(start)) + "," + process + "\n")
+        start_time += duration + 60
+    return path
+
+
+def write_sawing_data(path_data, part_ids, n_samples=200, seed=None):
+    """Writes sawing_process_data.h5, one (channels + 1, [value, time], samples) dataset per part."""
+    import h5py
+
+    rng = np.random.default_rng(seed)
+    with h5py.File(os.path.join(path_data, "sawing_process_data.h5"), "w") as f:
+        for i, part_id in enumerate(part_ids):
+            times = START_TIME + i * 600 + np.arange(n_samples) * 0.5
+            levels = get_process_levels(rng, 1, N_SAWING_CHANNELS + 1)[0]
+            data = np.empty((N_SAWING_CHANNELS + 1, 2, n_samples))
+            data[:, 0] = (
+                levels[:, None] * (1 + rng.normal(scale=0.1, size=(len(levels), n_samples)))
+            ).round(2)
+            data[:, 1] = times
+            f.create_dataset(str(part_id), data=data)
+
+
+def write_turning_data(path_data, part_ids, n_samples=200, seed=None):
+    """Writes turning_process_data.h5, one (fields + 1, samples) dataset per part, time first."""
+    import h5py
+
+    rng = np.random.default_rng(seed)
+    with h5py.File(os.path.join(path_data, "turning_process_data.h5"), "w") as f:
+        for i, part_id in enumerate(part_ids):
+            times = START_TIME + i * 600 + np.arange(n_samples) * 0.5
+            levels = get_process_levels(rng, 1, N_TURNING_FIELDS - 1)[0]
+            data = np.vstack(
+                [
+                    times,
+                    levels[:, None]
+                    * (1 + rng.normal(scale=0.1, size=(len(levels), n_samples))),
+                    np.full((1, n_samples), np.nan),
+                ]
+            )
+            f.create_dataset(str(part_id), data=data)
+
+
+def format_decimal(value):
+    return ("%.4f" % value).replace(".", ",")
+
+
+def write_milling_quality_data(path_csv, part_ids, seed=None):
+    """Writes the cylinder bottom quality measurements as read by MillingProductData."""
+    rng = np.random.default_rng(seed)
+    with open(path_csv, "w", encoding="latin1") as f:
+        f.write("Nr;Teil;Messzeitpunkt;Rauheit;Parallelität;Nuttiefe;Nutdurchmesser\n")
+        f.write(";Einheit;;µm;mm;mm;mm\n")
+        f.write(";Nennmaß;;0,8;0;2,5;60\n")
+        f.write(";Toleranz;;0,4;0,05;0,1;0,1\n")
+        for i, part_id in enumerate(part_ids):
+            measured = datetime.datetime.fromtimestamp(START_TIME + 86400 + i * 600)
+            f.write(
+                ";".join(
+                    [
+                        str(i + 1),
+                        str(part_id),
+                        measured.strftime("%d.%m.%Y %H:%M:%S"),
+                        format_decimal(rng.normal(0.8, 0.1)),
+                        format_decimal(abs(rng.normal(0, 0.02))),
+                        format_decimal(rng.normal(2.5, 0.03)),
+                        format_decimal(rng.normal(60, 0.03)),
+                    ]
+                )
+                + "\n"
+            )
+
+
+def write_sawing_quality_data(path_csv, part_ids, seed=None):
+    """Writes the sawn part weights as read by SawingProductData."""
+    rng = np.random.default_rng(seed)
+    with open(path_csv, "w", encoding="latin1") as f:
+        f.write("id,measurement_timestamp,weight\n")
+        for i, part_id in enumerate(part_ids):
+            measured = datetime.datetime.fromtimestamp(START_TIME + 3600 + i * 600)
+            f.write(
+                str(part_id)
+                + ","
+                + measured.strftime("%d-%m-%Y %H:%M:%S")
+                + ","
+                + "%.1f" % rng.normal(1250, 5)
+                + "\n"
+            )
+
+
+def write_turning_quality_data(path_csv, part_ids, seed=None):
+    """Writes the piston rod quality measurements as read by TurningProductData."""
+    rng = np.random.default_rng(seed)
+    with open(path_csv, "w", encoding="latin1") as f:
+        f.write("Nr;Teil;Koaxialität;i.O.;Durchmesser;i.O.;Länge;i.O.\n")
+        for header in ["Einheit", "Nennmaß", "Obere Toleranz", "Untere Toleranz", "Prüfmittel", "Prüfer", "Bemerkung"]:
+            f.write(";" + header + ";mm;;mm;;mm;\n")
+        for i, part_id in enumerate(part_ids):
+            f.write(
+                ";".join(
+                    [
+                        str(i + 1),
+                        str(part_id),
+                        format_decimal(abs(rng.normal(0, 0.02))),
+                        "1",
+                        format_decimal(rng.normal(20, 0.01)),
+                        "1",
+                        format_decimal(rng.normal(250, 0.1)),
+                        "1",
+                    ]
+                )
+                + "\n"
+            )
+
+
+def generate_dataset(
+    root,
+    n_milling_parts=10,
+    n_sawing_parts=None,
+    n_turning_parts=None,
+    acc_rows=200000,
+    n_samples=200,
+    seed=0,
+):
+    """Writes a complete synthetic dataset below root.
+
+    The milling part folders go below root like below Config.DATASET_PATH, the
+    sawing and turning files and the quality csvs into root itself. Milling
+    and sawing share the cylinder bottom part ids, turning gets its own
+    piston rod ids. Returns the part ids and file paths of every process.
+    """
+    n_sawing_parts = n_milling_parts if n_sawing_parts is None else n_sawing_parts
+    n_turning_parts = n_milling_parts if n_turning_parts is None else n_turning_parts
+    cylinder_bottom_ids = [str(100101 + i) for i in range(max(n_milling_parts, n_sawing_parts))]
+    milling_ids = cylinder_bottom_ids[:n_milling_parts]
+    sawing_ids = cylinder_bottom_ids[:n_sawing_parts]
+    turning_ids = [str(200101 + i) for i in range(n_turning_parts)]
+    os.makedirs(root, exist_ok=True)
+
+    for i, part_id in enumerate(milling_ids):
+        write_milling_part(
+            root, part_id, acc_rows, start_time=START_TIME + i * 3600, seed=seed + i
+        )
+    write_sawing_data(root, sawing_ids, n_samples, seed)
+    write_turning_data(root, turning_ids, n_samples, seed)
+    paths = {
+        "milling_quality_data": os.path.join(root, "quality_data_cylinder_bottom.csv"),
+        "sawing_quality_data": os.path.join(root, "quality_data_sawing.csv"),
+        "turning_quality_data": os.path.join(root, "quality_data_piston_rods.csv"),
+    }
+    write_milling_quality_data(paths["milling_quality_data"], milling_ids, seed)
+    write_sawing_quality_data(paths["sawing_quality_data"], sawing_ids, seed)
+    write_turning_quality_data(paths["turning_quality_data"], turning_ids, seed)
+    return {
+        "root": root,
+        "milling_ids": milling_ids,
+        "sawing_ids": sawing_ids,
+        "turning_ids": turning_ids,
+        **paths,
+    }
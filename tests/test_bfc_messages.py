@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+from interq_cip_qhs.process import milling
+
+# process starts in seconds, as in the timestamp_process_pairs csv
+TS_DATA = {"1671042610.0": "face_milling", "1671042600.0": "drilling"}
+
+
+def get_message(seconds, datapoints):
+    timestamp = pd.Timestamp(seconds, unit="s").strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    return {
+        "set": {
+            "timestamp": timestamp,
+            "datapoints": [{"name": name, "value": value} for name, value in datapoints],
+        }
+    }
+
+
+@pytest.fixture
+def reader(tmp_path):
+    return milling.MillingProcessData(path_data=str(tmp_path))
+
+
+def get_messages(reader, gaps):
+    """One message per second from 1671042595, value 10 * second + column; the
+    datapoints of (message, column) in gaps are left out."""
+    messages = []
+    for i in range(25):
+        datapoints = [
+            (feature, 10.0 * i + j)
+            for j, feature in enumerate(reader.bfc_features)
+            if (i, j) not in gaps
+        ]
+        # datapoints of other signals, not necessarily numbers, in between
+        datapoints.insert(3, ("program_name", "cylinder_bottom.mpf"))
+        messages.append(get_message(1671042595 + i, datapoints))
+    return messages
+
+
+def test_complete_messages(reader):
+    data = reader.read_raw_bfc("side_1", get_messages(reader, set()), TS_DATA)
+
+    assert data.columns.tolist() == ["id", "time", *reader.bfc_features]
+    assert len(data) == 25
+    assert not data.isna().any().any()
+    np.testing.assert_array_equal(data.time, (1671042595 + np.arange(25)) * 1e6)
+    # before the first process the messages go to the last one
+    assert data.id.astype(object).tolist() == (
+        ["side_1_face_milling"] * 5 + ["side_1_drilling"] * 10 + ["side_1_face_milling"] * 10
+    )
+    np.testing.assert_array_equal(
+        data[reader.bfc_features].to_numpy(),
+        10.0 * np.arange(25)[:, None] + np.arange(len(reader.bfc_features)),
+    )
+    features = reader.extract_bfc_features(data)
+    assert sorted(features.index) == ["side_1_drilling", "side_1_face_milling"]
+    assert features.loc["side_1_drilling", "aaCurr5__mean"] == 10.0 * np.arange(5, 15).mean()
+
+
+def test_missing_datapoints_are_nan(reader):
+    # the first and last column of a message, a middle column of two
+    # messages and a message without any datapoint
+    gaps = {(0, 0), (0, len(reader.bfc_features) - 1), (7, 5), (8, 5)}
+    gaps |= {(12, j) for j in range(len(reader.bfc_features))}
+    data = reader.read_raw_bfc("side_1", get_messages(reader, gaps), TS_DATA)
+
+    assert len(data) == 25
+    values = data[reader.bfc_features].to_numpy()
+    assert sorted(zip(*np.nonzero(np.isnan(values)))) == sorted(gaps)
+    expected = 10.0 * np.arange(25)[:, None] + np.arange(len(reader.bfc_features))
+    present = ~np.isnan(values)
+    np.testing.assert_array_equal(values[present], expected[present])
+    assert data.id.astype(object).tolist()[12] == "side_1_drilling"
+
+    # like tsfresh, the feature backends reject gaps instead of computing
+    # features of the values that are there
+    with pytest.raises(ValueError, match="NaN"):
+        reader.extract_bfc_features(data)
+    features = reader.extract_bfc_features(data.fillna(0))
+    assert features.loc["side_1_drilling", "aaCurr5__maximum"] == 140.0
+    assert features.loc["side_1_drilling", "aaCurr5__minimum"] == 0.0
+
+
+def test_no_messages(reader):
+    data = reader.read_raw_bfc("side_1", [], TS_DATA)
+    assert data.columns.tolist() == ["id", "time", *reader.bfc_features]
+    assert len(data) == 0
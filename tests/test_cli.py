@@ -0,0 +1,59 @@
+import pytest
+from interq_cip_qhs import cli, synthetic
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    pytest.importorskip("h5py")
+    return synthetic.generate_dataset(str(tmp_path), 1, acc_rows=5000, n_samples=20)
+
+
+def get_paths(generated, **paths):
+    return {
+        "dataset": generated["root"],
+        "process_data": generated["root"],
+        **{
+            name: generated[name]
+            for name in cli.get_config_paths()
+            if name.endswith("_quality_data")
+        },
+        **paths,
+    }
+
+
+def test_milling_jobs_only_with_a_dataset(dataset):
+    names = [job.name for job in cli.build_jobs(get_paths(dataset, dataset=None))]
+    assert "milling_process:index" not in names
+    assert "sawing_process:publish" in names and "milling_product:publish" in names
+    # the config path is the notebooks' example data, the pipeline doesn't use it
+    assert cli.get_config_paths()["dataset"] is None
+
+    names = [job.name for job in cli.build_jobs(get_paths(dataset))]
+    assert ["milling_process:index", "milling_process:publish"] == names[:2]
+
+
+def test_missing_and_nonexistent_paths(dataset, tmp_path):
+    with pytest.raises(ValueError, match="Missing path: dataset for milling_process"):
+        cli.build_jobs(get_paths(dataset, dataset=None), ["milling_process"])
+    with pytest.raises(ValueError, match="Path not found: .*nowhere"):
+        cli.build_jobs(get_paths(dataset, dataset=str(tmp_path / "nowhere")))
+
+
+def test_main_exits_on_nonexistent_path(tmp_path):
+    with pytest.raises(SystemExit) as error:
+        cli.main(["--dataset", str(tmp_path / "nowhere"), "--dry-run"])
+    assert error.value.code == 2
+
+
+@pytest.mark.parametrize(
+    "sizes, n_workers, shares",
+    [
+        ({"a": 100, "b": 1, "c": 1}, 8, {"a": 6, "b": 1, "c": 1}),
+        ({"a": 2, "b": 1, "c": 1}, 8, {"a": 4, "b": 2, "c": 2}),
+        ({"a": 0, "b": 0}, 3, {"a": 2, "b": 1}),
+        ({"a": 5, "b": 5, "c": 5}, 2, {"a": 1, "b": 1, "c": 1}),
+        ({}, 4, {}),
+    ],
+)
+def test_worker_shares(sizes, n_workers, shares):
+    assert cli.get_worker_shares(sizes, n_workers) == shares
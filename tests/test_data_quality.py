@@ -0,0 +1,186 @@
+import glob
+import io
+import json
+import os
+import tarfile
+import numpy as np
+import pandas as pd
+import pytest
+from interq_cip_qhs import synthetic
+from interq_cip_qhs.process import milling, sawing
+from interq_cip_qhs.process.data_quality import (
+    analyze_data_quality,
+    get_duplicate_records_qhd,
+    get_missing_values_qhd,
+)
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load_fixture(name):
+    # responses recorded in the notebooks, see tests/fixtures
+    with open(os.path.join(FIXTURES, name)) as f:
+        return json.load(f)
+
+
+def get_keys(document, prefix=()):
+    """Paths of all keys of a nested document."""
+    keys = set()
+    for key, value in document.items():
+        keys.add(prefix + (key,))
+        if isinstance(value, dict):
+            keys |= get_keys(value, prefix + (key,))
+    return keys
+
+
+def get_times(first, counts):
+    """Datetimes of consecutive seconds from first, counts[i] rows spread over second i."""
+    seconds = np.repeat(np.arange(len(counts)), counts)
+    fractions = np.concatenate([np.arange(count) / count for count in counts])
+    return pd.Series(pd.Timestamp(first) + pd.to_timedelta(seconds + fractions, unit="s"))
+
+
+@pytest.fixture
+def reader(tmp_path):
+    return sawing.SawingProcessData(str(tmp_path))
+
+
+def test_duplicate_records_matches_container():
+    expected = load_fixture("dqaas_duplicate_records_milling_126101.json")
+    # 314 distinct seconds from 10:23:58 to 10:40:57, all repetitions within the first one
+    counts = [780000 - 313] + [1] * 312
+    times = pd.concat(
+        [get_times("2023-04-24T10:23:58", counts), get_times("2023-04-24T10:40:57", [1])],
+        ignore_index=True,
+    )
+    qhd = get_duplicate_records_qhd(times, np.zeros(len(times)), "time", "acc_x", "+01:00")
+
+    assert set(qhd["qhd"]["qhd-header"]) == set(expected["qhd"]["qhd-header"])
+    assert get_keys(qhd["qhd"]["qhd-body"]) == get_keys(expected["qhd"]["qhd-body"])
+    body, expected_body = qhd["qhd"]["qhd-body"], expected["qhd"]["qhd-body"]
+    for field in ["kpi_actual", "kpi_required", "kpi_success", "start_time", "end_time"]:
+        assert body[field] == expected_body[field]
+    # rows within the same second are duplicates, the container sees whole seconds
+    assert body["exceptions"]["result"]["unexpected_count"] == 779686
+    assert body["exceptions"]["result"]["partial_unexpected_list"] == (
+        expected_body["exceptions"]["result"]["partial_unexpected_list"]
+    )
+    assert body == expected_body
+
+
+def test_duplicate_records_matches_recorded_sawing_document(reader):
+    expected = load_fixture("data_qh_duplicate_records_sawing_100102.json")
+    # two samples per second from 07:01:37 to 07:03:20, one in the last second
+    times = get_times("2022-08-16T07:01:37", [2] * 103 + [1])
+    qhd = get_duplicate_records_qhd(times, np.zeros(len(times)), "time", "P_Vorschub", "Z")
+
+    assert reader.reformatAtomicFields(qhd["qhd"]["qhd-body"]) == expected["qhd"]["qhd-body"]
+
+
+@pytest.mark.parametrize("part_id, n_missing", [("199000", 100000), ("124404", 0)])
+def test_missing_values_matches_recorded_milling_document(reader, part_id, n_missing):
+    expected = load_fixture("data_qh_missing_values_milling_" + part_id + ".json")
+    times = pd.Series(
+        pd.date_range("2022-12-14T14:20:23", "2022-12-14T14:39:48.999", periods=780000)
+    )
+    values = np.ones(len(times))
+    values[np.linspace(0, len(values) - 1, n_missing).astype(np.int64)] = np.nan
+    qhd = get_missing_values_qhd(times, values, "time", "acc_x", "+01:00")
+
+    assert reader.reformatAtomicFields(qhd["qhd"]["qhd-body"]) == expected["qhd"]["qhd-body"]
+
+
+class FakeResponse:
+    def __init__(self, obj):
+        self.content = json.dumps(obj).encode()
+
+
+class FakeContainer:
+    """Stands in for the DQaaS container, analyzes the uploaded csv with the local rules."""
+
+    def __init__(self):
+        self.files = {}
+
+    def put_archive(self, path, data):
+        archive = b"".join(data)
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            for member in tar.getmembers():
+                self.files[path + member.name] = tar.extractfile(member).read()
+
+    def exec_run(self, command):
+        self.files.pop(command[-1], None)
+
+    def get(self, url, params):
+        data = pd.read_csv(io.BytesIO(self.files["/app/data/" + params["file_name"]]))
+        strings = data[params["ts_column"]]
+        # the container reads the local clock time and keeps the offset for its lists
+        times = pd.to_datetime(strings.str[:19], format="%Y-%m-%dT%H:%M:%S")
+        return FakeResponse(
+            analyze_data_quality(
+                url,
+                times,
+                data[params["value_column_1"]],
+                params["ts_column"],
+                params["value_column_1"],
+                strings.iloc[0][19:],
+            )
+        )
+
+
+class FakeDockerClient:
+    def __init__(self, container):
+        self.containers = self
+        self.container = container
+
+    def get(self, name):
+        return self.container
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    for module in (milling, sawing):
+        monkeypatch.setattr(module.config, "FEATURE_STORE_PATH", None)
+    dataset = synthetic.generate_dataset(
+        str(tmp_path), 1, n_sawing_parts=1, acc_rows=5000, n_samples=60
+    )
+    # gaps in acc_x for the missing values rule
+    import h5py
+
+    pattern = os.path.join(str(tmp_path), "**", "*_external_sensor_signals.h5")
+    for path in glob.glob(pattern, recursive=True):
+        with h5py.File(path, "r+") as f:
+            f["data"][::7, 1] = np.nan
+    return dataset
+
+
+@pytest.mark.parametrize(
+    "process_class, fixture",
+    [
+        ("milling", "data_qh_missing_values_milling_199000.json"),
+        ("sawing", "data_qh_duplicate_records_sawing_100102.json"),
+    ],
+)
+def test_get_data_QH_id_local_and_container(dataset, monkeypatch, process_class, fixture):
+    import requests
+
+    expected = load_fixture(fixture)
+    container = FakeContainer()
+    monkeypatch.setattr(requests, "get", container.get)
+
+    documents = {}
+    for backend in ["local", "container"]:
+        if process_class == "milling":
+            reader = milling.MillingProcessData(dq_backend=backend, path_data=dataset["root"])
+        else:
+            reader = sawing.SawingProcessData(dataset["root"], dq_backend=backend)
+        reader._docker_client = FakeDockerClient(container)
+        part_id = reader.get_part_ids()[0]
+        documents[backend] = reader.get_data_QH_id(part_id, container_name="dqaas")
+
+    assert documents["local"]["qhd"]["qhd-body"]["exceptions"]["result"]["IND_unexpected_count"] > 0
+    assert documents["local"] == documents["container"]
+    assert not container.files
+    assert set(documents["local"]) == set(expected)
+    assert set(documents["local"]["qhd"]["qhd-header"]) == set(expected["qhd"]["qhd-header"])
+    assert get_keys(documents["local"]["qhd"]["qhd-body"]) == get_keys(expected["qhd"]["qhd-body"])
+
@@ -0,0 +1,96 @@
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+import pytest
+from interq_cip_qhs import synthetic
+from interq_cip_qhs.process import milling, sawing, turning
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+class FakeResponse:
+    def __init__(self, obj):
+        self.content = json.dumps(obj).encode()
+
+
+class FakeContainer:
+    """Stands in for the DQaaS container, keeps the uploaded files."""
+
+    def __init__(self):
+        self.uploads = []
+        self.containers = self
+
+    def get(self, name):
+        return self
+
+    def put_archive(self, path, data):
+        archive = data if isinstance(data, bytes) else b"".join(data)
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            for member in tar.getmembers():
+                self.uploads.append(tar.extractfile(member).read())
+
+    def exec_run(self, command):
+        pass
+
+
+@pytest.fixture
+def utc(monkeypatch):
+    # the timerefs are formatted in local time
+    monkeypatch.setenv("TZ", "UTC")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch, utc):
+    pytest.importorskip("h5py")
+    for module in (milling, sawing, turning):
+        monkeypatch.setattr(module.config, "FEATURE_STORE_PATH", None)
+        monkeypatch.setattr(module.config, "MANIFEST_FILE_NAME", None)
+    return synthetic.generate_dataset(str(tmp_path), 1, acc_rows=5000, n_samples=60)
+
+
+def get_reader(process_class, dataset, dq_backend):
+    if process_class == "milling":
+        return milling.MillingProcessData(dq_backend=dq_backend, path_data=dataset["root"])
+    if process_class == "sawing":
+        return sawing.SawingProcessData(dataset["root"], dq_backend=dq_backend)
+    return turning.TurningProcessData(dataset["root"], dq_backend=dq_backend)
+
+
+def to_json(document):
+    # as the publisher sends it
+    return json.loads(json.dumps(document, default=lambda value: value.item()))
+
+
+@pytest.mark.parametrize("process_class", ["milling", "sawing", "turning"])
+def test_documents_match_golden(dataset, monkeypatch, process_class):
+    """The documents and the data QH upload of the first synthetic part of
+    every process, as built before the timestamps were formatted in bulk."""
+    import requests
+
+    with open(os.path.join(FIXTURES, "golden_documents.json")) as f:
+        expected = json.load(f)[process_class]
+    id = dataset[process_class + "_ids"][0]
+
+    reader = get_reader(process_class, dataset, "local")
+    assert to_json(reader.get_process_QH_id(id)) == expected["process_qh"]
+    assert to_json(reader.get_data_QH_id(id)) == expected["data_qh"]
+
+    with open(os.path.join(FIXTURES, "dqaas_duplicate_records_milling_126101.json")) as f:
+        response = json.load(f)
+    monkeypatch.setattr(requests, "get", lambda url, params: FakeResponse(response))
+    reader = get_reader(process_class, dataset, "container")
+    reader._docker_client = FakeContainer()
+    reader.get_data_QH_id(id, container_name="dqaas")
+    upload = reader._docker_client.uploads[0]
+    lines = upload.decode().splitlines()
+    assert lines[:3] == expected["upload"]["head"]
+    assert lines[-2:] == expected["upload"]["tail"]
+    assert len(lines) == expected["upload"]["n_lines"]
+    assert hashlib.sha256(upload).hexdigest() == expected["upload"]["sha256"]
@@ -0,0 +1,68 @@
+import os
+import pandas as pd
+import pytest
+from interq_cip_qhs import synthetic
+from interq_cip_qhs.process import sawing, turning
+from interq_cip_qhs.process.feature_store import FeatureStore
+from interq_cip_qhs.process.hdf5 import close_part_files
+
+pytest.importorskip("h5py")
+
+READERS = {
+    "sawing": (sawing.SawingProcessData, synthetic.write_sawing_data),
+    "turning": (turning.TurningProcessData, synthetic.write_turning_data),
+}
+
+
+@pytest.fixture(params=sorted(READERS))
+def dataset(request, tmp_path, monkeypatch):
+    reader_class, write_data = READERS[request.param]
+    for module in (sawing, turning):
+        monkeypatch.setattr(
+            module.config, "FEATURE_STORE_PATH", str(tmp_path / "feature_store.sqlite")
+        )
+    path = str(tmp_path / "data")
+    os.makedirs(path)
+    write_data(path, ["101", "102"], n_samples=50, seed=0)
+    yield reader_class, write_data, path
+    close_part_files()
+
+
+def test_rewritten_part_is_recomputed(dataset):
+    reader_class, write_data, path = dataset
+    stored = reader_class(path).get_process_features("101")["features"]
+    assert reader_class(path).get_process_features("101")["features"].equals(stored)
+
+    close_part_files()
+    # same ids, shapes and sizes, other values
+    write_data(path, ["101", "102"], n_samples=50, seed=1)
+
+    reader = reader_class(path)
+    expected = reader.compute_process_features("101")["features"]
+    features = reader.get_process_features("101")["features"]
+    assert not features.equals(stored)
+    pd.testing.assert_frame_equal(features, expected)
+    pd.testing.assert_frame_equal(
+        reader.get_process_features_batch(["101"]).loc[["101"]].droplevel(0, axis=1),
+        expected.set_axis(["101"]),
+        check_names=False,
+    )
+
+
+def test_added_part_keeps_stored_features(dataset):
+    reader_class, write_data, path = dataset
+    reader = reader_class(path)
+    reader.get_process_features_batch(["101", "102"])
+
+    close_part_files()
+    write_data(path, ["101", "102", "103"], n_samples=50, seed=0)
+
+    store = FeatureStore(sawing.config.FEATURE_STORE_PATH)
+    reader = reader_class(path)
+    for id in ["101", "102"]:
+        assert store.get(
+            reader.process_class.split("_")[0],
+            id,
+            reader.feature_backend.feature_set,
+            reader.get_part_fingerprint(id),
+        ) is not None
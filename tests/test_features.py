@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+from interq_cip_qhs.process.features import NumpyFeatureBackend, TsfreshFeatureBackend
+from interq_cip_qhs.process.segmentation import get_id_column, get_segment_index, to_long_frame
+
+pytest.importorskip("tsfresh")
+
+
+def get_acc_frame():
+    # long (id, time, x, y, z) frame of consecutive process windows, as read_raw_acc builds it
+    rng = np.random.default_rng(0)
+    ids = ["process_3", "process_1", "process_2"]
+    lengths = np.array([50, 1, 37])
+    rows = np.column_stack(
+        [np.arange(lengths.sum()) * 1e-3, rng.normal(size=(lengths.sum(), 3)) * 100]
+    )
+    data = to_long_frame(ids, rows, lengths, ["time", "x", "y", "z"])
+    return data, get_segment_index(ids, lengths, rows[:, 0])
+
+
+def get_interleaved_frame():
+    # the ids come in more than one run of rows
+    rng = np.random.default_rng(1)
+    ids = np.array(["b", "a", "b", "c", "a", "c", "b"]).repeat([3, 5, 2, 4, 1, 6, 2])
+    return pd.DataFrame(
+        {"id": ids, "time": np.arange(len(ids), dtype=float), "value": rng.normal(size=len(ids))}
+    )
+
+
+def get_sawing_frame():
+    # long (id, kind, time, value) frame of one part, channel after channel, as load_raw_from_id builds it
+    rng = np.random.default_rng(2)
+    kinds = ["CPU_Kuehlwasser", "Vorschub", "Motorstrom"]
+    lengths = [40, 25, 31]
+    return pd.DataFrame(
+        {
+            "id": get_id_column(["17"], [sum(lengths)]),
+            "kind": get_id_column(kinds, lengths),
+            "time": np.concatenate([np.arange(length, dtype=float) for length in lengths]),
+            "value": rng.normal(size=sum(lengths)) * 10 + 5,
+        }
+    )
+
+
+def assert_same_features(features, expected):
+    assert list(features.columns) == list(expected.columns)
+    assert list(features.index) == sorted(features.index)
+    assert list(features.index) == list(expected.index)
+    np.testing.assert_allclose(
+        features.to_numpy(dtype=float), expected.to_numpy(dtype=float), rtol=1e-9, atol=0
+    )
+
+
+@pytest.fixture(scope="module")
+def tsfresh_backend():
+    return TsfreshFeatureBackend(n_jobs=0)
+
+
+def test_segmented_acc_frame(tsfresh_backend):
+    data, segments = get_acc_frame()
+    expected = tsfresh_backend.extract_features(data, column_id="id", column_sort="time")
+    backend = NumpyFeatureBackend()
+    assert_same_features(backend.extract_features(data, column_id="id", column_sort="time"), expected)
+    assert_same_features(
+        backend.extract_features(data, column_id="id", column_sort="time", segments=segments),
+        expected,
+    )
+
+
+def test_interleaved_ids(tsfresh_backend):
+    data = get_interleaved_frame()
+    expected = tsfresh_backend.extract_features(data, column_id="id", column_sort="time")
+    features = NumpyFeatureBackend().extract_features(data, column_id="id", column_sort="time")
+    assert_same_features(features, expected)
+
+
+def test_single_id_sawing_frame(tsfresh_backend):
+    data = get_sawing_frame()
+    kwargs = dict(column_id="id", column_sort="time", column_kind="kind", column_value="value")
+    expected = tsfresh_backend.extract_features(data, **kwargs)
+    assert_same_features(NumpyFeatureBackend().extract_features(data, **kwargs), expected)
+
+
+def test_nan_raises():
+    data = get_interleaved_frame()
+    data.loc[4, "value"] = np.nan
+    with pytest.raises(ValueError):
+        NumpyFeatureBackend().extract_features(data, column_id="id", column_sort="time")
+    data = get_sawing_frame()
+    data.loc[3, "value"] = np.nan
+    with pytest.raises(ValueError):
+        NumpyFeatureBackend().extract_features(
+            data, column_id="id", column_sort="time", column_kind="kind", column_value="value"
+        )
@@ -0,0 +1,95 @@
+import os
+import pytest
+from interq_cip_qhs import synthetic
+from interq_cip_qhs.process import sawing, turning
+from interq_cip_qhs.process.cache import file_fingerprint
+from interq_cip_qhs.process.hdf5 import close_part_files
+
+h5py = pytest.importorskip("h5py")
+
+READERS = {
+    "sawing": (sawing.SawingProcessData, synthetic.write_sawing_data),
+    "turning": (turning.TurningProcessData, synthetic.write_turning_data),
+}
+
+
+@pytest.fixture(params=sorted(READERS))
+def part_file(request, tmp_path):
+    reader_class, write_data = READERS[request.param]
+    write_data(str(tmp_path), ["101", "102", "103"], n_samples=50, seed=0)
+    yield reader_class, str(tmp_path), request.param + "_process_data.h5"
+    # the part files are shared by all readers of a path
+    close_part_files()
+
+
+def get_fingerprints(reader):
+    return reader._manifest.get_fingerprints(reader.process_class)
+
+
+def test_entries(part_file):
+    reader_class, path, file_name = part_file
+    reader = reader_class(path)
+
+    assert reader.get_part_ids() == ["101", "102", "103"]
+    entries = reader._manifest.get_entries(reader.process_class)
+    assert [entry["n_samples"] for entry in entries] == [50, 50, 50]
+    assert entries[0]["first_time"] == synthetic.START_TIME
+    assert entries[0]["last_time"] == synthetic.START_TIME + 49 * 0.5
+    assert len(set(get_fingerprints(reader).values())) == 3
+    # nothing is indexed while the file stays the same
+    assert reader.update_manifest() == 0
+    assert reader_class(path).update_manifest() == 0
+
+
+def test_rewritten_part_changes_its_fingerprint_only(part_file):
+    reader_class, path, file_name = part_file
+    reader = reader_class(path)
+    reader.update_manifest()
+    before = get_fingerprints(reader)
+
+    close_part_files()
+    # same shape and size, only the values change
+    with h5py.File(os.path.join(path, file_name), "r+") as f:
+        f["102"][...] = f["102"][...] + 1
+
+    assert reader.update_manifest() == 3
+    after = get_fingerprints(reader)
+    assert after["102"] != before["102"]
+    assert {key: after[key] for key in ["101", "103"]} == {
+        key: before[key] for key in ["101", "103"]
+    }
+    assert reader.get_part_fingerprint("102") == (os.path.join(path, file_name), after["102"])
+
+
+def test_added_and_removed_parts(part_file):
+    reader_class, path, file_name = part_file
+    reader = reader_class(path)
+    reader.update_manifest()
+    before = get_fingerprints(reader)
+
+    close_part_files()
+    with h5py.File(os.path.join(path, file_name), "r+") as f:
+        f.create_dataset("104", data=f["101"][...] * 2)
+        del f["103"]
+
+    reader.update_manifest()
+    after = get_fingerprints(reader)
+    assert sorted(after) == ["101", "102", "104"]
+    assert after["104"] != after["101"] == before["101"]
+    assert after["102"] == before["102"]
+
+
+def test_manifest_is_kept_next_to_the_data(part_file):
+    reader_class, path, file_name = part_file
+    reader_class(path).update_manifest()
+
+    assert os.path.exists(os.path.join(path, sawing.config.MANIFEST_FILE_NAME))
+    reader = reader_class(path)
+    assert reader._manifest.is_current(
+        reader.process_class,
+        os.path.join(path, file_name),
+        file_fingerprint([os.path.join(path, file_name)]),
+    )
+    assert reader._manifest.get_nbytes(reader.process_class) == sum(
+        entry["nbytes"] for entry in reader._manifest.get_entries(reader.process_class)
+    )
@@ -0,0 +1,132 @@
+import sqlite3
+import pytest
+from interq_cip_qhs.outbox import ACKNOWLEDGED, FAILED, PENDING, Outbox
+
+ENDPOINT = "http://qh/qhs"
+
+
+def get_subject(id):
+    return "part_id::" + str(id)
+
+
+class Source:
+    """Builds a document per id from its current version, counts the builds."""
+
+    def __init__(self):
+        self.versions = {}
+        self.built = []
+
+    def build(self, ids):
+        for id in ids:
+            self.built.append(id)
+            yield id, {"subject": get_subject(id), "version": self.versions.get(id, 0)}, None
+
+
+def post(outbox, source, ids, accepted=lambda id: True):
+    """One bulk run, returns the items it posted and the errors it got."""
+    posted, errors = [], []
+    for id, document, error in outbox.resume(ENDPOINT, ids, get_subject, source.build):
+        if error is not None:
+            errors.append((id, error))
+            continue
+        posted.append((id, document["version"]))
+        response = {"uuid": "u" + str(id)} if accepted(id) else {"message": "invalid"}
+        outbox.acknowledge(ENDPOINT, get_subject(id), response)
+    return posted, errors
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return Outbox(str(tmp_path / "outbox.sqlite"), verify=False, max_attempts=2)
+
+
+def test_acknowledged_subjects_are_skipped(outbox):
+    source = Source()
+    assert post(outbox, source, [1, 2, 3]) == ([(1, 0), (2, 0), (3, 0)], [])
+    assert outbox.get_status(ENDPOINT, get_subject(2)) == ACKNOWLEDGED
+
+    source.built.clear()
+    assert post(outbox, source, [1, 2, 3, 4]) == ([(4, 0)], [])
+    assert source.built == [4]
+    # other endpoints keep their own record
+    assert outbox.get_subjects("http://other/qhs") == set()
+
+
+def test_pending_documents_are_rebuilt(outbox):
+    source = Source()
+    # the run stops after the documents were stored, before they were answered
+    items = outbox.resume(ENDPOINT, [1, 2], get_subject, source.build)
+    assert [id for id, _, _ in items] == [1, 2]
+    assert outbox.get_status(ENDPOINT, get_subject(1)) == PENDING
+
+    source.versions[1] = 1
+    source.built.clear()
+    assert post(outbox, source, [1, 2]) == ([(1, 1), (2, 0)], [])
+    assert source.built == [1, 2]
+    assert outbox.get_content_hashes(ENDPOINT)[get_subject(1)][0] == ACKNOWLEDGED
+
+
+def test_rejected_documents_fail_after_max_attempts(outbox):
+    source = Source()
+    rejected = lambda id: id != 2
+    assert post(outbox, source, [1, 2, 3], rejected) == ([(1, 0), (2, 0), (3, 0)], [])
+    assert outbox.get_status(ENDPOINT, get_subject(2)) == FAILED
+
+    # the second attempt is built from the source again
+    source.versions[2] = 1
+    assert post(outbox, source, [1, 2, 3], rejected) == ([(2, 1)], [])
+    assert outbox.get_failed(ENDPOINT) == [
+        ("2", get_subject(2), 2, {"message": "invalid"})
+    ]
+
+    source.built.clear()
+    posted, errors = post(outbox, source, [1, 2, 3], rejected)
+    assert posted == [] and source.built == []
+    assert [id for id, _ in errors] == [2]
+    assert "Rejected document for subject: part_id::2 after 2 attempts" in str(errors[0][1])
+
+    outbox.clear(ENDPOINT, FAILED)
+    assert post(outbox, source, [1, 2, 3]) == ([(2, 1)], [])
+    assert outbox.get_failed(ENDPOINT) == []
+
+
+def test_verify_reports_changed_documents(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"), verify=True)
+    source = Source()
+    post(outbox, source, [1, 2])
+
+    source.versions[2] = 1
+    posted, errors = post(outbox, source, [1, 2])
+    assert posted == []
+    assert [(id, str(error)) for id, error in errors] == [
+        (2, "Changed document for acknowledged subject: part_id::2")
+    ]
+
+
+def test_outbox_without_attempts_column(tmp_path):
+    path = str(tmp_path / "outbox.sqlite")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE outbox (endpoint TEXT, subject TEXT, part_id TEXT, content_hash TEXT, "
+        "document TEXT, status TEXT, response TEXT, updated REAL, "
+        "PRIMARY KEY (endpoint, subject))"
+    )
+    connection.execute(
+        "INSERT INTO outbox VALUES (?, ?, '1', 'x', '{}', ?, NULL, 0)",
+        (ENDPOINT, get_subject(1), ACKNOWLEDGED),
+    )
+    connection.commit()
+    connection.close()
+
+    outbox = Outbox(path, max_attempts=1)
+    source = Source()
+    assert post(outbox, source, [1, 2], lambda id: False) == ([(2, 0)], [])
+    assert outbox.get_failed(ENDPOINT)[0][:3] == ("2", get_subject(2), 1)
+
+
+def test_disabled_outbox_builds_everything():
+    outbox = Outbox(None)
+    source = Source()
+    post(outbox, source, [1, 2])
+    assert post(outbox, source, [1, 2]) == ([(1, 0), (2, 0)], [])
+    assert outbox.get_failed(ENDPOINT) == []
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+from interq_cip_qhs import synthetic
+from interq_cip_qhs.process import sawing, turning
+from interq_cip_qhs.process.cache import PartDataCache, file_fingerprint
+from interq_cip_qhs.process.hdf5 import close_part_files
+
+
+def test_lru_bounded_by_bytes():
+    cache = PartDataCache(max_bytes=2000)
+    for key in "abc":
+        cache.put(key, 1, np.zeros(100))
+    # 800 bytes each, the least recently used goes first
+    assert cache.get("a", 1) is None
+    assert cache.get("b", 1) is not None
+    cache.put("d", 1, np.zeros(100))
+    assert cache.get("c", 1) is None
+    assert cache.get("b", 1) is not None
+    assert cache.nbytes == 1600
+    cache.put("e", 1, np.zeros(1000))
+    assert cache.get("e", 1) is None and len(cache) == 2
+
+
+def test_changed_fingerprint_reloads():
+    cache = PartDataCache()
+    loads = []
+
+    def load(value):
+        loads.append(value)
+        return np.full(3, value)
+
+    assert cache.get_or_load("a", 1, lambda: load(1))[0] == 1
+    assert cache.get_or_load("a", 1, lambda: load(2))[0] == 1
+    assert cache.get_or_load("a", 2, lambda: load(2))[0] == 2
+    assert loads == [1, 2]
+
+
+def test_file_fingerprint(tmp_path):
+    path = tmp_path / "part.csv"
+    path.write_text("a")
+    fingerprint = file_fingerprint([path])
+    assert file_fingerprint([path]) == fingerprint
+    path.write_text("ab")
+    assert file_fingerprint([path]) != fingerprint
+
+
+@pytest.mark.parametrize(
+    "reader_class, write_data, read",
+    [
+        (sawing.SawingProcessData, synthetic.write_sawing_data, "read_raw_long_from_id"),
+        (turning.TurningProcessData, synthetic.write_turning_data, "read_raw_from_id"),
+    ],
+)
+def test_rewritten_part_is_reloaded(tmp_path, reader_class, write_data, read):
+    pytest.importorskip("h5py")
+    path = str(tmp_path)
+    write_data(path, ["101", "102"], n_samples=50, seed=0)
+    reader = reader_class(path)
+    try:
+        before = getattr(reader, read)("101")
+        assert getattr(reader, read)("101") is before
+
+        close_part_files()
+        write_data(path, ["101", "102"], n_samples=50, seed=1)
+
+        # the same reader, its cache still holds the old frame
+        after = getattr(reader, read)("101")
+        assert not after.equals(before)
+        pd.testing.assert_frame_equal(after, reader.load_raw_from_id("101"))
+    finally:
+        close_part_files()
@@ -0,0 +1,69 @@
+import threading
+import time
+from http.server import ThreadingHTTPServer
+import pytest
+from interq_cip_qhs.benchmark import QHStandInHandler
+from interq_cip_qhs.publisher import QHPublisher
+
+pytest.importorskip("requests")
+
+
+class SlowHandler(QHStandInHandler):
+    """Answers after a short delay and records the most requests open at once."""
+
+    lock = threading.Lock()
+    open_requests = 0
+    max_open_requests = 0
+
+    def do_POST(self):
+        with self.lock:
+            SlowHandler.open_requests += 1
+            SlowHandler.max_open_requests = max(
+                SlowHandler.max_open_requests, SlowHandler.open_requests
+            )
+        time.sleep(0.02)
+        with self.lock:
+            SlowHandler.open_requests -= 1
+        super().do_POST()
+
+
+@pytest.fixture
+def api_endpoint():
+    SlowHandler.max_open_requests = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:%d/qhs" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_post_many_share_max_in_flight(api_endpoint):
+    publisher = QHPublisher(api_endpoint, max_in_flight=3, max_latencies=10)
+    results = {}
+
+    def post_all(job):
+        items = [((job, i), {"qhd": i}, None) for i in range(12)]
+        results[job] = list(publisher.post_many(items))
+
+    threads = [threading.Thread(target=post_all, args=(job,)) for job in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert SlowHandler.max_open_requests <= 3
+    for job in range(3):
+        assert sorted(key for key, _, _ in results[job]) == [(job, i) for i in range(12)]
+        assert all(error is None and "uuid" in response for _, response, error in results[job])
+    # only the last latencies are kept, all requests are counted
+    assert len(publisher.latencies) == 10
+    assert publisher.get_latency_summary()["count"] == 36
+
+
+def test_errors_are_passed_through(api_endpoint):
+    publisher = QHPublisher(api_endpoint, max_in_flight=2)
+    error = ValueError("failed to build")
+    results = list(publisher.post_many([("a", None, error), ("b", {"qhd": 1}, None)]))
+
+    assert ("a", None, error) in results
+    assert [key for key, response, error in results if error is None] == ["b"]
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+import pytest
+from interq_cip_qhs.process import milling
+from interq_cip_qhs.process.hdf5 import LazySignalFile
+from interq_cip_qhs.process.segmentation import (
+    get_segment_index,
+    index_segments,
+    split_segments,
+    to_long_frame,
+)
+
+
+def reference_segments(data, timestamps, fill_empty=False):
+    # one mask per window, as read_raw_acc and new_read_raw_bfc did before
+    segments = []
+    for i in range(len(timestamps)):
+        if i < len(timestamps) - 1:
+            rows = data[(data[:, 0] >= timestamps[i]) & (data[:, 0] < timestamps[i + 1])]
+        else:
+            rows = data[data[:, 0] >= timestamps[i]]
+        if fill_empty and len(rows) == 0:
+            rows = np.zeros((1, data.shape[1]))
+        segments.append(rows)
+    return segments
+
+
+def reference_frame(ids, segments, columns):
+    data = pd.DataFrame(columns=["id", *columns])
+    for id, rows in zip(ids, segments):
+        frame = pd.DataFrame({"id": [id] * len(rows)})
+        for i, column in enumerate(columns):
+            frame[column] = rows[:, i]
+        data = pd.concat([data, frame])
+    return data
+
+
+def get_data(order="sorted", seed=0):
+    rng = np.random.default_rng(seed)
+    times = np.arange(200, dtype=float)
+    if order == "shuffled":
+        times = rng.permutation(times)
+    elif order == "nan":
+        times[[5, 50, 120]] = np.nan
+    return np.column_stack([times, rng.normal(size=(200, 3))])
+
+
+# windows on row times, between them, before and after all rows, and empty ones
+TIMESTAMPS = {
+    "on rows": np.array([10.0, 20.0, 50.0, 199.0]),
+    "between rows": np.array([-5.5, 0.5, 99.5, 150.25]),
+    "empty windows": np.array([10.0, 10.0, 10.5, 30.0, 30.0, 250.0, 300.0]),
+    "single": np.array([0.0]),
+    "none": np.array([]),
+}
+
+
+@pytest.mark.parametrize("order", ["sorted", "shuffled", "nan"])
+@pytest.mark.parametrize("timestamps", sorted(TIMESTAMPS))
+@pytest.mark.parametrize("fill_empty", [False, True])
+def test_split_segments_matches_masks(order, timestamps, fill_empty):
+    data = get_data(order)
+    timestamps = TIMESTAMPS[timestamps]
+    expected = reference_segments(data, timestamps, fill_empty)
+
+    rows, lengths = split_segments(data, timestamps, fill_empty)
+    assert lengths.tolist() == [len(segment) for segment in expected]
+    offsets = np.cumsum(lengths) - lengths
+    for segment, offset, length in zip(expected, offsets, lengths):
+        # rows keep their order within a window
+        np.testing.assert_array_equal(rows[offset : offset + length], segment)
+
+
+@pytest.mark.parametrize("order", ["sorted", "shuffled", "nan"])
+@pytest.mark.parametrize("timestamps", ["on rows", "empty windows"])
+def test_long_frame_matches_concat(order, timestamps):
+    data = get_data(order)
+    timestamps = TIMESTAMPS[timestamps]
+    ids = ["process_" + str(i) for i in range(len(timestamps))]
+    columns = ["time", "x", "y", "z"]
+    expected = reference_frame(ids, reference_segments(data, timestamps), columns)
+
+    rows, lengths = split_segments(data, timestamps)
+    frame = to_long_frame(ids, rows, lengths, columns)
+    assert frame.id.astype(object).tolist() == expected.id.tolist()
+    assert frame.index.tolist() == expected.index.tolist()
+    np.testing.assert_array_equal(
+        frame[columns].to_numpy(), expected[columns].to_numpy(dtype=float)
+    )
+    segments = index_segments(frame)
+    non_empty = [id for id, length in zip(ids, lengths) if length]
+    assert segments.index.tolist() == non_empty
+    pd.testing.assert_frame_equal(
+        segments, get_segment_index(ids, lengths, rows[:, 0]).loc[non_empty]
+    )
+
+
+def test_milling_readers_match_masks(tmp_path):
+    reader = milling.MillingProcessData(path_data=str(tmp_path))
+    # keys are seconds, acc times microseconds and bfc times seconds
+    ts_data = {"30.0": "drilling", "10.0": "face_milling", "10.5": "idle", "250.0": "deburring"}
+    timestamps = np.array([10.0, 10.5, 30.0, 250.0])
+    ids = ["side_1_" + process for process in ["face_milling", "idle", "drilling", "deburring"]]
+    acc_data = get_data()
+    acc_data[:, 0] *= 1e6
+    bfc_data = np.column_stack(
+        [np.arange(0, 200, 0.25), np.ones((800, len(reader.bfc_features)))]
+    )
+
+    acc = reader.read_raw_acc("side_1", acc_data, ts_data)
+    expected = reference_frame(
+        ids,
+        reference_segments(acc_data, timestamps * 1e6),
+        ["time", *reader.acc_features],
+    )
+    assert acc.id.astype(object).tolist() == expected.id.tolist()
+    np.testing.assert_array_equal(
+        acc.iloc[:, 1:].to_numpy(), expected.iloc[:, 1:].to_numpy(dtype=float)
+    )
+
+    bfc = reader.new_read_raw_bfc("side_1", bfc_data, ts_data)
+    expected = reference_frame(
+        ids,
+        reference_segments(bfc_data, timestamps, fill_empty=True),
+        ["time", *reader.bfc_features],
+    )
+    assert bfc.id.astype(object).tolist() == expected.id.tolist()
+    np.testing.assert_array_equal(
+        bfc.iloc[:, 1:].to_numpy(), expected.iloc[:, 1:].to_numpy(dtype=float)
+    )
+    # the last window starts after the last row and gets the row of zeros
+    assert bfc[bfc.id == "side_1_deburring"].iloc[:, 1:].to_numpy().tolist() == [
+        [0.0] * (len(reader.bfc_features) + 1)
+    ]
+
+
+@pytest.mark.parametrize("order", ["sorted", "shuffled"])
+@pytest.mark.parametrize("timestamps", ["on rows", "between rows", "empty windows"])
+def test_read_windows_matches_masks(tmp_path, order, timestamps):
+    h5py = pytest.importorskip("h5py")
+    data = get_data(order)
+    timestamps = TIMESTAMPS[timestamps]
+    path = str(tmp_path / "signal.h5")
+    with h5py.File(path, "w") as f:
+        f.create_dataset("data", data=data, chunks=(16, 4))
+
+    windows = [i for i in range(len(timestamps)) if i % 2 == 0]
+    expected = reference_segments(data[:, :3], timestamps, fill_empty=True)
+    with LazySignalFile(path) as signal_file:
+        rows, lengths = signal_file.read_windows(timestamps, windows, 3, fill_empty=True)
+    assert lengths.tolist() == [len(expected[i]) for i in windows]
+    np.testing.assert_array_equal(rows, np.concatenate([expected[i] for i in windows]))
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+from interq_cip_qhs import synthetic
+from interq_cip_qhs.process import milling, streaming
+from interq_cip_qhs.process.features import MINIMAL_FEATURES, NumpyFeatureBackend
+from interq_cip_qhs.process.streaming import RunningStatistics, stream_process_QH
+
+
+@pytest.fixture
+def reader(tmp_path, monkeypatch):
+    pytest.importorskip("h5py")
+    monkeypatch.setattr(milling.config, "FEATURE_STORE_PATH", None)
+    monkeypatch.setattr(milling.config, "MANIFEST_FILE_NAME", None)
+    synthetic.write_milling_part(str(tmp_path), 1, acc_rows=40000, seed=3)
+    return milling.MillingProcessData(path_data=str(tmp_path))
+
+
+def get_events(reader, part_id, chunk=3000):
+    """The part folder as a live stream, acc chunks with the bfc rows up to
+    their last sample in between."""
+    import h5py
+
+    path = reader._part_id_paths[part_id]
+    for side in ["side_1", "side_2"]:
+        ts_path, acc_path = reader.get_side_files(path, side, "acc")
+        _, bfc_path = reader.get_side_files(path, side, "bfc")
+        for timestamp, process in reader.read_timestamp_process_pairs(ts_path).items():
+            yield part_id, "process_start", side, (timestamp, process)
+        with h5py.File(acc_path) as f:
+            acc = f["data"][:]
+        with h5py.File(bfc_path) as f:
+            bfc = f["data"][:]
+        sent = 0
+        for start in range(0, len(acc), chunk):
+            yield part_id, "acc", side, acc[start : start + chunk]
+            end = np.searchsorted(bfc[:, 0], acc[start : start + chunk, 0].max() / 1e6, "right")
+            if end > sent:
+                yield part_id, "bfc", side, bfc[sent:end]
+                sent = end
+        if sent < len(bfc):
+            yield part_id, "bfc", side, bfc[sent:]
+    yield part_id, "part_end", None, None
+
+
+def get_body(document):
+    return {
+        (process, signal, feature): value
+        for process, signals in document["qhd"]["qhd-body"].items()
+        for signal, features in signals.items()
+        for feature, value in features.items()
+    }
+
+
+def test_running_statistics_match_batch():
+    rng = np.random.default_rng(0)
+    values = rng.normal(3.0, 2.0, size=(3000, 3))
+    values[[4, 400, 2999], 1] = np.nan
+    values[:, 2] = np.nan
+    statistics = RunningStatistics(3, max_samples=3000)
+    for chunk in np.array_split(values, 17):
+        statistics.update(chunk)
+    result = statistics.get_statistics()
+
+    for column in range(2):
+        column_values = values[:, column][~np.isnan(values[:, column])]
+        expected = NumpyFeatureBackend().get_statistics(column_values[:, None], np.array([0]))
+        np.testing.assert_allclose(result[column], expected.ravel(), rtol=1e-12)
+    assert np.isnan(result[2]).all()
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_sampled_median_within_tolerance(seed):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=(200000, 1)) + np.sin(np.arange(200000) / 50.0)[:, None]
+    statistics = RunningStatistics(1, max_samples=4096)
+    for chunk in np.array_split(values, 61):
+        statistics.update(chunk)
+    assert len(statistics.samples) <= 4096
+    median = statistics.get_statistics()[0, MINIMAL_FEATURES.index("median")]
+    # the documented tolerance of the default sample size
+    assert abs(median - np.median(values)) < 0.03 * values.std()
+
+
+def test_stream_matches_part_folder(reader, monkeypatch):
+    part_id = sorted(reader._part_id_paths)[0]
+    batch = reader.get_process_QH_id(part_id)
+
+    # every process fits into the sample, all features are exact
+    monkeypatch.setattr(streaming.config, "STREAM_MEDIAN_SAMPLES", 40000)
+    [(id, document)] = stream_process_QH(reader, get_events(reader, part_id))
+    assert id == part_id
+    header, batch_header = document["qhd"]["qhd-header"], batch["qhd"]["qhd-header"]
+    assert header["subject"] == batch_header["subject"] + ",mode::stream"
+    assert header["subject"] == reader.get_process_QH_stream_subject(part_id)
+    assert {key: header[key] for key in header if key != "subject"} == {
+        key: batch_header[key] for key in batch_header if key != "subject"
+    }
+    body, batch_body = get_body(document), get_body(batch)
+    assert body.keys() == batch_body.keys()
+    for key, value in batch_body.items():
+        assert body[key] == pytest.approx(value, rel=1e-9, abs=1e-9), key
+
+    # with the default sample size only the medians of the acc processes
+    # differ, within the documented tolerance
+    monkeypatch.setattr(streaming.config, "STREAM_MEDIAN_SAMPLES", 4096)
+    [(_, document)] = stream_process_QH(reader, get_events(reader, part_id))
+    body = get_body(document)
+    for (process, signal, feature), value in batch_body.items():
+        if not feature.endswith("__median"):
+            assert body[process, signal, feature] == pytest.approx(value, rel=1e-9, abs=1e-9)
+            continue
+        deviation = batch_body[process, signal, feature.replace("median", "standard_deviation")]
+        assert abs(body[process, signal, feature] - value) <= 0.03 * deviation + 1e-9